@@ -21,7 +21,12 @@ SCRIPTS_DIR = (
     os.path.join(PosixPath(__file__).absolute().parents[1].as_posix(), 'scripts')
 )
 
-from . import tokenizers
-from . import reader
-from . import retriever
-from . import pipeline
+# Subpackages are imported on first access, so that e.g. a retriever-only
+# script does not pay for loading torch.
+from .common.lazy import lazy_import
+lazy_import(__name__, {
+    'tokenizers': ('.tokenizers', None),
+    'reader': ('.reader', None),
+    'retriever': ('.retriever', None),
+    'pipeline': ('.pipeline', None),
+})
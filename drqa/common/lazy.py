@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""On-demand loading of package attributes.
+
+Lets a package expose its submodules and classes (e.g. drqa.reader.DocReader)
+without importing them, and their heavy dependencies (torch, cove, sklearn,
+pexpect), until they are first accessed.
+"""
+
+import sys
+import types
+import importlib
+
+
+class LazyModule(types.ModuleType):
+    """Module type that imports registered attributes on first access."""
+
+    def __getattr__(self, name):
+        lazy_attrs = self.__dict__.get('_lazy_attrs', {})
+        if name not in lazy_attrs:
+            raise AttributeError('module %r has no attribute %r' %
+                                 (self.__name__, name))
+        module_name, attr = lazy_attrs[name]
+        module = importlib.import_module(module_name, self.__name__)
+        value = module if attr is None else getattr(module, attr)
+        # Cache it so that __getattr__ is not hit again.
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(super(LazyModule, self).__dir__()) |
+                      set(self.__dict__.get('_lazy_attrs', {})))
+
+
+def lazy_import(module_name, attrs):
+    """Register attributes of a module to be imported on first access.
+
+    Args:
+        module_name: name of the module to patch (usually __name__).
+        attrs: dict of attribute name --> (module, attribute). Relative module
+          names resolve against module_name. If attribute is None, the module
+          itself is the value.
+    """
+    module = sys.modules[module_name]
+    lazy_attrs = module.__dict__.setdefault('_lazy_attrs', {})
+    lazy_attrs.update(attrs)
+    module.__class__ = LazyModule
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Metrics and request tracing for the DrQA pipeline.
+
+Two process-wide registries, both disabled by default (and then close to
+free to call):
+    - METRICS: counters and histograms (e.g. stage latencies), optionally
+      labeled. Exported as a JSON object (one line per snapshot) or in the
+      Prometheus text format.
+    - TRACER: timed spans of individual queries, keyed by a trace id per
+      query, including jobs run by pool workers (with their pid). Exported
+      as JSON lines, one span per line.
+
+    from drqa.common import metrics
+    metrics.enable(tracing=True)
+    ...
+    metrics.METRICS.write_prometheus('metrics.prom')
+"""
+
+import os
+import time
+import json
+import uuid
+import threading
+
+from collections import deque
+
+# Upper bounds (seconds) of latency histogram buckets.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class Histogram(object):
+    """Cumulative bucket counts, sum and count of observed values."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile (upper bound of the bucket it falls in)."""
+        if self.count == 0:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def as_dict(self):
+        cumulative, total = [], 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'],
+                                cumulative)),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.end = time.time()
+        self.metrics.observe(self.name, self.end - self.start, **self.labels)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Metrics(object):
+    """Registry of named (and optionally labeled) counters and histograms."""
+
+    def __init__(self, enabled=False, prefix='drqa'):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def count(self, name, value=1, **labels):
+        """Increment counter name by value."""
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Add a value to histogram name."""
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def timer(self, name, **labels):
+        """Context manager observing its duration (seconds) in histogram
+        name. The timer keeps start and end (unless disabled).
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    # --------------------------------------------------------------------------
+    # Export.
+    # --------------------------------------------------------------------------
+
+    def snapshot(self):
+        """All values as a JSON-serializable dict."""
+        def name(key):
+            if not key[1]:
+                return key[0]
+            return '%s{%s}' % (key[0], ','.join('%s=%s' % l for l in key[1]))
+
+        with self.lock:
+            return {
+                'time': time.time(),
+                'counters': {name(k): v for k, v in
+                             sorted(self.counters.items())},
+                'histograms': {name(k): h.as_dict() for k, h in
+                               sorted(self.histograms.items())},
+            }
+
+    def write_json(self, path):
+        """Append a snapshot to path, as one JSON line."""
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.snapshot()) + '\n')
+
+    def prometheus(self):
+        """All values in the Prometheus text exposition format."""
+        def labels(pairs):
+            if not pairs:
+                return ''
+            return '{%s}' % ','.join('%s="%s"' % (k, v) for k, v in pairs)
+
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+            typed = set()
+            for (name, pairs), value in counters:
+                metric = '%s_%s' % (self.prefix, name)
+                if metric not in typed:
+                    lines.append('# TYPE %s counter' % metric)
+                    typed.add(metric)
+                lines.append('%s%s %s' % (metric, labels(pairs), value))
+            for (name, pairs), hist in histograms:
+                metric = '%s_%s' % (self.prefix, name)
+                if metric not in typed:
+                    lines.append('# TYPE %s histogram' % metric)
+                    typed.add(metric)
+                total = 0
+                bounds = [str(b) for b in hist.buckets] + ['+Inf']
+                for bound, count in zip(bounds, hist.counts):
+                    total += count
+                    lines.append('%s_bucket%s %d' % (
+                        metric, labels(pairs + (('le', bound),)), total
+                    ))
+                lines.append('%s_sum%s %s' % (metric, labels(pairs), hist.sum))
+                lines.append('%s_count%s %d' %
+                             (metric, labels(pairs), hist.count))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        with open(path, 'w') as f:
+            f.write(self.prometheus())
+
+
+class Tracer(object):
+    """Recorder of timed spans, per query trace id."""
+
+    def __init__(self, enabled=False, max_spans=1000000):
+        self.enabled = enabled
+        self.spans = deque(maxlen=max_spans)
+
+    def new_ids(self, n):
+        """n new trace ids (None if disabled)."""
+        if not self.enabled:
+            return [None] * n
+        return [uuid.uuid4().hex[:16] for _ in range(n)]
+
+    def add(self, trace_ids, name, start, end, pid=None, **attrs):
+        """Record a span (start and end are time.time() values) shared by
+        the queries of trace_ids.
+        """
+        if not self.enabled:
+            return
+        pid = pid or os.getpid()
+        for trace_id in trace_ids:
+            span = {'trace_id': trace_id, 'name': name, 'start': start,
+                    'end': end, 'duration': end - start, 'pid': pid}
+            if attrs:
+                span.update(attrs)
+            self.spans.append(span)
+
+    def write_json(self, path):
+        """Append the recorded spans to path, one JSON line each (and forget
+        them).
+        """
+        with open(path, 'a') as f:
+            while self.spans:
+                f.write(json.dumps(self.spans.popleft()) + '\n')
+
+
+METRICS = Metrics()
+TRACER = Tracer()
+
+
+def enable(metrics=True, tracing=False):
+    """Turn the process-wide metrics and/or tracing on (or off)."""
+    METRICS.enabled = metrics
+    TRACER.enabled = tracing
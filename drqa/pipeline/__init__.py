@@ -24,4 +24,10 @@ def set_default(key, value):
     DEFAULTS[key] = value
 
 
-from .drqa import DrQA
+from ..common.lazy import lazy_import
+lazy_import(__name__, {
+    'DrQA': ('.drqa', 'DrQA'),
+    'ParagraphFilter': ('.prefilter', 'ParagraphFilter'),
+    'RequestBatcher': ('.batcher', 'RequestBatcher'),
+    'PipelinedDrQA': ('.pipelined', 'PipelinedDrQA'),
+})
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Dynamic batching of concurrent queries in front of DrQA.process_batch.
+
+Callers (e.g. the threads of a server) submit single queries. A background
+thread collects them and runs them through process_batch together, once
+max_batch_size queries are waiting or the oldest one has waited max_wait
+seconds, so that concurrent queries share retrieval and reader batches.
+Each caller gets its own predictions back.
+"""
+
+import time
+import queue
+import logging
+import threading
+import numpy as np
+
+from collections import deque, Counter
+from concurrent.futures import Future
+
+from ..common.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class _Request(object):
+
+    def __init__(self, query, candidates, top_n, n_docs, return_context):
+        self.query = query
+        self.candidates = candidates
+        self.top_n = top_n
+        # Queries can only share a process_batch call with the same options.
+        self.key = (n_docs, return_context, candidates is not None)
+        self.future = Future()
+        self.arrival = time.time()
+
+
+class RequestBatcher(object):
+    """Queue single queries and flush them into DrQA.process_batch."""
+
+    def __init__(self, drqa, max_batch_size=32, max_wait=0.01,
+                 history=10000):
+        """
+        Args:
+            drqa: the DrQA pipeline.
+            max_batch_size: max number of queries per process_batch call.
+            max_wait: max seconds a query waits for others to join it.
+            history: number of latest requests to compute latencies over.
+        """
+        self.drqa = drqa
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.latencies = deque(maxlen=history)
+        self.batch_sizes = Counter()
+        self.num_requests = 0
+        self.max_depth = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, query, candidates=None, top_n=1, n_docs=5,
+               return_context=False):
+        """Queue a query (see DrQA.process).
+
+        Output:
+            concurrent.futures.Future of its predictions.
+        """
+        request = _Request(query, candidates, top_n, n_docs, return_context)
+        self.requests.put(request)
+        with self.lock:
+            self.max_depth = max(self.max_depth, self.requests.qsize())
+        return request.future
+
+    def process(self, query, candidates=None, top_n=1, n_docs=5,
+                return_context=False):
+        """Run a single query (blocking), batched with concurrent ones."""
+        return self.submit(
+            query, candidates, top_n, n_docs, return_context
+        ).result()
+
+    def _collect(self):
+        """Block for a first request, then gather more until the batch is
+        full or the first one's deadline has passed.
+        """
+        request = self.requests.get()
+        if request is None:
+            return None
+        batch = [request]
+        deadline = request.arrival + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    request = self.requests.get(timeout=timeout)
+                else:
+                    request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self.requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+            groups = {}
+            for request in batch:
+                groups.setdefault(request.key, []).append(request)
+            for (n_docs, return_context, has_cands), requests in \
+                    groups.items():
+                self._flush(requests, n_docs, return_context, has_cands)
+
+    def _flush(self, requests, n_docs, return_context, has_cands):
+        top_n = max(r.top_n for r in requests)
+        try:
+            predictions = self.drqa.process_batch(
+                [r.query for r in requests],
+                [r.candidates for r in requests] if has_cands else None,
+                top_n=top_n, n_docs=n_docs, return_context=return_context
+            )
+        except Exception as e:
+            logger.exception('Batch of %d queries failed' % len(requests))
+            for r in requests:
+                r.future.set_exception(e)
+            return
+        done = time.time()
+        with self.lock:
+            self.batch_sizes[len(requests)] += 1
+            self.num_requests += len(requests)
+            self.latencies.extend(done - r.arrival for r in requests)
+        for r in requests:
+            METRICS.observe('request_seconds', done - r.arrival)
+        for r, p in zip(requests, predictions):
+            r.future.set_result(p[:r.top_n])
+
+    def stats(self):
+        """Queue depth, batch size distribution and latency percentiles
+        (seconds, over the latest requests).
+        """
+        with self.lock:
+            latencies = list(self.latencies)
+            stats = {
+                'requests': self.num_requests,
+                'queue_depth': self.requests.qsize(),
+                'max_queue_depth': self.max_depth,
+                'batch_sizes': dict(sorted(self.batch_sizes.items())),
+            }
+        if latencies:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            stats['latency'] = {'p50': float(p50), 'p95': float(p95),
+                                'p99': float(p99),
+                                'mean': float(np.mean(latencies))}
+        return stats
+
+    def close(self):
+        """Stop the batching thread (after pending queries)."""
+        self.requests.put(None)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -9,18 +9,25 @@
 import torch
 import regex
 import heapq
+import itertools
 import math
 import time
 import logging
 
+from collections import deque
+from functools import partial
 from multiprocessing import Pool as ProcessPool
 from multiprocessing.util import Finalize
 
-from ..reader.vector import batchify
+from ..reader.vector import batchify, vectorize
 from ..reader.data import ReaderDataset, SortedBatchSampler
+from ..reader.data import TokenBudgetBatchSampler, log_padding_efficiency
 from .. import reader
 from .. import tokenizers
+from ..tokenizers.scheduler import timed_call
+from ..common.metrics import METRICS, TRACER
 from . import DEFAULTS
+from .prefilter import ParagraphFilter
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +50,11 @@ def init(tokenizer_class, tokenizer_opts, db_class, db_opts, candidates=None):
     PROCESS_CANDS = candidates
 
 
+def init_candidates(candidates):
+    global PROCESS_CANDS
+    PROCESS_CANDS = candidates
+
+
 def fetch_text(doc_id):
     global PROCESS_DB
     return PROCESS_DB.get_doc_text(doc_id)
@@ -53,16 +65,115 @@ def tokenize_text(text):
     return PROCESS_TOK.tokenize(text)
 
 
+# ------------------------------------------------------------------------------
+# Packing paragraphs into passages
+# ------------------------------------------------------------------------------
+
+
+def pack_paragraphs(lengths, max_tokens=0, overlap=0):
+    """Group the paragraphs of a document into passages for the reader.
+
+    Adjacent paragraphs are packed together while their total number of tokens
+    fits in max_tokens. Paragraphs longer than that are read in windows of
+    max_tokens, overlapping by overlap tokens. If max_tokens is 0, every
+    paragraph is a passage. Empty paragraphs are skipped.
+
+    Args:
+        lengths: number of tokens of each paragraph.
+    Output:
+        passages: lists of (paragraph index, start, end) token ranges.
+    """
+    if 0 < max_tokens <= overlap:
+        raise RuntimeError('Window overlap (%d) must be smaller than the '
+                           'passage size (%d).' % (overlap, max_tokens))
+    passages = []
+    passage, size = [], 0
+    for i, length in enumerate(lengths):
+        if length == 0:
+            continue
+        if not max_tokens:
+            passages.append([(i, 0, length)])
+            continue
+        if size + length > max_tokens and passage:
+            passages.append(passage)
+            passage, size = [], 0
+        if length <= max_tokens:
+            passage.append((i, 0, length))
+            size += length
+            continue
+        stride = max_tokens - overlap
+        start = 0
+        while True:
+            end = min(start + max_tokens, length)
+            passages.append([(i, start, end)])
+            if end == length:
+                break
+            start += stride
+    if passage:
+        passages.append(passage)
+    return passages
+
+
+def join_tokens(pieces):
+    """Concatenate (Tokens, start, end) pieces into a single Tokens."""
+    if len(pieces) == 1:
+        tokens, start, end = pieces[0]
+        if start == 0 and end == len(tokens):
+            return tokens
+        return tokens.slice(start, end)
+    data = []
+    for tokens, start, end in pieces:
+        data.extend(tokens.data[start:end])
+        # Keep a space between pieces (for untokenize and candidates).
+        last = data[-1]
+        if not last[tokens.TEXT_WS][-1:].isspace():
+            data[-1] = last[:tokens.TEXT_WS] + \
+                (last[tokens.TEXT_WS] + ' ',) + last[tokens.TEXT_WS + 1:]
+    tokens = pieces[0][0]
+    return tokens.__class__(data, tokens.annotators, tokens.opts)
+
+
+def locate_span(passage, start, end):
+    """Map the token span [start, end] of a passage to (paragraph, start, end)
+    in its paragraph. A span running over the end of the paragraph it starts
+    in is cut there.
+    """
+    for sidx, p_start, p_end in passage:
+        length = p_end - p_start
+        if start < length:
+            return sidx, p_start + start, p_start + min(end, length - 1)
+        start -= length
+        end -= length
+    raise IndexError('Span out of passage')
+
+
 # ------------------------------------------------------------------------------
 # Main DrQA pipeline
 # ------------------------------------------------------------------------------
 
 
+class QueryBatch(object):
+    """A batch of queries, and its state as it goes through the stages of
+    DrQA.process_batch.
+    """
+
+    def __init__(self, queries, candidates=None, top_n=1, n_docs=5,
+                 return_context=False):
+        self.queries = queries
+        self.candidates = candidates
+        self.top_n = top_n
+        self.n_docs = n_docs
+        self.return_context = return_context
+        self.predictions = None
+        self.start = time.time()
+        # One per query, if tracing (None otherwise).
+        self.trace_ids = TRACER.new_ids(len(queries))
+
+
 class DrQA(object):
-    # Target size for squashing short paragraphs together.
-    # 0 = read every paragraph independently
-    # infty = read all paragraphs together
-    GROUP_LENGTH = 0
+    # Paragraphs longer than this (in chars) are split at sentence boundaries
+    # for tokenization and stitched back together. 0 = never split.
+    TOKENIZE_LENGTH = 10000
 
     def __init__(
             self,
@@ -71,12 +182,17 @@ class DrQA(object):
             tokenizer=None,
             fixed_candidates=None,
             batch_size=128,
+            max_tokens=None,
+            pack_tokens=0,
+            window_overlap=32,
             cuda=True,
             data_parallel=False,
             max_loaders=5,
             num_workers=None,
+            reader_replicas=0,
             db_config=None,
-            ranker_config=None
+            ranker_config=None,
+            filter_config=None
     ):
         """Initialize the pipeline.
 
@@ -88,26 +204,57 @@ class DrQA(object):
             fixed_candidates: if given, all predictions will be constrated to
               the set of candidates contained in the file. One entry per line.
             batch_size: batch size when processing paragraphs.
+            max_tokens: if given, batch paragraphs by this budget of padded
+              tokens (longest paragraph x batch size) instead of batch_size.
+            pack_tokens: if > 0, read passages of up to this many tokens:
+              adjacent short paragraphs of a doc are packed together, and
+              longer ones are read in overlapping windows. 0 = read every
+              paragraph independently.
+            window_overlap: number of tokens shared by consecutive windows
+              of a long paragraph (keep it above the max span length).
             cuda: whether to use the gpu.
             data_parallel: whether to use multile gpus.
             max_loaders: max number of async data loading workers when reading.
               (default is fine).
             num_workers: number of parallel CPU processes to use for tokenizing
               and post processing resuls.
+            reader_replicas: if > 0 (and on CPU), run the reader in this many
+              processes sharing its weights (see reader.replicas).
             db_config: config for doc db.
             ranker_config: config for ranker.
+            filter_config: if given, options of the paragraph pre-filter
+              (see pipeline.prefilter: top_m and/or threshold); only the
+              paragraphs it keeps are read.
         """
+        if 0 < pack_tokens <= window_overlap:
+            raise RuntimeError('window_overlap (%d) must be smaller than '
+                               'pack_tokens (%d).' %
+                               (window_overlap, pack_tokens))
         self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.pack_tokens = pack_tokens
+        self.window_overlap = window_overlap
         self.max_loaders = max_loaders
         self.fixed_candidates = fixed_candidates is not None
         self.cuda = cuda
 
+        # Compiled once here: workers forked below inherit it.
+        if fixed_candidates is not None:
+            fixed_candidates = reader.candidates.compile_candidates(
+                fixed_candidates
+            )
+
         logger.info('Initializing document ranker...')
         ranker_config = ranker_config or {}
         ranker_class = ranker_config.get('class', DEFAULTS['ranker'])
         ranker_opts = ranker_config.get('options', {})
         self.ranker = ranker_class(**ranker_opts)
 
+        self.paragraph_filter = None
+        if filter_config:
+            self.paragraph_filter = ParagraphFilter(ranker=self.ranker,
+                                                    **filter_config)
+
         logger.info('Initializing document reader...')
         reader_model = reader_model or DEFAULTS['reader_model']
         self.reader = reader.DocReader.load(reader_model, normalize=False)
@@ -116,6 +263,8 @@ class DrQA(object):
             words = reader.utils.index_embedding_words(embedding_file)
             added = self.reader.expand_dictionary(words)
             self.reader.load_embeddings(added, embedding_file)
+            # Share the (large) expanded vocabulary with worker processes.
+            self.reader.compact_dictionary()
         if cuda:
             self.reader.cuda()
         if data_parallel:
@@ -139,28 +288,98 @@ class DrQA(object):
             initializer=init,
             initargs=(tok_class, tok_opts, db_class, db_opts, fixed_candidates)
         )
+        self.scheduler = tokenizers.SizeAwareScheduler(
+            self.processes, num_workers, max_chars=self.TOKENIZE_LENGTH
+        )
+
+        self.replicas = None
+        if reader_replicas > 0 and not cuda:
+            from ..reader.replicas import ReplicaPool
+            self.replicas = ReplicaPool(
+                self.reader, reader_replicas,
+                initializer=init_candidates, initargs=(fixed_candidates,)
+            )
+        self._finalize = None
+        if self.replicas:
+            self._finalize = Finalize(self, self.replicas.close,
+                                      exitpriority=100)
+
+    def close(self):
+        """Stop the reader replicas, if any (otherwise done when this DrQA is
+        garbage collected, or at exit)."""
+        if self._finalize:
+            self._finalize()
 
     def _split_doc(self, doc):
         """Given a doc, split it into chunks (by paragraph)."""
-        curr = []
-        curr_len = 0
         for split in regex.split(r'\n+', doc):
             split = split.strip()
-            if len(split) == 0:
-                continue
-            # Maybe group paragraphs together until we hit a length limit
-            if len(curr) > 0 and curr_len + len(split) > self.GROUP_LENGTH:
-                yield ' '.join(curr)
-                curr = []
-                curr_len = 0
-            curr.append(split)
-            curr_len += len(split)
-        if len(curr) > 0:
-            yield ' '.join(curr)
+            if len(split) > 0:
+                yield split
+
+    def _pack(self, tokens):
+        """Pack the tokenized paragraphs of a doc into passages. Returns the
+        passages (lists of (paragraph, start, end)) and their Tokens.
+        """
+        lengths = [len(t.words()) for t in tokens]
+        passages = pack_paragraphs(lengths, self.pack_tokens,
+                                   self.window_overlap)
+        p_tokens = [join_tokens([(tokens[i], s, e) for i, s, e in passage])
+                    for passage in passages]
+        return passages, p_tokens
+
+    @staticmethod
+    def _example(ex_id, q_tokens, p_tokens):
+        """Reader input for a question and a passage (Tokens)."""
+        return {
+            'id': ex_id,
+            'question': q_tokens.words(),
+            'qlemma': q_tokens.lemmas(),
+            'document': p_tokens.words(),
+            'lemma': p_tokens.lemmas(),
+            'pos': p_tokens.pos(),
+            'ner': p_tokens.entities(),
+        }
+
+    @staticmethod
+    def _prediction(doc_id, doc_score, tokens, paragraph, s, e, score,
+                    return_context=False):
+        """Output for span [s, e] of a paragraph (Tokens) of a doc."""
+        prediction = {
+            'doc_id': doc_id,
+            'span': tokens.slice(s, e + 1).untokenize(),
+            'doc_score': float(doc_score),
+            'span_score': float(score),
+        }
+        if return_context:
+            prediction['context'] = {
+                'text': tokens.untokenize(),
+                'paragraph': paragraph,
+                'start': tokens.offsets()[s][0],
+                'end': tokens.offsets()[e][1],
+            }
+        return prediction
 
     def _get_loader(self, data, num_loaders):
         """Return a pytorch data iterator for provided examples."""
         dataset = ReaderDataset(data, self.reader)
+        # Batches are sorted by length only: grouping paragraphs by question
+        # costs more in padding than encoding each question once saves. The
+        # reader still encodes repeated questions of a batch once.
+        if self.max_tokens:
+            batch_sampler = TokenBudgetBatchSampler(
+                dataset.lengths(),
+                self.max_tokens,
+                shuffle=False
+            )
+            log_padding_efficiency(batch_sampler)
+            return torch.utils.data.DataLoader(
+                dataset,
+                batch_sampler=batch_sampler,
+                num_workers=num_loaders,
+                collate_fn=batchify,
+                pin_memory=self.cuda,
+            )
         sampler = SortedBatchSampler(
             dataset.lengths(),
             self.batch_size,
@@ -185,122 +404,469 @@ class DrQA(object):
         )
         return predictions[0]
 
+    def _ranked_passages(self, doc_texts, prefetch=1):
+        """Yield (rel_didx, paragraph tokens, passage, passage tokens) for the
+        passages of doc_texts, in order. The next prefetch docs are tokenized
+        while the passages of the current one are consumed.
+        """
+        doc_splits = [list(self._split_doc(text)) for text in doc_texts]
+        pending = []
+        for rel_didx in range(len(doc_splits)):
+            while len(pending) < min(prefetch + 1, len(doc_splits) - rel_didx):
+                splits = doc_splits[rel_didx + len(pending)]
+                pending.append(self.processes.map_async(tokenize_text, splits))
+            tokens = pending.pop(0).get()
+            passages, p_tokens = self._pack(tokens)
+            for passage, tokens_ in zip(passages, p_tokens):
+                yield rel_didx, tokens, passage, tokens_
+
+    def process_incremental(self, query, candidates=None, top_n=1, n_docs=5,
+                            return_context=False, margin=0.1,
+                            time_budget=None, batch_size=16):
+        """Run a single query, reading its passages in retrieval order until
+        the answer is unlikely to change (lower latency than process).
+
+        Docs are tokenized one at a time, in rank order, the next one while
+        the current one is read. Passages are read in micro-batches of
+        batch_size. Span scores are not normalized (the reader is loaded with
+        normalize=False), so there is no bound on what unread passages can
+        score. It is estimated from retrieval: the unread passages come from
+        the doc of the last passage read or lower ranked ones, and are
+        expected to score at most the best score so far, scaled by the
+        retrieval score of that doc relative to the top doc. Reading stops
+        once the top_n-th best score is at least (1 + margin) times that
+        estimate (so never within the top doc), or once time_budget seconds
+        (if given) have passed. The output is the same as for process (the
+        paragraph filter is not used here).
+        """
+        t0 = time.time()
+        if candidates:
+            candidates = reader.candidates.compile_candidates(candidates)
+        doc_ids, doc_scores = self.ranker.closest_docs(query, k=n_docs)
+        doc_texts = self.processes.map(fetch_text, doc_ids)
+        q_tokens = self.processes.apply(tokenize_text, (query,))
+        if len(q_tokens.words()) == 0:
+            return []
+
+        stream = self._ranked_passages(doc_texts)
+        doc_tokens = {}
+        best = {}
+        num_read = 0
+        stop = 'end of docs'
+        while True:
+            chunk = list(itertools.islice(stream, batch_size))
+            if not chunk:
+                break
+            examples = [self._example(i, q_tokens, tokens)
+                        for i, (_, _, _, tokens) in enumerate(chunk)]
+            batch = batchify([vectorize(ex, self.reader) for ex in examples])
+            if candidates or self.fixed_candidates:
+                batch_cands = [{'input': tokens, 'cands': candidates}
+                               for _, _, _, tokens in chunk]
+                s, e, score = self.reader.predict(
+                    batch, batch_cands, async_pool=self.processes
+                ).get()
+            else:
+                s, e, score = self.reader.predict(batch)
+            num_read += len(chunk)
+
+            # Keep the best score of each span (windows can overlap).
+            for i, ex_id in enumerate(batch[-1]):
+                if len(score[i]) == 0:
+                    continue
+                rel_didx, tokens, passage, _ = chunk[ex_id]
+                doc_tokens[rel_didx] = tokens
+                sidx, start, end = locate_span(passage, s[i][0], e[i][0])
+                item = (score[i][0], (rel_didx, sidx), start, end)
+                key = (rel_didx, sidx, start, end)
+                if key not in best or best[key] < item:
+                    best[key] = item
+
+            # Estimate the best score of the unread passages (see above).
+            if len(best) >= top_n and doc_scores[0] > 0:
+                top = heapq.nlargest(top_n, best.values())
+                decay = doc_scores[chunk[-1][0]] / doc_scores[0]
+                if top[-1][0] >= top[0][0] * decay * (1 + margin):
+                    stop = 'confident'
+                    break
+            if time_budget and time.time() - t0 >= time_budget:
+                stop = 'time budget'
+                break
+
+        predictions = []
+        for item in heapq.nlargest(top_n, best.values()):
+            score, (rel_didx, sidx), s, e = item
+            predictions.append(self._prediction(
+                doc_ids[rel_didx], doc_scores[rel_didx],
+                doc_tokens[rel_didx][sidx], sidx, s, e, score, return_context
+            ))
+
+        logger.info('Read %d passages (%s) in %.4f (s)' %
+                    (num_read, stop, time.time() - t0))
+        return predictions
+
     def process_batch(self, queries, candidates=None, top_n=1, n_docs=5,
                       return_context=False):
         """Run a batch of queries (more efficient)."""
-        t0 = time.time()
-        logger.info('Processing %d queries...' % len(queries))
-        logger.info('Retrieving top %d docs...' % n_docs)
+        batch = QueryBatch(queries, candidates, top_n, n_docs, return_context)
+        for stage in self.STAGES:
+            self.run_stage(stage, batch)
+        return batch.predictions
+
+    # --------------------------------------------------------------------------
+    # Stages of process_batch, each updating a QueryBatch in place. They can
+    # run concurrently on different batches (see pipeline.pipelined).
+    # --------------------------------------------------------------------------
+
+    STAGES = ('rank', 'fetch', 'tokenize', 'build', 'read', 'aggregate')
+
+    def run_stage(self, name, batch):
+        """Run a stage on a batch, recording its latency (see common.metrics).
+        """
+        start = time.time()
+        getattr(self, name)(batch)
+        end = time.time()
+        METRICS.observe('stage_seconds', end - start, stage=name)
+        TRACER.add(batch.trace_ids, name, start, end)
+
+    def rank(self, batch):
+        """Retrieve the top n_docs documents of each query."""
+        logger.info('Processing %d queries...' % len(batch.queries))
+        if batch.candidates:
+            batch.candidates = [
+                reader.candidates.compile_candidates(c) if c else None
+                for c in batch.candidates
+            ]
+        logger.info('Retrieving top %d docs...' % batch.n_docs)
 
         # Rank documents for queries.
-        if len(queries) == 1:
-            ranked = [self.ranker.closest_docs(queries[0], k=n_docs)]
+        if len(batch.queries) == 1:
+            ranked = [self.ranker.closest_docs(batch.queries[0],
+                                               k=batch.n_docs)]
         else:
             ranked = self.ranker.batch_closest_docs(
-                queries, k=n_docs, num_workers=self.num_workers
+                batch.queries, k=batch.n_docs, num_workers=self.num_workers
             )
-        all_docids, all_doc_scores = zip(*ranked)
-
+        batch.all_docids, batch.all_doc_scores = zip(*ranked)
+        if METRICS.enabled:
+            METRICS.count('queries', len(batch.queries))
+            METRICS.count('docs_retrieved',
+                          sum(len(docids) for docids in batch.all_docids))
+
+    def fetch(self, batch):
+        """Fetch the text of the retrieved documents and split it."""
         # Flatten document ids and retrieve text from database.
         # We remove duplicates for processing efficiency.
-        flat_docids = list({d for docids in all_docids for d in docids})
-        did2didx = {did: didx for didx, did in enumerate(flat_docids)}
-        doc_texts = self.processes.map(fetch_text, flat_docids)
+        flat_docids = list({d for docids in batch.all_docids for d in docids})
+        batch.did2didx = {did: didx for didx, did in enumerate(flat_docids)}
+        if TRACER.enabled:
+            # Also trace each fetch, for all the queries of its doc.
+            doc_trace_ids = [[] for _ in flat_docids]
+            for qidx, docids in enumerate(batch.all_docids):
+                for did in docids:
+                    doc_trace_ids[batch.did2didx[did]].append(
+                        batch.trace_ids[qidx]
+                    )
+            doc_texts = []
+            for didx, text, pid, start, end in self.processes.map(
+                    partial(timed_call, fetch_text), enumerate(flat_docids)):
+                TRACER.add(doc_trace_ids[didx], 'fetch_doc', start, end,
+                           pid=pid, doc_id=flat_docids[didx])
+                doc_texts.append(text)
+            batch.doc_trace_ids = doc_trace_ids
+        else:
+            doc_texts = self.processes.map(fetch_text, flat_docids)
+        if METRICS.enabled:
+            METRICS.count('docs_fetched', len(flat_docids))
+            METRICS.count('doc_cache_hits',
+                          sum(len(docids) for docids in batch.all_docids) -
+                          len(flat_docids))
 
         # Split and flatten documents. Maintain a mapping from doc (index in
         # flat list) to split (index in flat list).
-        flat_splits = []
-        didx2sidx = []
+        batch.flat_splits = []
+        batch.didx2sidx = []
         for text in doc_texts:
             splits = self._split_doc(text)
-            didx2sidx.append([len(flat_splits), -1])
+            batch.didx2sidx.append([len(batch.flat_splits), -1])
             for split in splits:
-                flat_splits.append(split)
-            didx2sidx[-1][1] = len(flat_splits)
-
-        # Push through the tokenizers as fast as possible.
-        q_tokens = self.processes.map_async(tokenize_text, queries)
-        s_tokens = self.processes.map_async(tokenize_text, flat_splits)
-        q_tokens = q_tokens.get()
-        s_tokens = s_tokens.get()
+                batch.flat_splits.append(split)
+            batch.didx2sidx[-1][1] = len(batch.flat_splits)
+
+    def tokenize(self, batch):
+        """Tokenize the queries and paragraphs."""
+        # Push through the tokenizers as fast as possible. Longest texts are
+        # scheduled first so that no worker is left holding a huge paragraph
+        # at the end.
+        queries = list(batch.queries)
+        self.scheduler.reset()
+        tokens = self.scheduler.tokenize(tokenize_text,
+                                         queries + batch.flat_splits)
+        batch.q_tokens = tokens[:len(queries)]
+        batch.s_tokens = tokens[len(queries):]
+        self.scheduler.log_utilization()
+        if METRICS.enabled:
+            METRICS.count('paragraphs', len(batch.s_tokens))
+            METRICS.count('tokens', sum(len(t.words()) for t in tokens))
+
+        if TRACER.enabled:
+            # Trace each tokenization job, for the queries of its text.
+            sidx2didx = [didx for didx, (start, end) in
+                         enumerate(batch.didx2sidx) for _ in range(start, end)]
+            for idx, pid, start, end in self.scheduler.spans:
+                if idx < len(queries):
+                    trace_ids = [batch.trace_ids[idx]]
+                else:
+                    didx = sidx2didx[idx - len(queries)]
+                    trace_ids = batch.doc_trace_ids[didx]
+                TRACER.add(trace_ids, 'tokenize_text', start, end, pid=pid)
+
+    def build(self, batch):
+        """Pack paragraphs into passages, and pair them with their queries
+        as reader examples (keeping those selected by the filter, if any).
+        """
+        q_tokens, s_tokens = batch.q_tokens, batch.s_tokens
+
+        # Pack the paragraphs of each document into passages (lists of
+        # (split, start, end) token ranges). Maintain a mapping from doc to
+        # passage (index in flat list).
+        batch.passages = passages = []
+        batch.p_tokens = p_tokens = []
+        didx2pidx = []
+        for start, end in batch.didx2sidx:
+            didx2pidx.append([len(passages), -1])
+            doc_passages, doc_tokens = self._pack(s_tokens[start:end])
+            passages.extend([(start + i, s, e) for i, s, e in passage]
+                            for passage in doc_passages)
+            p_tokens.extend(doc_tokens)
+            didx2pidx[-1][1] = len(passages)
+        if self.pack_tokens:
+            logger.info('Packed %d paragraphs into %d passages' %
+                        (len(s_tokens), len(passages)))
+
+        # Maybe keep only the passages that overlap the most with each
+        # question. Each passage is hashed once, for all its questions, in
+        # the worker processes (only its words are sent over).
+        if self.paragraph_filter:
+            p_hashes = self.processes.map(
+                self.paragraph_filter.hash_fn(),
+                [t.words(uncased=True) for t in p_tokens]
+            )
 
         # Group into structured example inputs. Examples' ids represent
-        # mappings to their question, document, and split ids.
-        examples = []
-        for qidx in range(len(queries)):
-            for rel_didx, did in enumerate(all_docids[qidx]):
-                start, end = didx2sidx[did2didx[did]]
-                for sidx in range(start, end):
-                    if (len(q_tokens[qidx].words()) > 0 and
-                            len(s_tokens[sidx].words()) > 0):
-                        examples.append({
-                            'id': (qidx, rel_didx, sidx),
-                            'question': q_tokens[qidx].words(),
-                            'qlemma': q_tokens[qidx].lemmas(),
-                            'document': s_tokens[sidx].words(),
-                            'lemma': s_tokens[sidx].lemmas(),
-                            'pos': s_tokens[sidx].pos(),
-                            'ner': s_tokens[sidx].entities(),
-                        })
-
-        logger.info('Reading %d paragraphs...' % len(examples))
+        # mappings to their question, document, and passage ids.
+        batch.examples = examples = []
+        num_passages = 0
+        for qidx in range(len(batch.queries)):
+            if len(q_tokens[qidx].words()) == 0:
+                continue
+            pidxs = []
+            for rel_didx, did in enumerate(batch.all_docids[qidx]):
+                start, end = didx2pidx[batch.did2didx[did]]
+                pidxs.extend((rel_didx, pidx) for pidx in range(start, end))
+            num_passages += len(pidxs)
+            if self.paragraph_filter:
+                scores = self.paragraph_filter.scores(
+                    self.paragraph_filter.weights(q_tokens[qidx]),
+                    [p_hashes[pidx] for _, pidx in pidxs]
+                )
+                pidxs = [pidxs[i] for i in
+                         self.paragraph_filter.select(scores)]
+            for rel_didx, pidx in pidxs:
+                examples.append(self._example(
+                    (qidx, rel_didx, pidx), q_tokens[qidx], p_tokens[pidx]
+                ))
+
+        if self.paragraph_filter:
+            logger.info('Paragraph filter kept %d/%d passages' %
+                        (len(examples), num_passages))
+        METRICS.count('passages', len(passages))
+        METRICS.count('examples', len(examples))
+
+    def read(self, batch):
+        """Run the reader over the examples (decoding asynchronously)."""
+        batch.result_handles = list(self._submit(batch))
+
+    def _submit(self, batch):
+        """Push the examples through the reader, yielding (result handle,
+        example ids, batch size) for each reader batch.
+        """
+        examples = batch.examples
+        candidates = batch.candidates
+        logger.info('Reading %d passages...' % len(examples))
 
         # Push all examples through the document reader.
         # We decode argmax start/end indices asychronously on CPU.
-        result_handles = []
         num_loaders = min(self.max_loaders, math.floor(len(examples) / 1e3))
-        for batch in self._get_loader(examples, num_loaders):
+        loader = iter(self._get_loader(examples, num_loaders))
+        while True:
+            # Time spent waiting for vectorized batches.
+            with METRICS.timer('vectorize_seconds'):
+                ex = next(loader, None)
+            if ex is None:
+                break
+            start = time.time()
             if candidates or self.fixed_candidates:
                 batch_cands = []
-                for ex_id in batch[-1]:
+                for ex_id in ex[-1]:
                     batch_cands.append({
-                        'input': s_tokens[ex_id[2]],
+                        'input': batch.p_tokens[ex_id[2]],
                         'cands': candidates[ex_id[0]] if candidates else None
                     })
+            else:
+                batch_cands = None
+            if self.replicas:
+                handle = self.replicas.submit(ex, batch_cands)
+            elif batch_cands:
                 handle = self.reader.predict(
-                    batch, batch_cands, async_pool=self.processes
+                    ex, batch_cands, async_pool=self.processes
                 )
             else:
-                handle = self.reader.predict(batch, async_pool=self.processes)
-            result_handles.append((handle, batch[-1], batch[0].size(0)))
-
-        # Iterate through the predictions, and maintain priority queues for
-        # top scored answers for each question in the batch.
-        queues = [[] for _ in range(len(queries))]
-        for result, ex_ids, batch_size in result_handles:
+                handle = self.reader.predict(ex, async_pool=self.processes)
+            if METRICS.enabled:
+                METRICS.count('reader_batches')
+                METRICS.count('reader_padded_tokens',
+                              ex[0].size(0) * ex[0].size(1))
+                METRICS.count('reader_tokens', sum(
+                    len(batch.p_tokens[ex_id[2]].words()) for ex_id in ex[-1]
+                ))
+            if TRACER.enabled:
+                TRACER.add([batch.trace_ids[qidx] for qidx in
+                            sorted({ex_id[0] for ex_id in ex[-1]})],
+                           'read_batch', start, time.time(),
+                           batch_size=ex[0].size(0))
+            yield handle, ex[-1], ex[0].size(0)
+
+    def _collect(self, batch, best, result, ex_ids, batch_size):
+        """Add the predictions of a reader batch to best (a dict of query
+        index to {span: item}).
+        """
+        # Map predictions back to their paragraph. Overlapping windows can
+        # predict the same span: keep its best score only.
+        with METRICS.timer('decode_wait_seconds'):
             s, e, score = result.get()
-            for i in range(batch_size):
-                # We take the top prediction per split.
-                if len(score[i]) > 0:
-                    item = (score[i][0], ex_ids[i], s[i][0], e[i][0])
-                    queue = queues[ex_ids[i][0]]
-                    if len(queue) < top_n:
-                        heapq.heappush(queue, item)
-                    else:
-                        heapq.heappushpop(queue, item)
-
-        # Arrange final top prediction data.
-        all_predictions = []
-        for queue in queues:
-            predictions = []
-            while len(queue) > 0:
-                score, (qidx, rel_didx, sidx), s, e = heapq.heappop(queue)
-                prediction = {
-                    'doc_id': all_docids[qidx][rel_didx],
-                    'span': s_tokens[sidx].slice(s, e + 1).untokenize(),
-                    'doc_score': float(all_doc_scores[qidx][rel_didx]),
-                    'span_score': float(score),
-                }
-                if return_context:
-                    prediction['context'] = {
-                        'text': s_tokens[sidx].untokenize(),
-                        'start': s_tokens[sidx].offsets()[s][0],
-                        'end': s_tokens[sidx].offsets()[e][1],
-                    }
-                predictions.append(prediction)
-            all_predictions.append(predictions[-1::-1])
+        for i in range(batch_size):
+            # We take the top prediction per passage.
+            if len(score[i]) > 0:
+                qidx, rel_didx, pidx = ex_ids[i]
+                sidx, start, end = locate_span(batch.passages[pidx],
+                                               s[i][0], e[i][0])
+                key = (rel_didx, sidx, start, end)
+                item = (score[i][0], (qidx, rel_didx, sidx), start, end)
+                items = best.setdefault(qidx, {})
+                if key not in items or items[key] < item:
+                    items[key] = item
+
+    def _top_predictions(self, batch, qidx, items):
+        """Arrange the top predictions of a query from its items."""
+        predictions = []
+        for item in heapq.nlargest(batch.top_n, items.values()):
+            score, (qidx, rel_didx, sidx), s, e = item
+            doc_id = batch.all_docids[qidx][rel_didx]
+            start = batch.didx2sidx[batch.did2didx[doc_id]][0]
+            predictions.append(self._prediction(
+                doc_id, batch.all_doc_scores[qidx][rel_didx],
+                batch.s_tokens[sidx], sidx - start, s, e, score,
+                batch.return_context
+            ))
+        if batch.trace_ids[qidx] is not None:
+            for prediction in predictions:
+                prediction['trace_id'] = batch.trace_ids[qidx]
+        return predictions
+
+    def aggregate(self, batch):
+        """Gather the top predictions of each query."""
+        best = {}
+        for handle, ex_ids, batch_size in batch.result_handles:
+            self._collect(batch, best, handle, ex_ids, batch_size)
+        batch.predictions = [
+            self._top_predictions(batch, qidx, best.get(qidx, {}))
+            for qidx in range(len(batch.queries))
+        ]
+
+        logger.info('Processed %d queries in %.4f (s)' %
+                    (len(batch.queries), time.time() - batch.start))
+        METRICS.observe('batch_seconds', time.time() - batch.start)
+
+    def process_batch_stream(self, queries, candidates=None, top_n=1,
+                             n_docs=5, return_context=False, max_pending=4,
+                             group_size=64):
+        """Run a batch of queries like process_batch, but yield (query index,
+        predictions) for each query as soon as all its passages are read.
+
+        Queries go through the pipeline in groups of group_size (0 = all at
+        once): the docs, tokens and examples of a group are only built once
+        the previous group is done, and dropped with it, so memory is bounded
+        by the group size rather than by the number of queries (docs shared
+        by queries of different groups are fetched and tokenized again).
+        Within a group, reader batches follow query order, so queries
+        complete roughly in order (those with nothing to read first). At
+        most max_pending reader batches are in flight, and the predictions
+        of a query are dropped once it is yielded.
+        """
+        start = time.time()
+        group_size = group_size or len(queries)
+        for offset in range(0, len(queries), group_size):
+            batch = QueryBatch(
+                queries[offset:offset + group_size],
+                candidates[offset:offset + group_size] if candidates else None,
+                top_n, n_docs, return_context
+            )
+            for qidx, predictions in self._stream(batch, start, max_pending):
+                yield offset + qidx, predictions
+            # Release the group before building the next one.
+            del batch
 
         logger.info('Processed %d queries in %.4f (s)' %
-                    (len(queries), time.time() - t0))
+                    (len(queries), time.time() - start))
+        METRICS.observe('batch_seconds', time.time() - start)
 
-        return all_predictions
+    def _stream(self, batch, start, max_pending):
+        """Yield (query index, predictions) for the queries of a batch, in
+        completion order (see process_batch_stream).
+        """
+        for stage in ('rank', 'fetch', 'tokenize', 'build'):
+            self.run_stage(stage, batch)
+
+        remaining = [0] * len(batch.queries)
+        for ex in batch.examples:
+            remaining[ex['id'][0]] += 1
+        for qidx in range(len(batch.queries)):
+            if remaining[qidx] == 0:
+                yield qidx, []
+
+        # Reading and aggregating are interleaved: their time (excluding
+        # that spent by the consumer between two queries) is summed up and
+        # recorded per group, as run_stage does for the other stages.
+        best = {}
+        pending = deque()
+        handles = self._submit(batch)
+        read_seconds = aggregate_seconds = 0
+        while True:
+            t0 = time.time()
+            for handle in handles:
+                pending.append(handle)
+                if len(pending) >= max_pending:
+                    break
+            t1 = time.time()
+            read_seconds += t1 - t0
+            if not pending:
+                break
+            handle, ex_ids, batch_size = pending.popleft()
+            self._collect(batch, best, handle, ex_ids, batch_size)
+            done = []
+            for ex_id in ex_ids:
+                qidx = ex_id[0]
+                remaining[qidx] -= 1
+                if remaining[qidx] == 0:
+                    done.append((qidx, self._top_predictions(
+                        batch, qidx, best.pop(qidx, {})
+                    )))
+            aggregate_seconds += time.time() - t1
+            for qidx, predictions in done:
+                METRICS.observe('query_seconds', time.time() - start)
+                TRACER.add([batch.trace_ids[qidx]], 'stream', start,
+                           time.time())
+                yield qidx, predictions
+        METRICS.observe('stage_seconds', read_seconds, stage='read')
+        METRICS.observe('stage_seconds', aggregate_seconds, stage='aggregate')
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Stage-pipelined execution of DrQA over a stream of query batches.
+
+DrQA.process_batch runs its stages (rank, fetch, tokenize, build, read,
+aggregate) one after the other, leaving the reader idle while documents are
+tokenized and the tokenizers idle while the reader runs. Here each stage is an
+asyncio task reading from a bounded queue and running the stage in its own
+thread pool, so that batch i + 1 is ranked and tokenized while batch i is
+read. A full queue blocks the stage feeding it (backpressure): at most
+queue_size batches wait between two stages.
+"""
+
+import time
+import asyncio
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .drqa import QueryBatch
+
+logger = logging.getLogger(__name__)
+
+
+class StageStats(object):
+    """Throughput counters of a stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.batches = 0
+        self.queries = 0
+        self.busy = 0.0
+        self.idle = 0.0
+        self.blocked = 0.0
+        self.max_depth = 0
+
+    def as_dict(self):
+        return {
+            'batches': self.batches,
+            'queries': self.queries,
+            'busy': self.busy,
+            # Waiting for input (upstream is the bottleneck).
+            'idle': self.idle,
+            # Waiting for room downstream (backpressure).
+            'blocked': self.blocked,
+            'max_queue_depth': self.max_depth,
+            'queries_per_s': self.queries / self.busy if self.busy else 0.0,
+        }
+
+
+class PipelinedDrQA(object):
+    """Run the stages of DrQA.process_batch concurrently on batches."""
+
+    def __init__(self, drqa, queue_size=2, workers=None):
+        """
+        Args:
+            drqa: the DrQA pipeline.
+            queue_size: max number of batches waiting before each stage.
+            workers: optional dict of number of threads per stage (default
+              1: the tokenizer and reader pools are already parallel, this
+              only overlaps stages). Keep 1 for tokenize, whose scheduler is
+              shared.
+        """
+        self.drqa = drqa
+        self.queue_size = queue_size
+        self.workers = dict.fromkeys(drqa.STAGES, 1)
+        self.workers.update(workers or {})
+        self.stats = {name: StageStats(name) for name in drqa.STAGES}
+
+    @staticmethod
+    async def _put(queue, item, stats):
+        """Put item in the queue of a stage; return the time blocked."""
+        t0 = time.time()
+        await queue.put(item)
+        if stats is not None:
+            stats.max_depth = max(stats.max_depth, queue.qsize())
+        return time.time() - t0
+
+    async def _feed(self, batches, queue, stats):
+        for i, batch in enumerate(batches):
+            await self._put(queue, (i, batch), stats)
+        await queue.put(None)
+
+    async def _stage(self, name, inbox, outbox, executor, done, next_stats):
+        loop = asyncio.get_event_loop()
+        stage = partial(self.drqa.run_stage, name)
+        stats = self.stats[name]
+        while True:
+            t0 = time.time()
+            item = await inbox.get()
+            stats.idle += time.time() - t0
+            if item is None:
+                # Let the other workers of this stage see the end too.
+                await inbox.put(None)
+                break
+            t0 = time.time()
+            await loop.run_in_executor(executor, stage, item[1])
+            stats.busy += time.time() - t0
+            stats.batches += 1
+            stats.queries += len(item[1].queries)
+            stats.blocked += await self._put(outbox, item, next_stats)
+        done[name] -= 1
+        if done[name] == 0:
+            await outbox.put(None)
+
+    async def _sink(self, queue, callback):
+        # Batches can finish out of order if a stage has several workers.
+        pending, expected = {}, 0
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            pending[item[0]] = item[1]
+            while expected in pending:
+                callback(expected, pending.pop(expected))
+                expected += 1
+
+    async def run(self, batches, callback):
+        """Process QueryBatches, calling callback(i, batch) in order as each
+        batch is done (with its predictions in batch.predictions).
+        """
+        stages = self.drqa.STAGES
+        queues = [asyncio.Queue(self.queue_size) for _ in stages]
+        queues.append(asyncio.Queue())
+        done = dict(self.workers)
+        executors = [ThreadPoolExecutor(self.workers[name]) for name in stages]
+        tasks = [asyncio.ensure_future(
+            self._feed(batches, queues[0], self.stats[stages[0]])
+        )]
+        for k, name in enumerate(stages):
+            next_stats = self.stats[stages[k + 1]] \
+                if k + 1 < len(stages) else None
+            for _ in range(self.workers[name]):
+                tasks.append(asyncio.ensure_future(self._stage(
+                    name, queues[k], queues[k + 1], executors[k], done,
+                    next_stats
+                )))
+        tasks.append(asyncio.ensure_future(self._sink(queues[-1], callback)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for executor in executors:
+                executor.shutdown(wait=True)
+
+    def process_batches(self, batches, callback, top_n=1, n_docs=5,
+                        return_context=False):
+        """Run lists of queries through the pipeline (see process_batch),
+        calling callback(i, predictions) in order as each is done.
+        """
+        batches = (QueryBatch(queries, None, top_n, n_docs, return_context)
+                   for queries in batches)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.run(
+                batches, lambda i, batch: callback(i, batch.predictions)
+            ))
+        finally:
+            loop.close()
+        self.log_stats()
+
+    def log_stats(self):
+        logger.info('Stage throughput:')
+        for name in self.drqa.STAGES:
+            s = self.stats[name].as_dict()
+            logger.info('  %-9s: %d batches | %.2f queries/s | busy %.2f (s) '
+                        '| idle %.2f (s) | blocked %.2f (s) | max queue %d' %
+                        (name, s['batches'], s['queries_per_s'], s['busy'],
+                         s['idle'], s['blocked'], s['max_queue_depth']))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Cheap lexical pre-filter of retrieved paragraphs, before the reader.
+
+Questions and paragraphs are hashed into n-grams exactly like the retriever
+hashes queries (same normalization, n-gram size and hash buckets). A
+paragraph scores the fraction of the question's weight it covers: the sum of
+the idf weights of the question n-grams it contains, over the sum for all
+question n-grams. Idf weights are the retriever's (document frequencies of
+its tf-idf index); without a tf-idf ranker every n-gram weighs 1.
+"""
+
+import logging
+import numpy as np
+
+from functools import partial
+
+from ..retriever import utils
+
+logger = logging.getLogger(__name__)
+
+
+def hash_words(words, ngrams, hash_size):
+    """Set of the hashed n-grams (of length 1 to ngrams) of a list of
+    lowercased words, like Tokens.ngrams. Runs in worker processes.
+    """
+    return {utils.hash(utils.normalize(' '.join(words[s:e])), hash_size)
+            for s in range(len(words))
+            for e in range(s + 1, min(s + ngrams, len(words)) + 1)}
+
+
+class ParagraphFilter(object):
+    """Keep the best overlapping paragraphs of each question."""
+
+    def __init__(self, top_m=None, threshold=None, ranker=None, ngrams=1,
+                 hash_size=int(2**24)):
+        """
+        Args:
+            top_m: keep at most this many paragraphs per question.
+            threshold: drop paragraphs scoring below this (in [0, 1]).
+            ranker: if it is a TfidfDocRanker, use its n-grams, hash size and
+              document frequencies (ngrams and hash_size are then ignored).
+        """
+        if top_m is None and threshold is None:
+            raise RuntimeError('The paragraph filter needs top_m or threshold.')
+        self.top_m = top_m
+        self.threshold = threshold
+        self.ngrams = getattr(ranker, 'ngrams', ngrams)
+        self.hash_size = getattr(ranker, 'hash_size', hash_size)
+        self.doc_freqs = getattr(ranker, 'doc_freqs', None)
+        self.num_docs = getattr(ranker, 'num_docs', None)
+
+    def _hash(self, tokens, filter_fn=None):
+        grams = tokens.ngrams(n=self.ngrams, uncased=True, filter_fn=filter_fn)
+        return [utils.hash(utils.normalize(g), self.hash_size) for g in grams]
+
+    def weights(self, question):
+        """Map the hashed n-grams of question (Tokens) to their weights."""
+        wids = np.unique(self._hash(question, utils.filter_ngram))
+        if self.doc_freqs is None:
+            return dict.fromkeys(wids.tolist(), 1.0)
+        # Same idf as TfidfDocRanker.text2spvec.
+        Ns = self.doc_freqs[wids]
+        idfs = np.log((self.num_docs - Ns + 0.5) / (Ns + 0.5))
+        idfs[idfs < 0] = 0
+        return dict(zip(wids.tolist(), idfs.tolist()))
+
+    def hashes(self, paragraph):
+        """Set of the hashed n-grams of paragraph (Tokens)."""
+        return hash_words(paragraph.words(uncased=True), self.ngrams,
+                          self.hash_size)
+
+    def hash_fn(self):
+        """Picklable function mapping lowercased words to the set of their
+        hashed n-grams (the same as hashes), to map over a process pool.
+        """
+        return partial(hash_words, ngrams=self.ngrams,
+                       hash_size=self.hash_size)
+
+    def scores(self, weights, paragraphs):
+        """Score paragraphs (sets of hashes) against question weights."""
+        total = sum(weights.values())
+        if total == 0:
+            return [0.0] * len(paragraphs)
+        return [sum(w for h, w in weights.items() if h in p) / total
+                for p in paragraphs]
+
+    def select(self, scores):
+        """Indices (in order) of the paragraphs to keep given their scores.
+        Ties are broken by order; the best paragraph is always kept.
+        """
+        if len(scores) == 0:
+            return []
+        ranked = sorted(range(len(scores)), key=lambda i: -scores[i])
+        if self.top_m:
+            ranked = ranked[:self.top_m]
+        if self.threshold is not None:
+            ranked = ranked[:1] + [i for i in ranked[1:]
+                                   if scores[i] >= self.threshold]
+        return sorted(ranked)
@@ -20,9 +20,19 @@ def set_default(key, value):
     global DEFAULTS
     DEFAULTS[key] = value
 
-from .model import DocReader
-from .predictor import Predictor
-from . import config
-from . import vector
-from . import data
-from . import utils
+from ..common.lazy import lazy_import
+lazy_import(__name__, {
+    'DocReader': ('.model', 'DocReader'),
+    'Predictor': ('.predictor', 'Predictor'),
+    'config': ('.config', None),
+    'vector': ('.vector', None),
+    'data': ('.data', None),
+    'cache': ('.cache', None),
+    'candidates': ('.candidates', None),
+    'stream': ('.stream', None),
+    'embeddings': ('.embeddings', None),
+    'bundle': ('.bundle', None),
+    'backends': ('.backends', None),
+    'replicas': ('.replicas', None),
+    'utils': ('.utils', None),
+})
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Exported reader networks and the backends that run them.
+
+A network is exported by tracing it on an example batch, as a TorchScript
+module or an ONNX graph. Its inputs are those of network.forward, except that
+the document features are dense (batch * len_d * num_features): backends
+expand the compact features of a batch before running the graph.
+
+DocReader.predict runs the eager network unless a backend is set (see
+DocReader.set_backend); exported graphs are for CPU inference.
+
+Supported networks: drqa (RnnDocReader, checked against eager on batches of
+other shapes than the traced one), bidaf and fusionnet (traced the same way;
+check them with scripts/reader/export_graph.py). mlstm can not be exported:
+its match-LSTM steps through the document in python and reverses each
+sequence by its length, which tracing freezes to the traced batch.
+"""
+
+import logging
+import torch
+
+from . import layers
+
+logger = logging.getLogger(__name__)
+
+EXPORTABLE = ('drqa', 'bidaf', 'fusionnet')
+
+INPUT_NAMES = ['x1', 'x1_f', 'x1_mask', 'x2', 'x2_mask']
+CHAR_INPUT_NAMES = ['x1', 'x1_mask', 'x1_char', 'x1_char_mask', 'x1_f',
+                    'x2', 'x2_mask', 'x2_char', 'x2_char_mask']
+
+
+def input_names(model):
+    return CHAR_INPUT_NAMES if model.character_dict else INPUT_NAMES
+
+
+# ------------------------------------------------------------------------------
+# Graph inputs.
+# ------------------------------------------------------------------------------
+
+
+def graph_inputs(model, inputs):
+    """Network inputs of a batch (ex[:num_inputs]), with dense features."""
+    inputs = list(inputs)
+    i = input_names(model).index('x1_f')
+    if model.args.num_features > 0:
+        inputs[i] = layers.expand_features(
+            inputs[i], model.args.feature_value_cols, model.args.num_features
+        )
+    else:
+        inputs[i] = torch.zeros(inputs[0].size(0), inputs[0].size(1), 0)
+    return inputs
+
+
+def example_inputs(model, batch_size=4, doc_len=40, question_len=10,
+                   word_len=8):
+    """Random graph inputs, of decreasing lengths (so, with padding)."""
+    def words(length, vocab_size):
+        ids = torch.LongTensor(batch_size, length).random_(1, vocab_size)
+        lengths = torch.linspace(length, max(1, length // 2), batch_size)
+        mask = torch.arange(0, length).long().unsqueeze(0) >= \
+            lengths.long().unsqueeze(1)
+        return ids.masked_fill_(mask, 0), mask.byte()
+
+    def chars(length):
+        ids = torch.LongTensor(batch_size, length, word_len).random_(
+            1, len(model.character_dict)
+        )
+        return ids, torch.zeros(batch_size, length, word_len).byte()
+
+    x1, x1_mask = words(doc_len, len(model.word_dict))
+    x2, x2_mask = words(question_len, len(model.word_dict))
+    x1_f = torch.zeros(batch_size, doc_len, model.args.num_features)
+    x1_f.bernoulli_(0.5)
+    if not model.character_dict:
+        return [x1, x1_f, x1_mask, x2, x2_mask]
+    x1_char, x1_char_mask = chars(doc_len)
+    x2_char, x2_char_mask = chars(question_len)
+    return [x1, x1_mask, x1_char, x1_char_mask, x1_f,
+            x2, x2_mask, x2_char, x2_char_mask]
+
+
+# ------------------------------------------------------------------------------
+# Export.
+# ------------------------------------------------------------------------------
+
+
+def export_graph(model, path, fmt='torchscript', inputs=None):
+    """Trace the network of DocReader model (on CPU) and save it to path, in
+    fmt 'torchscript' or 'onnx'.
+    """
+    if model.use_cuda or model.parallel:
+        raise RuntimeError('Export the model from CPU.')
+    if model.args.model_type.lower() not in EXPORTABLE:
+        raise RuntimeError('%s networks can not be exported (supported: %s).'
+                           % (model.args.model_type, ', '.join(EXPORTABLE)))
+    if model.quantized:
+        # Packed quantized RNNs record the traced batch size as a constant.
+        raise RuntimeError('Quantized networks can not be exported.')
+    network = model.network
+    network.eval()
+    inputs = tuple(inputs or example_inputs(model))
+    logger.info('Exporting %s network to %s (%s)' %
+                (model.args.model_type, path, fmt))
+    with torch.no_grad():
+        if fmt == 'torchscript':
+            graph = torch.jit.trace(network, inputs, check_trace=False)
+            graph.save(path)
+        elif fmt == 'onnx':
+            names = input_names(model)
+            axes = {}
+            for name in names:
+                axes[name] = {0: 'batch',
+                              1: 'len_d' if name.startswith('x1') else 'len_q'}
+                if '_char' in name:
+                    axes[name][2] = 'len_w'
+            for name in ('score_s', 'score_e'):
+                axes[name] = {0: 'batch', 1: 'len_d'}
+            torch.onnx.export(network, inputs, path, input_names=names,
+                              output_names=['score_s', 'score_e'],
+                              dynamic_axes=axes)
+        else:
+            raise RuntimeError('Unsupported export format: %s' % fmt)
+
+
+# ------------------------------------------------------------------------------
+# Backends.
+# ------------------------------------------------------------------------------
+
+
+class GraphBackend(object):
+    """Runs an exported network."""
+
+    def forward(self, model, inputs):
+        """Output (score_s, score_e) of a batch (ex[:num_inputs])."""
+        return self.run(graph_inputs(model, inputs), input_names(model))
+
+    def run(self, inputs, names):
+        """Output (score_s, score_e) of graph inputs (named names)."""
+        raise NotImplementedError
+
+
+class TorchScriptBackend(GraphBackend):
+
+    def __init__(self, path):
+        self.graph = torch.jit.load(path, map_location='cpu')
+        self.graph.eval()
+
+    def run(self, inputs, names):
+        with torch.no_grad():
+            return self.graph(*inputs)
+
+
+class OnnxBackend(GraphBackend):
+
+    def __init__(self, path, threads=None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise RuntimeError('The onnx backend needs onnxruntime '
+                               '(pip install onnxruntime).')
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=['CPUExecutionProvider']
+        )
+        # Inputs the network does not use may have been pruned.
+        self.inputs = {i.name for i in self.session.get_inputs()}
+
+    def run(self, inputs, names):
+        feed = {name: x.cpu().numpy() for name, x in zip(names, inputs)
+                if name in self.inputs}
+        score_s, score_e = self.session.run(['score_s', 'score_e'], feed)
+        return torch.from_numpy(score_s), torch.from_numpy(score_e)
+
+
+BACKENDS = {
+    'torchscript': TorchScriptBackend,
+    'onnx': OnnxBackend,
+}
+
+
+def get_backend(name, path=None):
+    """Backend name ('eager', 'torchscript' or 'onnx') running the graph
+    exported to path. None for eager (the network itself).
+    """
+    if name == 'eager':
+        return None
+    if name not in BACKENDS:
+        raise RuntimeError('Unsupported backend: %s' % name)
+    if not path:
+        raise RuntimeError('The %s backend needs an exported graph.' % name)
+    return BACKENDS[name](path)
@@ -114,7 +114,7 @@ class BidafDocReader(nn.Module):
         x1_mask = document padding mask        [batch * len_d]
         x1_char = document chars indices       [batch * len_d * len_w]
         x1_char_mask = document chars padding mask       [batch * len_d * len_w]
-        x1_f = document word features indices  [batch * len_d * nfeat]
+        x1_f = document word features          (ids, values) compact pair
         x2 = question word indices             [batch * len_q]
         x2_mask = question padding mask        [batch * len_q]
         x2_char = question chars indices       [batch * len_q * len_w]
@@ -155,7 +155,9 @@ class BidafDocReader(nn.Module):
 
         # Add manual features
         if self.args.num_features > 0:
-            drnn_input.append(x1_f)
+            drnn_input.append(layers.expand_features(
+                x1_f, self.args.feature_value_cols, self.args.num_features
+            ))
 
         # Encode document with RNN shape: [batch, len_d, 2*hidden_size]
         doc_hiddens = self.doc_rnn(torch.cat(drnn_input, 2), x1_mask)
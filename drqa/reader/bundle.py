@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Serving bundles: a DocReader saved as plain, memory-mappable arrays.
+
+A bundle is a directory holding:
+    config.json     model args, feature dict and character dict.
+    vocab/          the word dictionary, as a CompactDictionary.
+    weights/        one .npy file per network parameter / buffer
+                    (including the embedding matrix).
+
+Unlike a .mdl file, nothing is unpickled or copied when loading: the arrays
+are memory mapped (copy-on-write), so the pages of the embedding matrix are
+only read when used, and shared by all processes serving the same bundle.
+"""
+
+import os
+import json
+import logging
+import argparse
+import numpy as np
+import torch
+
+from .config import override_model_args
+from .data import Dictionary, CompactDictionary
+from .model import DocReader
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+def is_bundle(path):
+    return os.path.isfile(os.path.join(path, 'config.json'))
+
+
+def export_bundle(model, path):
+    """Write DocReader model as a serving bundle in directory path."""
+    logger.info('Exporting serving bundle to %s' % path)
+    os.makedirs(os.path.join(path, 'weights'), exist_ok=True)
+
+    state_dict = model.network.state_dict()
+    state_dict.pop('fixed_embedding', None)
+    for name, tensor in state_dict.items():
+        np.save(os.path.join(path, 'weights', name + '.npy'),
+                tensor.cpu().numpy())
+
+    word_dict = model.word_dict
+    if not isinstance(word_dict, CompactDictionary):
+        word_dict = CompactDictionary.from_dictionary(word_dict)
+    word_dict.save(os.path.join(path, 'vocab'))
+
+    character_dict = None
+    if model.character_dict is not None:
+        character_dict = [model.character_dict[i]
+                          for i in range(len(model.character_dict))]
+
+    # Written last: marks the bundle as complete.
+    with open(os.path.join(path, 'config.json'), 'w') as f:
+        json.dump({
+            'version': FORMAT_VERSION,
+            'args': vars(model.args),
+            'feature_dict': model.feature_dict,
+            'character_dict': character_dict,
+            'weights': sorted(state_dict),
+        }, f, indent=2, sort_keys=True)
+
+
+def _set_tensor(module, name, tensor):
+    """Replace parameter or buffer name (dotted path) of module."""
+    path = name.split('.')
+    for attr in path[:-1]:
+        module = getattr(module, attr)
+    if path[-1] in module._parameters:
+        tensor = torch.nn.Parameter(tensor, requires_grad=False)
+    setattr(module, path[-1], tensor)
+
+
+def load_bundle(path, new_args=None, normalize=True):
+    """Construct a DocReader (for inference) from the bundle in path."""
+    logger.info('Loading serving bundle %s' % path)
+    with open(os.path.join(path, 'config.json')) as f:
+        config = json.load(f)
+    if config['version'] != FORMAT_VERSION:
+        raise RuntimeError('Unsupported bundle version %d in %s' %
+                           (config['version'], path))
+    args = argparse.Namespace(**config['args'])
+    if new_args:
+        args = override_model_args(args, new_args)
+
+    character_dict = None
+    if config['character_dict'] is not None:
+        character_dict = Dictionary()
+        for index, c in enumerate(config['character_dict']):
+            character_dict[c] = index
+            character_dict[index] = c
+
+    # Build the network around a placeholder vocabulary, so that no (random)
+    # embedding matrix is allocated, then plug in the mapped arrays.
+    model = DocReader(args, Dictionary(), config['feature_dict'],
+                      character_dict, normalize=normalize)
+    model.word_dict = CompactDictionary.load(os.path.join(path, 'vocab'))
+    model.args.vocab_size = len(model.word_dict)
+    for name in config['weights']:
+        array = np.load(os.path.join(path, 'weights', name + '.npy'),
+                        mmap_mode='c')
+        _set_tensor(model.network, name, torch.from_numpy(array))
+    model.network.embedding.num_embeddings = model.args.vocab_size
+    return model
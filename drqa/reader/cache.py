@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Binary cache of vectorized reader examples.
+
+Preprocessed examples are converted once into flat, column-wise NumPy arrays
+(word ids, compact feature ids/values, answer spans, lengths) that are memory
+mapped at training time, so that each epoch reads examples without any JSON
+decoding, dictionary lookups or feature construction. A cache is keyed by a
+fingerprint of the data file (path, size and modification time), the
+dictionaries and the feature options, and is rebuilt whenever any of those
+change. The data file itself is only parsed to (re)build the cache.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import torch
+
+from torch.utils.data import Dataset
+from .vector import compact_features, index_words
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+# Model options that change the content of vectorized examples.
+FEATURE_ARGS = ['use_in_question', 'use_lemma', 'use_pos', 'use_ner',
+                'use_tf', 'uncased_question', 'uncased_doc']
+
+
+# ------------------------------------------------------------------------------
+# Cache building.
+# ------------------------------------------------------------------------------
+
+
+def fingerprint(filename, model, skip_no_answer=False):
+    """Hash everything that determines the vectorized examples (without
+    reading the data file).
+    """
+    h = hashlib.sha1()
+    stat = os.stat(filename)
+    h.update(json.dumps({
+        'version': FORMAT_VERSION,
+        'file': os.path.abspath(filename),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'skip_no_answer': skip_no_answer,
+        'args': {k: getattr(model.args, k, None) for k in FEATURE_ARGS},
+        'features': sorted(model.feature_dict.items()),
+    }, sort_keys=True).encode('utf-8'))
+    # Dictionary indices (not just words: tune_partial reorders them).
+    for i in range(len(model.word_dict)):
+        h.update(model.word_dict[i].encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+
+def build_cache(examples, model, path):
+    """Vectorize examples and save them column-wise in directory path."""
+    word_dict = model.word_dict
+    doc_words, q_words, feat_ids, feat_values, answers = [], [], [], [], []
+    doc_lens, q_lens, ans_lens, ids = [], [], [], []
+    for ex in examples:
+        doc_words.append(index_words(word_dict, ex, 'document'))
+        q_words.append(index_words(word_dict, ex, 'question'))
+        f_ids, f_values = compact_features(ex, model.args, model.feature_dict)
+        feat_ids.append(f_ids)
+        feat_values.append(f_values)
+        answers.extend(ex['answers'])
+        doc_lens.append(len(ex['document']))
+        q_lens.append(len(ex['question']))
+        ans_lens.append(len(ex['answers']))
+        ids.append(ex['id'])
+
+    id_dtype = np.int16 if len(model.feature_dict) < 2 ** 15 else np.int32
+    columns = {
+        'doc_offsets': _offsets(doc_lens),
+        'doc_words': np.fromiter((w for d in doc_words for w in d),
+                                 np.int32, sum(doc_lens)),
+        'q_offsets': _offsets(q_lens),
+        'q_words': np.fromiter((w for q in q_words for w in q),
+                               np.int32, sum(q_lens)),
+        'ans_offsets': _offsets(ans_lens),
+        'answers': np.array(answers, dtype=np.int32).reshape(-1, 2),
+        'ids': np.array(ids, dtype=str),
+    }
+    if len(examples) > 0 and feat_ids[0] is not None:
+        columns['feat_ids'] = np.concatenate(feat_ids).astype(id_dtype)
+    if len(examples) > 0 and feat_values[0] is not None:
+        columns['feat_values'] = np.concatenate(feat_values)
+
+    os.makedirs(path, exist_ok=True)
+    for name, array in columns.items():
+        np.save(os.path.join(path, name + '.npy'), array)
+
+    # Written last: marks the cache as complete.
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'version': FORMAT_VERSION, 'num_examples': len(examples),
+                   'columns': sorted(columns)}, f)
+
+
+def _offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def cache_path(filename, model, cache_dir, skip_no_answer=False):
+    """Directory of the cache of filename's examples in cache_dir."""
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(cache_dir, '%s.%s.cache' % (
+        name, fingerprint(filename, model, skip_no_answer)
+    ))
+
+
+def cached_dataset(filename, load, model, cache_dir, single_answer=False,
+                   skip_no_answer=False):
+    """Return a CachedReaderDataset for the examples of filename, building
+    the cache first if there is no valid one in cache_dir. load() returns
+    the examples (as loaded with skip_no_answer): it is only called then.
+    """
+    path = cache_path(filename, model, cache_dir, skip_no_answer)
+    if not os.path.isfile(os.path.join(path, 'meta.json')):
+        examples = load()
+        logger.info('Caching %d vectorized examples to %s' %
+                    (len(examples), path))
+        build_cache(examples, model, path)
+    else:
+        logger.info('Using cached examples in %s' % path)
+    return CachedReaderDataset(path, single_answer)
+
+
+# ------------------------------------------------------------------------------
+# PyTorch dataset over a cache.
+# ------------------------------------------------------------------------------
+
+
+class CachedReaderDataset(Dataset):
+    """Drop-in replacement for ReaderDataset reading from a binary cache.
+
+    Arrays are memory mapped, so DataLoader workers share the same pages.
+    """
+
+    def __init__(self, path, single_answer=False):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != FORMAT_VERSION:
+            raise RuntimeError('Unsupported cache version %d in %s' %
+                               (meta['version'], path))
+        self.path = path
+        self.single_answer = single_answer
+        self.columns = {
+            name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+            for name in meta['columns']
+        }
+        self.num_examples = meta['num_examples']
+
+    def __len__(self):
+        return self.num_examples
+
+    def _slice(self, name, index, offsets=None, dtype=None):
+        offsets = self.columns[offsets or name.split('_')[0] + '_offsets']
+        start, end = offsets[index], offsets[index + 1]
+        return np.array(self.columns[name][start:end], dtype=dtype)
+
+    def __getitem__(self, index):
+        document = torch.from_numpy(self._slice('doc_words', index,
+                                                dtype=np.int64))
+        question = torch.from_numpy(self._slice('q_words', index,
+                                                dtype=np.int64))
+        features = None
+        if 'feat_ids' in self.columns or 'feat_values' in self.columns:
+            features = tuple(
+                torch.from_numpy(self._slice(name, index, 'doc_offsets',
+                                             dtype=dtype))
+                if name in self.columns else None
+                for name, dtype in (('feat_ids', np.int64),
+                                    ('feat_values', np.float32))
+            )
+        answers = self._slice('answers', index, 'ans_offsets')
+        ex_id = str(self.columns['ids'][index])
+
+        if self.single_answer:
+            assert(len(answers) > 0)
+            start = torch.LongTensor(1).fill_(int(answers[0][0]))
+            end = torch.LongTensor(1).fill_(int(answers[0][1]))
+        else:
+            start = [int(a[0]) for a in answers]
+            end = [int(a[1]) for a in answers]
+
+        return (document, None), features, (question, None), start, end, ex_id
+
+    def lengths(self):
+        doc_lens = np.diff(self.columns['doc_offsets'])
+        q_lens = np.diff(self.columns['q_offsets'])
+        return list(zip(doc_lens.tolist(), q_lens.tolist()))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Matching of candidate answer strings against tokenized paragraphs.
+
+A span of tokens matches a candidate if its untokenized text (or that text
+lower cased) is one of the candidates. Instead of building the text of every
+n-gram, the candidates are compiled once into an Aho-Corasick automaton over
+characters, and each paragraph is scanned in a single pass (twice: as is and
+lower cased). Occurrences are kept if they start and end on token boundaries.
+"""
+
+from collections import deque
+
+
+class CandidateMatcher(object):
+    """Aho-Corasick automaton over a set of candidate strings.
+
+    It only holds lists and dicts: compile it once in the parent process and
+    it is inherited by forked workers (and cheap to pickle if it's not).
+    """
+
+    def __init__(self, candidates):
+        # Node 0 is the root. For each node: its transitions, its failure
+        # link, the length of the candidate ending there (0 if none), and the
+        # closest node on its failure chain where a candidate ends.
+        self.goto = [{}]
+        self.length = [0]
+        self.num_candidates = 0
+        for candidate in set(candidates):
+            if candidate:
+                self._add(candidate)
+        self.fail = [0] * len(self.goto)
+        self.output = [0] * len(self.goto)
+        self._link()
+
+    def _add(self, candidate):
+        node = 0
+        for c in candidate:
+            if c not in self.goto[node]:
+                self.goto.append({})
+                self.length.append(0)
+                self.goto[node][c] = len(self.goto) - 1
+            node = self.goto[node][c]
+        self.length[node] = len(candidate)
+        self.num_candidates += 1
+
+    def _link(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and c not in self.goto[fail]:
+                    fail = self.fail[fail]
+                fail = self.goto[fail].get(c, 0)
+                self.fail[child] = fail
+                self.output[child] = fail if self.length[fail] else \
+                    self.output[fail]
+
+    def __len__(self):
+        return self.num_candidates
+
+    def find(self, text, ends):
+        """Yield (start, end) character offsets of the candidates occurring
+        in text, for the end offsets in ends only.
+        """
+        goto, fail, length, output = \
+            self.goto, self.fail, self.length, self.output
+        node = 0
+        for i, c in enumerate(text):
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            if i + 1 in ends:
+                match = node if length[node] else output[node]
+                while match:
+                    yield i + 1 - length[match], i + 1
+                    match = output[match]
+
+    def spans(self, tokens, max_len=None):
+        """Return the sorted (start, end) token indices (inclusive) of the
+        spans of tokens, at most max_len long, matching a candidate.
+        """
+        texts = [t[tokens.TEXT_WS] for t in tokens.data]
+        found = set()
+        for lower in (False, True):
+            if lower:
+                texts = [t.lower() for t in texts]
+            starts, ends = _boundaries(texts)
+            for s, e in self.find(''.join(texts), ends):
+                for start in starts.get(s, ()):
+                    for end in ends[e]:
+                        if start <= end and \
+                                (not max_len or end - start < max_len):
+                            found.add((start, end))
+        return sorted(found)
+
+
+def _boundaries(texts):
+    """Map the character offsets where the (stripped) text of a span can
+    start or end, to the tokens that can start or end it there.
+    """
+    starts, ends = {}, {}
+    offset = 0
+    for i, text in enumerate(texts):
+        start = offset + len(text) - len(text.lstrip())
+        end = offset + len(text.rstrip())
+        offset += len(text)
+        if start < end:
+            starts.setdefault(start, []).append(i)
+            ends.setdefault(end, []).append(i)
+    return starts, ends
+
+
+def compile_candidates(candidates):
+    """Return candidates as a CandidateMatcher (compiling it if needed)."""
+    if isinstance(candidates, CandidateMatcher):
+        return candidates
+    return CandidateMatcher(candidates)
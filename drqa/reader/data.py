@@ -9,6 +9,8 @@
 import numpy as np
 import logging
 import unicodedata
+import zlib
+import os
 
 from torch.utils.data import Dataset
 from torch.utils.data.sampler import Sampler
@@ -79,6 +81,166 @@ class Dictionary(object):
                   if k not in {'<NULL>', '<UNK>'}]
         return tokens
 
+    def index(self, tokens, normalized=False):
+        """Return the indices of a list of tokens.
+
+        If normalized, the tokens were already normalized (e.g. when the
+        examples were loaded) and are looked up as is.
+        """
+        if not normalized:
+            tokens = [self.normalize(t) for t in tokens]
+        get, unk = self.tok2ind.get, self.tok2ind.get(self.UNK)
+        return [get(t, unk) for t in tokens]
+
+
+class CompactDictionary(object):
+    """Read-only Dictionary backed by flat arrays instead of Python dicts.
+
+    Tokens are stored in index order as one UTF-8 blob with offsets, and
+    looked up through an open addressing hash table (crc32, linear probing)
+    of indices. The arrays can be saved and memory mapped, and are shared
+    (not copied) by forked DataLoader and pipeline workers.
+    """
+
+    NULL = Dictionary.NULL
+    UNK = Dictionary.UNK
+    START = Dictionary.START
+    normalize = staticmethod(Dictionary.normalize)
+
+    def __init__(self, blob, offsets, table):
+        """
+        Args:
+            blob: uint8 array, concatenated UTF-8 encoded tokens.
+            offsets: int64 array, token i is blob[offsets[i]:offsets[i + 1]].
+            table: int32 array (power of 2 size), token indices at their hash
+              slot, -1 for empty slots.
+        """
+        self.blob = blob
+        self.offsets = offsets
+        self.table = table
+        self._init_views()
+
+    def _init_views(self):
+        # Memoryviews are much faster than numpy for scalar access.
+        self._blob = memoryview(self.blob)
+        self._offsets = memoryview(self.offsets)
+        self._table = memoryview(self.table)
+        self._mask = len(self.table) - 1
+        self._unk = self._find(self.UNK)
+
+    @staticmethod
+    def from_dictionary(dictionary):
+        """Build from a Dictionary (keeping its indices)."""
+        keys = [dictionary[i].encode('utf-8') for i in range(len(dictionary))]
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum([len(k) for k in keys], out=offsets[1:])
+        blob = np.frombuffer(b''.join(keys), dtype=np.uint8)
+
+        table = np.full(1 << (2 * len(keys) - 1).bit_length(), -1,
+                        dtype=np.int32)
+        mask = len(table) - 1
+        for index, key in enumerate(keys):
+            slot = zlib.crc32(key) & mask
+            while table[slot] >= 0:
+                slot = (slot + 1) & mask
+            table[slot] = index
+        return CompactDictionary(blob, offsets, table)
+
+    def to_dictionary(self):
+        """Convert back to a (mutable) Dictionary."""
+        dictionary = Dictionary()
+        for index in range(len(self)):
+            dictionary[self[index]] = index
+            dictionary[index] = self[index]
+        return dictionary
+
+    def save(self, path):
+        """Save the arrays to directory path."""
+        os.makedirs(path, exist_ok=True)
+        for name in ('blob', 'offsets', 'table'):
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+
+    @staticmethod
+    def load(path, mmap=True):
+        """Load arrays saved in path, memory mapped unless mmap is False."""
+        mode = 'r' if mmap else None
+        return CompactDictionary(*[
+            np.load(os.path.join(path, name + '.npy'), mmap_mode=mode)
+            for name in ('blob', 'offsets', 'table')
+        ])
+
+    def __getstate__(self):
+        return {'blob': np.asarray(self.blob),
+                'offsets': np.asarray(self.offsets),
+                'table': np.asarray(self.table)}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_views()
+
+    def _token(self, index):
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return bytes(self._blob[start:end]).decode('utf-8')
+
+    def _find(self, token):
+        """Return the index of an (already normalized) token, or None."""
+        key = token.encode('utf-8')
+        slot = zlib.crc32(key) & self._mask
+        while True:
+            index = self._table[slot]
+            if index < 0:
+                return None
+            if self._blob[self._offsets[index]:self._offsets[index + 1]] == key:
+                return index
+            slot = (slot + 1) & self._mask
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __iter__(self):
+        return (self._token(i) for i in range(len(self)))
+
+    def __contains__(self, key):
+        if type(key) == int:
+            return 0 <= key < len(self)
+        elif type(key) == str:
+            return self._find(self.normalize(key)) is not None
+
+    def __getitem__(self, key):
+        if type(key) == int:
+            return self._token(key) if 0 <= key < len(self) else self.UNK
+        if type(key) == str:
+            index = self._find(self.normalize(key))
+            return self._unk if index is None else index
+
+    def __setitem__(self, key, item):
+        raise RuntimeError('CompactDictionary is read-only.')
+
+    def add(self, token):
+        raise RuntimeError('CompactDictionary is read-only.')
+
+    def tokens(self):
+        """Get dictionary tokens, except for special tokens."""
+        return [t for t in self if t not in {self.NULL, self.UNK}]
+
+    def index(self, tokens, normalized=False):
+        """Return the indices of a list of tokens (see Dictionary.index)."""
+        if not normalized:
+            tokens = [self.normalize(t) for t in tokens]
+        # _find, inlined.
+        blob, offsets, table = self._blob, self._offsets, self._table
+        mask, unk, crc32 = self._mask, self._unk, zlib.crc32
+        indices = []
+        for t in tokens:
+            key = t.encode('utf-8')
+            slot = crc32(key) & mask
+            index = table[slot]
+            while index >= 0 and blob[offsets[index]:offsets[index + 1]] != key:
+                slot = (slot + 1) & mask
+                index = table[slot]
+            indices.append(unk if index < 0 else index)
+        return indices
+
 
 # ------------------------------------------------------------------------------
 # PyTorch dataset class for SQuAD (and SQuAD-like) data.
@@ -115,17 +277,105 @@ class SortedBatchSampler(Sampler):
         self.batch_size = batch_size
         self.shuffle = shuffle
 
+    def batches(self):
+        indices = sort_by_length(self.lengths)
+        return [indices[i:i + self.batch_size]
+                for i in range(0, len(indices), self.batch_size)]
+
     def __iter__(self):
-        lengths = np.array(
-            [(-l[0], -l[1], np.random.random()) for l in self.lengths],
-            dtype=[('l1', np.int_), ('l2', np.int_), ('rand', np.float_)]
-        )
-        indices = np.argsort(lengths, order=('l1', 'l2', 'rand'))
-        batches = [indices[i:i + self.batch_size]
-                   for i in range(0, len(indices), self.batch_size)]
+        batches = self.batches()
         if self.shuffle:
             np.random.shuffle(batches)
         return iter([i for batch in batches for i in batch])
 
     def __len__(self):
         return len(self.lengths)
+
+
+def sort_by_length(lengths):
+    """Return indices sorted by decreasing (doc, question) length, with
+    random tie-breaking.
+    """
+    lengths = np.array(
+        [(-l[0], -l[1], np.random.random()) for l in lengths],
+        dtype=[('l1', np.int_), ('l2', np.int_), ('rand', np.float_)]
+    )
+    return np.argsort(lengths, order=('l1', 'l2', 'rand'))
+
+
+# ------------------------------------------------------------------------------
+# PyTorch batch sampler packing sorted examples under a token budget.
+# ------------------------------------------------------------------------------
+
+
+class TokenBudgetBatchSampler(Sampler):
+    """Yield batches of length-sorted examples whose padded document size
+    (longest document x batch size) stays within max_tokens. Use as the
+    batch_sampler of a DataLoader.
+    """
+
+    def __init__(self, lengths, max_tokens, shuffle=True, max_batch_size=None):
+        """
+        Args:
+            lengths: list of (document, question) lengths.
+            max_tokens: budget of padded document tokens per batch. A single
+              example longer than that still gets its own batch.
+            shuffle: shuffle the order of the batches (not their content).
+            max_batch_size: optional cap on the number of examples per batch.
+        """
+        self.lengths = lengths
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.max_batch_size = max_batch_size
+        # Batch sizes only depend on the sorted lengths, not on tie-breaking.
+        self.num_batches = len(self.batches())
+
+    def batches(self):
+        batches, batch, longest = [], [], 0
+        for idx in sort_by_length(self.lengths):
+            # Sorted by decreasing length: the first example is the longest.
+            longest = longest or self.lengths[idx][0]
+            over_budget = longest * (len(batch) + 1) > self.max_tokens
+            full = self.max_batch_size and len(batch) >= self.max_batch_size
+            if batch and (over_budget or full):
+                batches.append(batch)
+                batch, longest = [], self.lengths[idx][0]
+            batch.append(idx)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __iter__(self):
+        batches = self.batches()
+        if self.shuffle:
+            np.random.shuffle(batches)
+        return iter(batches)
+
+    def __len__(self):
+        return self.num_batches
+
+
+def padding_efficiency(lengths, batches):
+    """Fraction of the padded tensors that holds real tokens.
+
+    Args:
+        lengths: list of (document, question) lengths.
+        batches: list of batches of example indices.
+    Output:
+        (document efficiency, question efficiency)
+    """
+    real, padded = np.zeros(2), np.zeros(2)
+    for batch in batches:
+        batch_lengths = np.array([lengths[i] for i in batch]).reshape(-1, 2)
+        real += batch_lengths.sum(0)
+        padded += batch_lengths.max(0) * len(batch)
+    return tuple(real / np.maximum(padded, 1))
+
+
+def log_padding_efficiency(sampler, name='Batches'):
+    """Log the padding efficiency of a sampler (with a batches() method)."""
+    batches = sampler.batches()
+    doc, question = padding_efficiency(sampler.lengths, batches)
+    logger.info('%s: %d batches | padding efficiency: document = %.1f%% | '
+                'question = %.1f%%' % (name, len(batches), 100 * doc,
+                                       100 * question))
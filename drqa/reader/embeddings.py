@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Pretrained embedding files and their binary cache.
+
+The first time a (space separated, text) embedding file is used, it is
+converted into a float32 matrix saved as .npy next to it, along with the list
+of its normalized words. Later uses memory map the matrix and only read the
+rows that are needed. If the cache cannot be written, the text file is parsed
+as before.
+"""
+
+import os
+import json
+import logging
+import numpy as np
+
+from .data import Dictionary
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+# ------------------------------------------------------------------------------
+# Cache.
+# ------------------------------------------------------------------------------
+
+
+def cache_path(embedding_file):
+    return embedding_file + '.cache'
+
+
+def _source_info(embedding_file):
+    stat = os.stat(embedding_file)
+    return {'version': FORMAT_VERSION, 'size': stat.st_size,
+            'mtime': stat.st_mtime}
+
+
+def build_cache(embedding_file, path):
+    """Convert embedding_file into a words list + vectors matrix in path."""
+    logger.info('Caching embeddings of %s to %s' % (embedding_file, path))
+    with open(embedding_file) as f:
+        dim = len(f.readline().rstrip().split(' ')) - 1
+        num_words = 1 + sum(1 for _ in f)
+
+    os.makedirs(path, exist_ok=True)
+    vectors = np.lib.format.open_memmap(
+        os.path.join(path, 'vectors.npy'), mode='w+', dtype=np.float32,
+        shape=(num_words, dim)
+    )
+    with open(embedding_file) as f, \
+            open(os.path.join(path, 'words.txt'), 'w', encoding='utf-8',
+                 newline='\n') as f_words:
+        for i, line in enumerate(f):
+            parsed = line.rstrip().split(' ')
+            assert(len(parsed) == dim + 1)
+            f_words.write(Dictionary.normalize(parsed[0]) + '\n')
+            vectors[i] = [float(v) for v in parsed[1:]]
+    vectors.flush()
+    del vectors
+
+    # Written last: marks the cache as complete.
+    meta = _source_info(embedding_file)
+    meta.update({'num_words': num_words, 'dim': dim})
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def load_cache(embedding_file, build=True):
+    """Return (normalized words, memory mapped vectors) of embedding_file,
+    building the cache if needed. Return None if it can't be.
+    """
+    path = cache_path(embedding_file)
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if any(meta[k] != v for k, v in _source_info(embedding_file).items()):
+            raise ValueError('Stale cache')
+    except (IOError, ValueError, KeyError):
+        if not build:
+            return None
+        try:
+            build_cache(embedding_file, path)
+        except (IOError, OSError) as e:
+            logger.warning('WARN: Could not cache embeddings (%s)' % e)
+            return None
+
+    # Split on \n only: words may contain other line breaks.
+    with open(os.path.join(path, 'words.txt'), encoding='utf-8',
+              newline='') as f:
+        words = f.read().split('\n')[:-1]
+    vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+    return words, vectors
+
+
+# ------------------------------------------------------------------------------
+# Loading.
+# ------------------------------------------------------------------------------
+
+
+def index_words(embedding_file):
+    """Return the set of (normalized) words in embedding_file."""
+    cache = load_cache(embedding_file)
+    if cache is not None:
+        return set(cache[0])
+    words = set()
+    with open(embedding_file) as f:
+        for line in f:
+            w = Dictionary.normalize(line.rstrip().split(' ')[0])
+            words.add(w)
+    return words
+
+
+def load_vectors(embedding_file, words, dim):
+    """Read the vectors of the given (normalized) words in embedding_file.
+    Words that appear several times (once normalized) get the average of
+    their vectors, summed in file order.
+
+    Output:
+        found: list of words that have a vector.
+        vectors: float32 array of their vectors, len(found) x dim.
+    """
+    cache = load_cache(embedding_file)
+    if cache is None:
+        return _parse_vectors(embedding_file, words, dim)
+    all_words, all_vectors = cache
+    assert(all_vectors.shape[1] == dim)
+
+    # Row of each occurrence, and the output position of its word.
+    rows, position, found = [], {}, []
+    for row, w in enumerate(all_words):
+        if w in words:
+            if w not in position:
+                position[w] = len(found)
+                found.append(w)
+            rows.append(row)
+
+    targets = np.array([position[all_words[r]] for r in rows], dtype=np.int64)
+    counts = np.bincount(targets, minlength=len(found))
+    vectors = np.zeros((len(found), dim), dtype=np.float32)
+    np.add.at(vectors, targets, all_vectors[rows])
+    duplicates = counts > 1
+    if duplicates.any():
+        logger.warning('WARN: Duplicate embeddings found for %d words' %
+                       duplicates.sum())
+        vectors[duplicates] /= counts[duplicates, None].astype(np.float32)
+    return found, vectors
+
+
+def _parse_vectors(embedding_file, words, dim):
+    """load_vectors, reading the text file."""
+    vec_sums, vec_counts, found = {}, {}, []
+    with open(embedding_file) as f:
+        for line in f:
+            parsed = line.rstrip().split(' ')
+            assert(len(parsed) == dim + 1)
+            w = Dictionary.normalize(parsed[0])
+            if w in words:
+                vec = np.array([float(i) for i in parsed[1:]],
+                               dtype=np.float32)
+                if w not in vec_counts:
+                    vec_counts[w] = 1
+                    vec_sums[w] = vec
+                    found.append(w)
+                else:
+                    logger.warning('WARN: Duplicate embedding found for %s' % w)
+                    vec_counts[w] = vec_counts[w] + 1
+                    vec_sums[w] += vec
+    vectors = np.zeros((len(found), dim), dtype=np.float32)
+    for i, w in enumerate(found):
+        vectors[i] = vec_sums[w] / np.float32(vec_counts[w])
+    return found, vectors
@@ -174,7 +174,7 @@ class FusionNetReader(nn.Module):
         """Inputs:
         x1 = document word indices             [batch * len_d]
         x1_mask = document padding mask        [batch * len_d]
-        x1_f = document word features indices  [batch * len_d * nfeat]
+        x1_f = document word features          (ids, values) compact pair
         x2 = question word indices             [batch * len_q]
         x2_mask = question padding mask        [batch * len_q]
         """
@@ -207,7 +207,9 @@ class FusionNetReader(nn.Module):
 
         # Add manual features
         if self.args.num_features > 0:
-            drnn_input.append(x1_f)
+            drnn_input.append(layers.expand_features(
+                x1_f, self.args.feature_value_cols, self.args.num_features
+            ))
 
         # Encode document with RNN shape: [batch, len_d, 2*hidden_size]
         low_level_doc_hiddens = self.reading_low_level_doc_rnn(torch.cat(drnn_input, 2), x1_mask)
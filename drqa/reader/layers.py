@@ -13,6 +13,15 @@ from torch.nn.parameter import Parameter
 from torch.autograd import Variable
 import math
 
+
+def is_tracing():
+    """True while the network is traced for export (see
+    reader/backends.py, export_graph).
+    """
+    tracing = getattr(torch.jit, 'is_tracing', None)
+    return tracing is not None and tracing()
+
+
 # ------------------------------------------------------------------------------
 # Modules
 # ------------------------------------------------------------------------------
@@ -55,7 +64,10 @@ class StackedBRNN(nn.Module):
         Output:
             x_encoded: batch * len * hdim_encoded
         """
-        if x_mask.data.sum() == 0:
+        if is_tracing():
+            # Padding-aware, and without data dependent branches.
+            output = self._forward_padded(x, x_mask)
+        elif x_mask.data.sum() == 0:
             # No padding necessary.
             output = self._forward_unpadded(x, x_mask)
         elif self.padding or not self.training:
@@ -107,13 +119,20 @@ class StackedBRNN(nn.Module):
         padding.
         """
         # Compute sorted sequence lengths
-        lengths = x_mask.data.eq(0).long().sum(1).squeeze()  # batch
+        # When tracing, everything derived from the mask must stay in the
+        # graph (not be recorded as constants).
+        tracing = is_tracing()
+        mask = x_mask if tracing else x_mask.data
+        lengths = mask.eq(0).long().sum(1).view(-1)  # batch
         _, idx_sort = torch.sort(lengths, dim=0, descending=True)  # index of batch with length from big to small
         _, idx_unsort = torch.sort(idx_sort, dim=0)
 
-        lengths = list(lengths[idx_sort])
-        idx_sort = Variable(idx_sort)
-        idx_unsort = Variable(idx_unsort)
+        if tracing:
+            lengths = lengths[idx_sort]
+        else:
+            lengths = list(lengths[idx_sort])
+            idx_sort = Variable(idx_sort)
+            idx_unsort = Variable(idx_unsort)
 
         # Sort x
         x = x.index_select(0, idx_sort)
@@ -139,8 +158,9 @@ class StackedBRNN(nn.Module):
             outputs.append(self.rnns[i](rnn_input)[0])
 
         # Unpack everything
+        unpack = {'total_length': x_mask.size(1)} if tracing else {}
         for i, o in enumerate(outputs[1:], 1):
-            outputs[i] = nn.utils.rnn.pad_packed_sequence(o)[0]  # len * batch * hdim
+            outputs[i] = nn.utils.rnn.pad_packed_sequence(o, **unpack)[0]  # len * batch * hdim
 
         # Concat hidden layers or take final
         if self.concat_layers:
@@ -189,13 +209,12 @@ class BoundaryPointerLayer(nn.Module):
         self.lstm = rnn_type(2 * input_size, hidden_size)
         self.answer_attn = PerceptronSeqAttn(hidden_size, normalize)
 
-    def init_hidden(self, batch_size):
+    def init_hidden(self, batch_size, cuda=False):
         # Before we've done anything, we dont have any hidden state.
         # Refer to the Pytorch documentation to see exactly
         # why they have this dimensionality.
         # The axes semantics are (num_layers, minibatch_size, hidden_dim)
-        return (Variable(torch.zeros(1, batch_size, self.hidden_size).cuda(async=True)),
-                Variable(torch.zeros(1, batch_size, self.hidden_size).cuda(async=True)))
+        return init_hidden(batch_size, self.hidden_size, cuda)
 
     def forward(self, h_hiddens, h_hiddens_mask):
         """
@@ -212,7 +231,7 @@ class BoundaryPointerLayer(nn.Module):
         else:
             inputs = h_hiddens
 
-        (ha, ca) = self.init_hidden(batch_size)
+        (ha, ca) = self.init_hidden(batch_size, h_hiddens.data.is_cuda)
         # answer start
         answer_start_score = self.answer_attn(ha.transpose(0, 1), h_hiddens, h_hiddens_mask)  # batch * p_len
         weighted_p = torch.bmm(answer_start_score.unsqueeze(1), h_hiddens)  # batch * 1 * 2hdim
@@ -257,7 +276,7 @@ class PerceptronSeqAttn(nn.Module):
         expn = attn.expand([attn.size(0), seq_len, attn.size(2)])  # batch * seq_len * hdim
         f = F.tanh(self.linear_v(hr) + expn)  # batch * seq_len * hdim
         score = self.linear_beta(f).squeeze(2)  # batch * seq_len
-        score.data.masked_fill_(hr_mask.data, -float('inf'))
+        score = masked_fill(score, hr_mask, -float('inf'))
 
         padding = torch.sum(hr_mask.data.eq(1).long().sum(1).squeeze())
         if self.normalize:
@@ -290,10 +309,9 @@ class MatchLSTMLayer(nn.Module):
         self.blstm = rnn_type(2 * input_size, hidden_size)
         self.match_attn = MatchAttn(hidden_size)
 
-    def init_hidden(self, batch_size):
+    def init_hidden(self, batch_size, cuda=False):
         # The axes semantics are (num_layers, minibatch_size, hidden_dim)
-        return (Variable(torch.zeros(1, batch_size, self.hidden_size).cuda(async=True)),
-                Variable(torch.zeros(1, batch_size, self.hidden_size).cuda(async=True)))
+        return init_hidden(batch_size, self.hidden_size, cuda)
 
     def forward(self, q_hiddens, q_hiddens_mask, p_hiddens, p_hiddens_mask):
         """
@@ -315,12 +333,11 @@ class MatchLSTMLayer(nn.Module):
 
         for i in range(batch_size):
             if lengths[i] < p_len:  # if lengths[i] == p_len, do nothing
-                indices = Variable(torch.cat((torch.arange(lengths[i] - 1, -1, -1),
-                                              torch.arange(lengths[i], p_len))).long().cuda())
+                indices = reverse_indices(lengths[i], p_len, p_hiddens.data.is_cuda)
                 rp_hiddens[i, :, :] = rp_hiddens[i, :, :].index_select(0, indices)
 
-        (hr, cr) = self.init_hidden(batch_size)
-        (rhr, rcr) = self.init_hidden(batch_size)
+        (hr, cr) = self.init_hidden(batch_size, p_hiddens.data.is_cuda)
+        (rhr, rcr) = self.init_hidden(batch_size, p_hiddens.data.is_cuda)
         h_hiddens = [hr]
         rh_hiddens = [rhr]
 
@@ -359,8 +376,7 @@ class MatchLSTMLayer(nn.Module):
         # reverse concrete hiddens in rp_hiddens
         for i in range(batch_size):
             if lengths[i] < p_len:
-                indices = Variable(torch.cat((torch.arange(lengths[i] - 1, -1, -1),
-                                              torch.arange(lengths[i], p_len))).long().cuda())
+                indices = reverse_indices(lengths[i], p_len, p_hiddens.data.is_cuda)
                 rh_hiddens[i, :, :] = rh_hiddens[i, :, :].index_select(0, indices)
 
         h_hiddens = torch.cat((h_hiddens, rh_hiddens), dim=2)
@@ -405,7 +421,7 @@ class MatchAttn(nn.Module):
         expn = attn.expand([attn.size(0), seq_len, attn.size(2)])  # batch * seq_len * hdim
         g = F.tanh(self.linear_q(hq) + expn)  # batch * seq_len * hdim
         score = self.linear_g(g).squeeze(2)  # batch * seq_len
-        score.data.masked_fill_(hq_mask.data, -float('inf'))
+        score = masked_fill(score, hq_mask, -float('inf'))
         alpha = F.softmax(score)
         return alpha
 
@@ -463,7 +479,7 @@ class SymBilinearAttnMatch(nn.Module):
 
         # Mask padding
         y_mask = y_mask.unsqueeze(1).expand(scores.size())  # batch * 1 * len2 ==> batch * len1 * len2
-        scores.data.masked_fill_(y_mask.data, -float('inf'))
+        scores = masked_fill(scores, y_mask, -float('inf'))
 
         # Normalize with softmax
         alpha_flat = F.softmax(scores.view(-1, y.size(1)))  # (batch * len1) * len2
@@ -512,7 +528,7 @@ class SeqAttnMatch(nn.Module):
 
         # Mask padding
         y_mask = y_mask.unsqueeze(1).expand(scores.size())  # batch * 1 * len2 ==> batch * len1 * len2
-        scores.data.masked_fill_(y_mask.data, -float('inf'))
+        scores = masked_fill(scores, y_mask, -float('inf'))
 
         # Normalize with softmax
         alpha_flat = F.softmax(scores.view(-1, y.size(1)))  # batch * len2
@@ -552,7 +568,7 @@ class BilinearSeqAttn(nn.Module):
         """
         Wy = self.linear(y) if self.linear is not None else y  # Wy  batch * x_size
         xWy = x.bmm(Wy.unsqueeze(2)).squeeze(2)  # Wy.unsqueeze(2)  batch * x_size * 1
-        xWy.data.masked_fill_(x_mask.data, -float('inf'))
+        xWy = masked_fill(xWy, x_mask, -float('inf'))
         if self.normalize:
             if self.training and self.log_normalize:
                 # In training we output log-softmax for NLL
@@ -585,7 +601,7 @@ class LinearSeqAttn(nn.Module):
         """
         x_flat = x.view(-1, x.size(-1))
         scores = self.linear(x_flat).view(x.size(0), x.size(1))
-        scores.data.masked_fill_(x_mask.data, -float('inf'))
+        scores = masked_fill(scores, x_mask, -float('inf'))
         alpha = F.softmax(scores)
         return alpha
 
@@ -595,6 +611,37 @@ class LinearSeqAttn(nn.Module):
 # ------------------------------------------------------------------------------
 
 
+def masked_fill(x, mask, value):
+    """Fill x with value where mask is 1: in place on the data, or recorded in
+    the graph while tracing.
+    """
+    if is_tracing():
+        return x.masked_fill(mask, value)
+    x.data.masked_fill_(mask.data, value)
+    return x
+
+
+def init_hidden(batch_size, hidden_size, cuda=False):
+    """Zero (h, c) state of a single layer LSTM: 1 * batch * hidden_size."""
+    h = torch.zeros(1, batch_size, hidden_size)
+    c = torch.zeros(1, batch_size, hidden_size)
+    if cuda:
+        h = h.cuda(non_blocking=True)
+        c = c.cuda(non_blocking=True)
+    return Variable(h), Variable(c)
+
+
+def reverse_indices(length, max_len, cuda=False):
+    """Indices reversing the first length steps of a sequence of max_len,
+    leaving the padding in place.
+    """
+    indices = torch.cat((torch.arange(length - 1, -1, -1),
+                         torch.arange(length, max_len))).long()
+    if cuda:
+        indices = indices.cuda()
+    return Variable(indices)
+
+
 def uniform_weights(x, x_mask):
     """Return uniform weights over non-masked x (a sequence of vectors).
 
@@ -622,3 +669,34 @@ def weighted_avg(x, weights):
         x_avg: batch * hdim
     """
     return weights.unsqueeze(1).bmm(x).squeeze(1)
+
+
+def expand_features(x_f, value_cols, num_features):
+    """Expand compact manual features (see vector.compact_features) into the
+    dense one-hot + real valued layout the network is trained on.
+
+    Args:
+        x_f: (ids, values) pair, or already dense features.
+          ids: batch * len * ngroups, (column + 1) of the active one-hot
+            feature of each group, 0 for none (or padding).
+          values: batch * len * nvalues, real-valued feature columns.
+        value_cols: dense column of each of the values.
+        num_features: total number of dense feature columns.
+    Output:
+        x_f: batch * len * num_features
+    """
+    if not isinstance(x_f, (tuple, list)):
+        return x_f
+    ids, values = x_f
+    ref = ids.data if ids is not None else values.data
+
+    # One extra leading column collects the "none" ids; dropped at the end.
+    dense = torch.zeros(ref.size(0), ref.size(1), num_features + 1)
+    if ref.is_cuda:
+        dense = dense.cuda()
+    if ids is not None:
+        dense.scatter_(2, ids.data, 1)
+    if values is not None:
+        cols = ref.new([c + 1 for c in value_cols]).long()
+        dense.index_copy_(2, cols, values.data)
+    return Variable(dense[:, :, 1:].contiguous())
@@ -90,7 +90,7 @@ class mLSTMDocReader(nn.Module):
     def forward(self, x1, x1_f, x1_mask, x2, x2_mask):
         """Inputs:
         x1 = document word indices             [batch * len_d]
-        x1_f = document word features indices  [batch * len_d * nfeat]
+        x1_f = document word features          (ids, values) compact pair
         x1_mask = document padding mask        [batch * len_d]
         x2 = question word indices             [batch * len_q]
         x2_mask = question padding mask        [batch * len_q]
@@ -111,7 +111,9 @@ class mLSTMDocReader(nn.Module):
 
         # Add manual features
         if self.args.num_features > 0:
-            drnn_input.append(x1_f)
+            drnn_input.append(layers.expand_features(
+                x1_f, self.args.feature_value_cols, self.args.num_features
+            ))
 
         # Encode document with RNN
         doc_hiddens = self.doc_rnn(torch.cat(drnn_input, 2), x1_mask)
@@ -13,17 +13,42 @@ import torch.nn.functional as F
 import numpy as np
 import logging
 import copy
+import os
 
 from torch.autograd import Variable
 from .config import override_model_args
-from .rnn_reader import RnnDocReader
-from .mLSTM_reader import mLSTMDocReader
-from .bidaf_reader import BidafDocReader
-from .fusionnet_reader import FusionNetReader
+from .vector import feature_value_columns, share_questions
+from .data import CompactDictionary
+from .candidates import compile_candidates
+from ..common.metrics import METRICS
+from . import embeddings
 
 logger = logging.getLogger(__name__)
 
 
+def to_variable(e, cuda=False, volatile=False):
+    """Wrap a batch input (a tensor, None, or a tuple of those, e.g. compact
+    features) in Variables, optionally transferring to GPU.
+    """
+    if e is None:
+        return None
+    if isinstance(e, (tuple, list)):
+        return tuple(to_variable(i, cuda, volatile) for i in e)
+    if cuda:
+        e = e.cuda(non_blocking=True)
+    return Variable(e, volatile=volatile)
+
+
+class ReadyResult(object):
+    """An already computed result, with the AsyncResult get() interface."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
 class DocReader(object):
     """High level module that handles intializing the underlying network
     architecture, saving, updating examples, and predicting examples.
@@ -44,19 +69,27 @@ class DocReader(object):
         if self.character_dict:
             self.args.character_vocab_size = len(character_dict)
         self.args.num_features = len(feature_dict)
+        self.args.feature_value_cols = feature_value_columns(feature_dict)
         self.updates = 0
         self.use_cuda = False
         self.parallel = False
+        self.quantized = False
+        self.backend = None
 
         # Building network. If normalize if false, scores are not normalized
-        # 0-1 per paragraph (no softmax).
+        # 0-1 per paragraph (no softmax). Network modules are imported here so
+        # that only the requested architecture (and its deps, e.g. cove) load.
         if args.model_type.lower() == 'drqa':
+            from .rnn_reader import RnnDocReader
             self.network = RnnDocReader(args, normalize)
         elif args.model_type.lower() == 'mlstm':
+            from .mLSTM_reader import mLSTMDocReader
             self.network = mLSTMDocReader(args, normalize)
         elif args.model_type.lower() == 'bidaf':
+            from .bidaf_reader import BidafDocReader
             self.network = BidafDocReader(args)
         elif args.model_type.lower() == 'fusionnet':
+            from .fusionnet_reader import FusionNetReader
             self.network = FusionNetReader(args)
         else:
             raise RuntimeError('Unsupported module: %s' % args.model_type)
@@ -86,8 +119,17 @@ class DocReader(object):
         # Add words to dictionary and expand embedding layer
         if len(to_add) > 0:
             logger.info('Adding %d new words to dictionary...' % len(to_add))
+            # A CompactDictionary (e.g. from a bundle) is read-only: expand a
+            # copy, then compact it again.
+            compact = isinstance(self.word_dict, CompactDictionary)
+            if compact:
+                self.word_dict = self.word_dict.to_dictionary()
             for w in to_add:
                 self.word_dict.add(w)
+            if compact:
+                self.word_dict = CompactDictionary.from_dictionary(
+                    self.word_dict
+                )
             self.args.vocab_size = len(self.word_dict)
             logger.info('New vocab size: %d' % len(self.word_dict))
 
@@ -101,6 +143,14 @@ class DocReader(object):
         # Return added words
         return to_add
 
+    def compact_dictionary(self):
+        """Switch to a read-only CompactDictionary (e.g. for inference, once
+        the dictionary was expanded). Its arrays are shared by forked workers
+        instead of being copied along with Python dicts.
+        """
+        if not isinstance(self.word_dict, CompactDictionary):
+            self.word_dict = CompactDictionary.from_dictionary(self.word_dict)
+
     def load_embeddings(self, words, embedding_file):
         """Load pretrained embeddings for a given list of words, if they exist.
 
@@ -115,29 +165,18 @@ class DocReader(object):
         embedding = self.network.embedding.weight.data
 
         # When normalized, some words are duplicated. (Average the embeddings).
-        vec_counts = {}
-        with open(embedding_file) as f:
-            for line in f:
-                parsed = line.rstrip().split(' ')
-                assert(len(parsed) == embedding.size(1) + 1)
-                w = self.word_dict.normalize(parsed[0])
-                if w in words:
-                    vec = torch.Tensor([float(i) for i in parsed[1:]])
-                    if w not in vec_counts:
-                        vec_counts[w] = 1
-                        embedding[self.word_dict[w]].copy_(vec)
-                    else:
-                        logging.warning(
-                            'WARN: Duplicate embedding found for %s' % w
-                        )
-                        vec_counts[w] = vec_counts[w] + 1
-                        embedding[self.word_dict[w]].add_(vec)
-
-        for w, c in vec_counts.items():
-            embedding[self.word_dict[w]].div_(c)
+        words = {self.word_dict.normalize(w) for w in words}
+        found, vectors = embeddings.load_vectors(embedding_file, words,
+                                                 embedding.size(1))
+        if len(found) > 0:
+            index = torch.LongTensor(self.word_dict.index(found, normalized=True))
+            vectors = torch.from_numpy(vectors)
+            if embedding.is_cuda:
+                index, vectors = index.cuda(), vectors.cuda()
+            embedding.index_copy_(0, index, vectors)
 
         logger.info('Loaded %d embeddings (%.2f%%)' %
-                    (len(vec_counts), 100 * len(vec_counts) / len(words)))
+                    (len(found), 100 * len(found) / len(words)))
 
     def tune_embeddings(self, words):
         """Unfix the embeddings of a list of words. This is only relevant if
@@ -223,26 +262,10 @@ class DocReader(object):
         self.network.train()
 
         # Transfer to GPU
-        if self.use_cuda:
-            if self.character_dict:
-                inputs = [e if e is None else Variable(e.cuda(async=True))
-                          for e in ex[:9]]
-                target_s = Variable(ex[9].cuda(async=True))
-                target_e = Variable(ex[10].cuda(async=True))
-            else:
-                inputs = [e if e is None else Variable(e.cuda(async=True))
-                          for e in ex[:5]]
-                target_s = Variable(ex[5].cuda(async=True))
-                target_e = Variable(ex[6].cuda(async=True))
-        else:
-            if self.character_dict:
-                inputs = [e if e is None else Variable(e) for e in ex[:9]]
-                target_s = Variable(ex[9])
-                target_e = Variable(ex[10])
-            else:
-                inputs = [e if e is None else Variable(e) for e in ex[:5]]
-                target_s = Variable(ex[5])
-                target_e = Variable(ex[6])
+        num_inputs = 9 if self.character_dict else 5
+        inputs = [to_variable(e, self.use_cuda) for e in ex[:num_inputs]]
+        target_s = to_variable(ex[num_inputs], self.use_cuda)
+        target_e = to_variable(ex[num_inputs + 1], self.use_cuda)
 
         # Run forward
         score_s, score_e = self.network(*inputs)
@@ -323,30 +346,31 @@ class DocReader(object):
         # Eval mode
         self.network.eval()
 
-        # Transfer to GPU
-        if self.use_cuda:
-            if self.character_dict:
-                inputs = [e if e is None else
-                          Variable(e.cuda(async=True), volatile=True)
-                          for e in ex[:9]]
-            else:
-                inputs = [e if e is None else
-                          Variable(e.cuda(async=True), volatile=True)
-                          for e in ex[:5]]
-        else:
-            if self.character_dict:
-                inputs = [e if e is None else Variable(e, volatile=True)
-                          for e in ex[:9]]
+        # Run forward, through the exported graph if a backend is set
+        num_inputs = 9 if self.character_dict else 5
+        with METRICS.timer('reader_forward_seconds'):
+            if self.backend is not None:
+                score_s, score_e = self.backend.forward(self, ex[:num_inputs])
             else:
-                inputs = [e if e is None else Variable(e, volatile=True)
-                          for e in ex[:5]]
-
-        # Run forward
-        score_s, score_e = self.network(*inputs)
-
-        # Decode predictions
-        score_s = score_s.data.cpu()
-        score_e = score_e.data.cpu()
+                # Encode each distinct question once, if the network can
+                inputs = list(ex[:num_inputs])
+                if getattr(self.network, 'SHARES_QUESTIONS', False):
+                    inputs[3], inputs[4], q_index = \
+                        share_questions(*inputs[3:5])
+                    if q_index is not None:
+                        inputs.append(q_index)
+                        if METRICS.enabled:
+                            METRICS.count('question_cache_hits',
+                                          ex[3].size(0) - inputs[3].size(0))
+
+                # Transfer to GPU, and run without recording the graph
+                inputs = [to_variable(e, self.use_cuda) for e in inputs]
+                with torch.no_grad():
+                    score_s, score_e = self.network(*inputs)
+
+            # Decode predictions
+            score_s = score_s.data.cpu()
+            score_e = score_e.data.cpu()
         if candidates:
             args = (score_s, score_e, candidates, top_n, self.args.max_len)
             if async_pool:
@@ -354,48 +378,60 @@ class DocReader(object):
             else:
                 return self.decode_candidates(*args)
         else:
-            args = (score_s, score_e, top_n, self.args.max_len)
+            # Cheap enough to do here, rather than shipping scores to a pool.
+            with METRICS.timer('reader_decode_seconds'):
+                result = self.decode(score_s, score_e, top_n,
+                                     self.args.max_len)
             if async_pool:
-                return async_pool.apply_async(self.decode, args)
+                return ReadyResult(result)
             else:
-                return self.decode(*args)
+                return result
 
     @staticmethod
     def decode(score_s, score_e, top_n=1, max_len=None):
         """Take argmax of constrained score_s * score_e.
 
+        Only the band of spans up to max_len long is scored, for the whole
+        batch at once (batch * len * max_len instead of len * len per
+        example). Ties go to the earliest span, as with a full argmax.
+
         Args:
             score_s: independent start predictions
             score_e: independent end predictions
             top_n: number of top scored pairs to take
             max_len: max span length to consider
         """
-        pred_s = []
-        pred_e = []
-        pred_score = []
-        max_len = max_len or score_s.size(1)
-        for i in range(score_s.size(0)):
-            # Outer product of scores to get full p_s * p_e matrix
-            scores = torch.ger(score_s[i], score_e[i])
-
-            # Zero out negative length and over-length span scores
-            scores.triu_().tril_(max_len - 1)
-
-            # Take argmax or top n
-            scores = scores.numpy()
-            scores_flat = scores.flatten()
-            if top_n == 1:
-                idx_sort = [np.argmax(scores_flat)]
-            elif len(scores_flat) < top_n:
-                idx_sort = np.argsort(-scores_flat)
-            else:
-                idx = np.argpartition(-scores_flat, top_n)[0:top_n]
-                idx_sort = idx[np.argsort(-scores_flat[idx])]
-            s_idx, e_idx = np.unravel_index(idx_sort, scores.shape)
-            pred_s.append(s_idx)
-            pred_e.append(e_idx)
-            pred_score.append(scores_flat[idx_sort])
-        return pred_s, pred_e, pred_score
+        score_s = score_s.numpy()
+        score_e = score_e.numpy()
+        batch_size, length = score_s.shape
+        width = min(max_len or length, length)
+
+        # band[i, s, k] = score_s[i, s] * score_e[i, s + k], read through
+        # sliding windows over the (padded) end scores.
+        padded = np.zeros((batch_size, length + width - 1), dtype=score_e.dtype)
+        padded[:, :length] = score_e
+        windows = np.lib.stride_tricks.as_strided(
+            padded, shape=(batch_size, length, width),
+            strides=(padded.strides[0], padded.strides[1], padded.strides[1])
+        )
+        band = score_s[:, :, None] * windows
+        valid = (np.arange(length)[:, None] + np.arange(width)) < length
+        band[:, ~valid] = -np.inf
+        band = band.reshape(batch_size, -1)
+
+        # Take argmax or top n
+        rows = np.arange(batch_size)[:, None]
+        top_n = min(top_n, int(valid.sum()))
+        if top_n == 1:
+            idx = band.argmax(axis=1)[:, None]
+        else:
+            idx = np.argpartition(-band, top_n - 1, axis=1)[:, :top_n]
+            order = np.lexsort((idx, -band[rows, idx]))
+            idx = idx[rows, order]
+        pred_s = idx // width
+        pred_e = pred_s + idx % width
+        pred_score = band[rows, idx]
+        return list(pred_s), list(pred_e), list(pred_score)
 
     @staticmethod
     def decode_candidates(score_s, score_e, candidates, top_n=1, max_len=None):
@@ -405,6 +441,7 @@ class DocReader(object):
         pred_s = []
         pred_e = []
         pred_score = []
+        matchers = {}
         for i in range(score_s.size(0)):
             # Extract original tokens stored with candidates
             tokens = candidates[i]['input']
@@ -417,17 +454,17 @@ class DocReader(object):
             if not cands:
                 raise RuntimeError('No candidates given.')
 
+            # Compile plain candidate lists/sets once per batch.
+            if id(cands) not in matchers:
+                matchers[id(cands)] = compile_candidates(cands)
+            cands = matchers[id(cands)]
+
             # Score all valid candidates found in text.
-            # Brute force get all ngrams and compare against the candidate list.
-            max_len = max_len or len(tokens)
             scores, s_idx, e_idx = [], [], []
-            for s, e in tokens.ngrams(n=max_len, as_strings=False):
-                span = tokens.slice(s, e).untokenize()
-                if span in cands or span.lower() in cands:
-                    # Match! Record its score.
-                    scores.append(score_s[i][s] * score_e[i][e - 1])
-                    s_idx.append(s)
-                    e_idx.append(e - 1)
+            for s, e in cands.spans(tokens, max_len):
+                scores.append(score_s[i][s] * score_e[i][e])
+                s_idx.append(s)
+                e_idx.append(e)
 
             if len(scores) == 0:
                 # No candidates present
@@ -451,6 +488,8 @@ class DocReader(object):
     # --------------------------------------------------------------------------
 
     def save(self, filename):
+        if self.quantized:
+            raise RuntimeError('Quantized models can not be saved.')
         state_dict = copy.copy(self.network.state_dict())
         if 'fixed_embedding' in state_dict:
             state_dict.pop('fixed_embedding')
@@ -483,6 +522,10 @@ class DocReader(object):
 
     @staticmethod
     def load(filename, new_args=None, normalize=True):
+        # Serving bundle (see bundle.export_bundle)?
+        if os.path.isdir(filename):
+            from .bundle import load_bundle
+            return load_bundle(filename, new_args, normalize)
         logger.info('Loading module %s' % filename)
         saved_params = torch.load(
             filename, map_location=lambda storage, loc: storage
@@ -530,3 +573,23 @@ class DocReader(object):
         """
         self.parallel = True
         self.network = torch.nn.DataParallel(self.network)
+
+    def set_backend(self, backend='eager', path=None):
+        """Run the network with backend: 'eager' (this module, default), or
+        'torchscript' / 'onnx' (on CPU), loading the graph exported to path
+        (see backends.export_graph).
+        """
+        if backend != 'eager' and self.use_cuda:
+            raise RuntimeError('The %s backend is CPU only.' % backend)
+        from .backends import get_backend
+        self.backend = get_backend(backend, path)
+
+    def quantize(self, embedding=False):
+        """Switch to int8 inference on CPU (see quantize.py), optionally with
+        8-bit word embeddings. The model can't be trained or saved afterwards.
+        """
+        if self.use_cuda or self.parallel:
+            raise RuntimeError('Quantized inference is CPU only.')
+        from .quantize import quantize_network
+        self.network = quantize_network(self.network, embedding)
+        self.quantized = True
@@ -65,6 +65,11 @@ class Predictor(object):
             words = utils.index_embedding_words(embedding_file)
             added = self.model.expand_dictionary(words)
             self.model.load_embeddings(added, embedding_file)
+            # Share the (large) expanded vocabulary with worker processes.
+            self.model.compact_dictionary()
+
+        # Time spent in the reader itself (vs. tokenizing).
+        self.reader_timer = utils.Timer().stop()
 
         logger.info('Initializing tokenizer...')
         annotators = tokenizers.get_annotators_for_model(self.model)
@@ -126,7 +131,9 @@ class Predictor(object):
 
         # Build the batch and run it through the module
         batch_exs = batchify([vectorize(e, self.model) for e in examples])
+        self.reader_timer.resume()
         s, e, score = self.model.predict(batch_exs, candidates, top_n)
+        self.reader_timer.stop()
 
         # Retrieve the predicted spans
         results = []
@@ -143,3 +150,6 @@ class Predictor(object):
 
     def cpu(self):
         self.model.cpu()
+
+    def quantize(self, embedding=False):
+        self.model.quantize(embedding)
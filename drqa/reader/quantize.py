@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Int8 inference mode for reader networks (CPU only).
+
+The recurrent (LSTM/GRU) and Linear layers are replaced with their dynamic
+quantized versions: weights are stored as int8, activations are quantized on
+the fly. Optionally, the word embedding matrix is stored with 8 bits per
+value too (with a scale and offset per row).
+"""
+
+import logging
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+
+class QuantizedEmbedding(nn.Module):
+    """Embedding lookup over a matrix stored as uint8, row-wise affine."""
+
+    def __init__(self, embedding):
+        super(QuantizedEmbedding, self).__init__()
+        weight = embedding.weight.data.float()
+        low = weight.min(1, keepdim=True)[0]
+        scale = (weight.max(1, keepdim=True)[0] - low) / 255
+        codes = ((weight - low) / scale.clamp(min=1e-12)).round()
+        self.num_embeddings, self.embedding_dim = weight.size()
+        self.padding_idx = embedding.padding_idx
+        self.register_buffer('codes', codes.byte())
+        self.register_buffer('scale', scale)
+        self.register_buffer('low', low)
+
+    def forward(self, x):
+        return self.codes[x].float() * self.scale[x] + self.low[x]
+
+
+def _dynamic_types():
+    """Module types that dynamic quantization supports here."""
+    quantized = getattr(getattr(torch.nn, 'quantized', None), 'dynamic', None)
+    if quantized is None:
+        return set()
+    return {getattr(nn, name) for name in
+            ('Linear', 'LSTM', 'GRU', 'LSTMCell', 'GRUCell', 'RNNCell')
+            if hasattr(quantized, name)}
+
+
+def quantize_network(network, embedding=False):
+    """Quantize (in place) the RNN and Linear layers of a reader network,
+    and optionally its word embeddings. Inference only.
+    """
+    quantization = getattr(torch, 'quantization', None)
+    if quantization is None or not hasattr(quantization, 'quantize_dynamic'):
+        raise RuntimeError('Dynamic quantization needs PyTorch >= 1.3 '
+                           '(found %s)' % torch.__version__)
+    network.eval()
+    types = _dynamic_types()
+    logger.info('Quantizing %s to int8' %
+                ', '.join(sorted(t.__name__ for t in types)))
+    network = quantization.quantize_dynamic(network, types, dtype=torch.qint8,
+                                            inplace=True)
+    if embedding:
+        logger.info('Quantizing word embeddings to uint8')
+        network.embedding = QuantizedEmbedding(network.embedding)
+        if hasattr(network, 'fixed_embedding'):
+            del network.fixed_embedding
+    return network
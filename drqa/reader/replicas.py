@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Pool of DocReader replicas for multi-process CPU inference.
+
+Replicas are worker processes that all map the same network weights instead
+of each holding a private copy:
+    - given a DocReader, its network is moved to shared memory before the
+      replicas are started (forked), and they use it in place.
+    - given the path of a serving bundle (see bundle.py), every replica loads
+      it; its memory mapped arrays are shared through the page cache.
+Batches are queued and picked up by whichever replica is idle; results are
+handed back in submission order.
+"""
+
+import os
+import queue
+import logging
+import traceback
+import torch
+import torch.multiprocessing as mp
+
+from .model import DocReader
+
+logger = logging.getLogger(__name__)
+
+
+def _serve(model, normalize, threads, initializer, initargs, tasks, results):
+    """Replica loop: predict batches from tasks until None is received."""
+    torch.set_num_threads(threads)
+    if initializer is not None:
+        initializer(*initargs)
+    if isinstance(model, str):
+        model = DocReader.load(model, normalize=normalize)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        index, batch, candidates, top_n = task
+        try:
+            results.put((index, model.predict(batch, candidates, top_n), None))
+        except Exception:
+            results.put((index, None, traceback.format_exc()))
+
+
+class ReplicaResult(object):
+    """Handle on the result of a submitted batch (like AsyncResult)."""
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+
+    def get(self):
+        return self.pool._get(self.index)
+
+
+class ReplicaPool(object):
+    """Dispatch batches to DocReader replicas in worker processes."""
+
+    # Seconds between checks that the replicas are alive, while waiting.
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, model, num_replicas=None, threads=None, normalize=True,
+                 initializer=None, initargs=()):
+        """
+        Args:
+            model: a DocReader, or the path of a serving bundle (or .mdl
+              file, but then each replica holds its own copy).
+            num_replicas: number of worker processes (default cpu count).
+            threads: torch threads per replica (default cpus / replicas).
+            normalize: passed to DocReader.load when model is a path.
+            initializer, initargs: optionally called in each replica first.
+        """
+        if isinstance(model, DocReader):
+            if model.use_cuda:
+                raise RuntimeError('Replicas are for CPU inference only.')
+            model.network.share_memory()
+        elif not os.path.isdir(model):
+            logger.warning('WARN: %s is not a serving bundle, each replica '
+                           'will load its own copy of it.' % model)
+
+        cpus = os.cpu_count() or 1
+        num_replicas = num_replicas or cpus
+        threads = threads or max(1, cpus // num_replicas)
+        logger.info('Starting %d reader replicas (%d threads each)' %
+                    (num_replicas, threads))
+
+        context = mp.get_context('fork')
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.replicas = [
+            context.Process(target=_serve, daemon=True, args=(
+                model, normalize, threads, initializer, initargs,
+                self.tasks, self.results
+            ))
+            for _ in range(num_replicas)
+        ]
+        for replica in self.replicas:
+            replica.start()
+        self.submitted = 0
+        self.done = {}
+
+    def submit(self, batch, candidates=None, top_n=1):
+        """Queue a batch for prediction (see DocReader.predict).
+
+        Output:
+            ReplicaResult, whose get() returns (pred_s, pred_e, pred_score).
+        """
+        index = self.submitted
+        self.submitted += 1
+        self.tasks.put((index, batch, candidates, top_n))
+        return ReplicaResult(self, index)
+
+    def _get(self, index):
+        while index not in self.done:
+            try:
+                i, result, error = self.results.get(
+                    timeout=self.POLL_INTERVAL
+                )
+            except queue.Empty:
+                # A replica killed by a signal (e.g. OOM) never reports back.
+                for k, replica in enumerate(self.replicas):
+                    if not replica.is_alive():
+                        raise RuntimeError(
+                            'Reader replica %d died (exit code %s)' %
+                            (k, replica.exitcode)
+                        )
+                continue
+            if error:
+                raise RuntimeError('Reader replica failed:\n%s' % error)
+            self.done[i] = result
+        return self.done.pop(index)
+
+    def imap(self, batches, candidates=None, top_n=1):
+        """Predict batches (and their candidates, if given), yielding
+        results in order.
+        """
+        candidates = candidates or [None] * len(batches)
+        handles = [self.submit(b, c, top_n)
+                   for b, c in zip(batches, candidates)]
+        for handle in handles:
+            yield handle.get()
+
+    def map(self, batches, candidates=None, top_n=1):
+        return list(self.imap(batches, candidates, top_n))
+
+    def close(self):
+        """Stop the replicas (after pending batches)."""
+        for replica in self.replicas:
+            if replica.is_alive():
+                self.tasks.put(None)
+        for replica in self.replicas:
+            replica.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
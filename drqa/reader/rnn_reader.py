@@ -19,6 +19,9 @@ from . import layers
 class RnnDocReader(nn.Module):
     RNN_TYPES = {'lstm': nn.LSTM, 'gru': nn.GRU, 'rnn': nn.RNN}
 
+    # forward() accepts q_index (see vector.share_questions).
+    SHARES_QUESTIONS = True
+
     def __init__(self, args, normalize=True):
         super(RnnDocReader, self).__init__()
         # Store config
@@ -87,14 +90,19 @@ class RnnDocReader(nn.Module):
             normalize=normalize,
         )
 
-    def forward(self, x1, x1_f, x1_mask, x2, x2_mask):
+    def forward(self, x1, x1_f, x1_mask, x2, x2_mask, q_index=None):
         """Inputs:
         x1 = document word indices             [batch * len_d]
-        x1_f = document word features indices  [batch * len_d * nfeat]
+        x1_f = document word features          (ids, values) compact pair
         x1_mask = document padding mask        [batch * len_d]
         x2 = question word indices             [batch * len_q]
         x2_mask = question padding mask        [batch * len_q]
+        q_index = optional, question of each document [batch]: then x2 and
+          x2_mask only hold the distinct questions, encoded once each.
         """
+        def expand(x):
+            return x if q_index is None else x.index_select(0, q_index)
+
         # Embed both document and question
         x1_emb = self.embedding(x1)
         x2_emb = self.embedding(x2)
@@ -111,12 +119,15 @@ class RnnDocReader(nn.Module):
 
         # Add attention-weighted question representation
         if self.args.use_qemb:
-            x2_weighted_emb = self.qemb_match(x1_emb, x2_emb, x2_mask)  # batch * len_d
+            x2_weighted_emb = self.qemb_match(x1_emb, expand(x2_emb),
+                                              expand(x2_mask))  # batch * len_d
             drnn_input.append(x2_weighted_emb)
 
         # Add manual features
         if self.args.num_features > 0:
-            drnn_input.append(x1_f)
+            drnn_input.append(layers.expand_features(
+                x1_f, self.args.feature_value_cols, self.args.num_features
+            ))
 
         # Encode document with RNN
         doc_hiddens = self.doc_rnn(torch.cat(drnn_input, 2), x1_mask)
@@ -127,7 +138,9 @@ class RnnDocReader(nn.Module):
             q_merge_weights = layers.uniform_weights(question_hiddens, x2_mask)
         elif self.args.question_merge == 'self_attn':
             q_merge_weights = self.self_attn(question_hiddens, x2_mask)
-        question_hidden = layers.weighted_avg(question_hiddens, q_merge_weights)
+        question_hidden = expand(
+            layers.weighted_avg(question_hiddens, q_merge_weights)
+        )
 
         # Predict start and end positions
         start_scores = self.start_attn(doc_hiddens, question_hidden, x1_mask)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Streaming of reader examples from sharded JSON-lines files.
+
+Examples are read lazily (one line at a time) from one or more sources, each
+a list of shard files with a mixing weight, instead of being loaded in memory
+all at once. Batches are formed inside a bounded buffer: the buffered
+examples are sorted by length, cut into batches and the batches shuffled, so
+memory use only depends on the buffer size, not on the size of the corpus.
+"""
+
+import glob
+import json
+import random
+import logging
+import os
+
+from .data import sort_by_length, TokenBudgetBatchSampler
+from .utils import prepare_example
+from .vector import vectorize, BatchCollator
+
+try:
+    from torch.utils.data import IterableDataset, get_worker_info
+    HAS_ITERABLE_DATASET = True
+except ImportError:
+    IterableDataset = object
+    HAS_ITERABLE_DATASET = False
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------------------
+# Sources.
+# ------------------------------------------------------------------------------
+
+
+def parse_sources(specs, data_dir=''):
+    """Parse source specs of the form 'pattern[:weight]'.
+
+    Args:
+        specs: list of specs; pattern is a file or glob of shard files
+          (relative to data_dir), weight defaults to 1.
+        data_dir: directory relative patterns resolve against.
+    Output:
+        list of (sorted list of files, weight) tuples.
+    """
+    sources = []
+    for spec in specs:
+        pattern, weight = spec, 1.0
+        if ':' in spec:
+            head, tail = spec.rsplit(':', 1)
+            try:
+                pattern, weight = head, float(tail)
+            except ValueError:
+                pass
+        files = sorted(glob.glob(os.path.join(data_dir, pattern)))
+        if len(files) == 0:
+            raise IOError('No such file: %s' % os.path.join(data_dir, pattern))
+        sources.append((files, weight))
+    return sources
+
+
+class ExampleStream(object):
+    """Re-iterable stream of (raw) examples mixed from sharded sources.
+
+    Each iteration is an epoch. Inside a DataLoader worker, each worker reads
+    its own share of the data: whole shards if a source has at least as many
+    shards as there are workers, else every n-th line of it.
+    """
+
+    def __init__(self, sources, args, skip_no_answer=False, epoch_size=0,
+                 rank=0, world_size=1):
+        """
+        Args:
+            sources: list of (files, weight), see parse_sources.
+            args: options with uncased_question/uncased_doc.
+            skip_no_answer: drop examples without answers.
+            epoch_size: number of examples per epoch. If 0, each source is
+              read once (weights only set how they are interleaved). Else
+              sources are drawn from proportionally to their weights, and
+              restarted when exhausted.
+            rank, world_size: optional extra sharding level (e.g. one per
+              training process), on top of DataLoader workers.
+        """
+        self.sources = sources
+        self.args = args
+        self.skip_no_answer = skip_no_answer
+        self.epoch_size = epoch_size
+        self.rank = rank
+        self.world_size = world_size
+
+    def _shard(self):
+        """Return (index, count) of this reader among all readers."""
+        info = get_worker_info() if HAS_ITERABLE_DATASET else None
+        worker, num_workers = (info.id, info.num_workers) if info else (0, 1)
+        return (self.rank * num_workers + worker,
+                self.world_size * num_workers)
+
+    def _read(self, files, index, count):
+        """Yield this reader's examples of one pass over a source."""
+        if len(files) >= count:
+            files, index, count = files[index::count], 0, 1
+        line_no = 0
+        for filename in files:
+            with open(filename) as f:
+                for line in f:
+                    line_no += 1
+                    if (line_no - 1) % count != index:
+                        continue
+                    ex = json.loads(line)
+                    if self.skip_no_answer and len(ex['answers']) == 0:
+                        continue
+                    yield prepare_example(self.args, ex)
+
+    def _cycle(self, files, index, count):
+        """Like _read, restarting at the end (unless the source is empty)."""
+        while True:
+            empty = True
+            for ex in self._read(files, index, count):
+                empty = False
+                yield ex
+            if empty:
+                return
+
+    def __iter__(self):
+        index, count = self._shard()
+        read = self._cycle if self.epoch_size else self._read
+        readers = [read(files, index, count) for files, _ in self.sources]
+        weights = [weight for _, weight in self.sources]
+
+        # This reader's share of the epoch.
+        if self.epoch_size:
+            limit = self.epoch_size // count
+            limit += 1 if index < self.epoch_size % count else 0
+        else:
+            limit = None
+
+        num_examples = 0
+        while readers and (limit is None or num_examples < limit):
+            i = self._choose(weights)
+            try:
+                ex = next(readers[i])
+            except StopIteration:
+                del readers[i], weights[i]
+                continue
+            num_examples += 1
+            yield ex
+
+    @staticmethod
+    def _choose(weights):
+        r = random.random() * sum(weights)
+        for i, weight in enumerate(weights):
+            r -= weight
+            if r < 0:
+                return i
+        return len(weights) - 1
+
+
+# ------------------------------------------------------------------------------
+# PyTorch iterable dataset of batches.
+# ------------------------------------------------------------------------------
+
+
+class ShardedReaderDataset(IterableDataset):
+    """Stream of collated batches of examples read from an ExampleStream.
+
+    Examples are vectorized in the reading process and bucketed by length
+    within a buffer of buffer_size examples, into batches of batch_size or,
+    if max_tokens, of up to max_tokens padded document tokens (see
+    data.TokenBudgetBatchSampler). Use with a DataLoader with
+    batch_size=None, or iterate over it directly (single process).
+    """
+
+    def __init__(self, examples, model, batch_size, buffer_size=10000,
+                 single_answer=False, shuffle=True, max_tokens=0):
+        self.examples = examples
+        self.model = model
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.buffer_size = max(buffer_size, batch_size)
+        self.single_answer = single_answer
+        self.shuffle = shuffle
+        self.collator = BatchCollator()
+
+    def _flush(self, buffer):
+        lengths = [(len(ex['document']), len(ex['question'])) for ex in buffer]
+        if self.max_tokens > 0:
+            batches = TokenBudgetBatchSampler(lengths, self.max_tokens,
+                                              shuffle=False).batches()
+        else:
+            indices = sort_by_length(lengths)
+            batches = [indices[i:i + self.batch_size]
+                       for i in range(0, len(indices), self.batch_size)]
+        if self.shuffle:
+            random.shuffle(batches)
+        for batch in batches:
+            yield self.collator([
+                vectorize(buffer[i], self.model, self.single_answer)
+                for i in batch
+            ])
+
+    def __iter__(self):
+        buffer = []
+        for ex in self.examples:
+            buffer.append(ex)
+            if len(buffer) == self.buffer_size:
+                for batch in self._flush(buffer):
+                    yield batch
+                buffer = []
+        for batch in self._flush(buffer):
+            yield batch
@@ -14,6 +14,7 @@ import regex as re
 
 from collections import Counter
 from .data import Dictionary
+from . import embeddings
 
 logger = logging.getLogger(__name__)
 
@@ -31,13 +32,9 @@ def load_data(args, filename, skip_no_answer=False):
     with open(filename) as f:
         examples = [json.loads(line) for line in f]
 
-    # Make case insensitive?
-    if args.uncased_question or args.uncased_doc:
-        for ex in examples:
-            if args.uncased_question:
-                ex['question'] = [w.lower() for w in ex['question']]
-            if args.uncased_doc:
-                ex['document'] = [w.lower() for w in ex['document']]
+    # Make case insensitive? (and normalize words once, for lookups)
+    for ex in examples:
+        prepare_example(args, ex)
 
     # Skip unparsed (start/end) examples
     if skip_no_answer:
@@ -46,6 +43,20 @@ def load_data(args, filename, skip_no_answer=False):
     return examples
 
 
+def prepare_example(args, ex):
+    """Lower-case question and/or document words in place, per args. Their
+    normalized forms are added as question_norm and document_norm, to be
+    looked up in dictionaries without normalizing (the original words are
+    kept for characters).
+    """
+    for field, uncased in (('question', args.uncased_question),
+                           ('document', args.uncased_doc)):
+        if uncased:
+            ex[field] = [w.lower() for w in ex[field]]
+        ex[field + '_norm'] = [Dictionary.normalize(w) for w in ex[field]]
+    return ex
+
+
 def load_text(filename):
     """Load the paragraphs only of a SQuAD dataset. Store as qid -> text."""
     # Load JSON file
@@ -107,12 +118,7 @@ def load_questions(filename):
 
 def index_embedding_words(embedding_file):
     """Put all the words in embedding_file into a set."""
-    words = set()
-    with open(embedding_file) as f:
-        for line in f:
-            w = Dictionary.normalize(line.rstrip().split(' ')[0])
-            words.add(w)
-    return words
+    return embeddings.index_words(embedding_file)
 
 
 def load_words(args, examples):
@@ -7,6 +7,7 @@
 """Functions for putting examples into torch format."""
 
 from collections import Counter
+import numpy as np
 import torch
 
 
@@ -17,58 +18,25 @@ def vectorize(ex, model, single_answer=False):
     feature_dict = model.feature_dict
     character_dict = model.character_dict
 
-    # Index words
-    document = torch.LongTensor([word_dict[w] for w in ex['document']])
-    question = torch.LongTensor([word_dict[w] for w in ex['question']])
+    # Index words (skip normalization if done when loading the example)
+    document = torch.LongTensor(index_words(word_dict, ex, 'document'))
+    question = torch.LongTensor(index_words(word_dict, ex, 'question'))
 
-    # Index chars
+    # Index chars: (flat char ids, length of each word)
     if args.use_char_emb and model.character_dict is not None:
-        document_chars = [torch.LongTensor([character_dict[c] for c in w]) for w in ex['document']]
-        question_chars = [torch.LongTensor([character_dict[c] for c in w]) for w in ex['question']]
+        document_chars = index_chars(ex['document'], character_dict)
+        question_chars = index_chars(ex['question'], character_dict)
     else:
         document_chars = None
         question_chars = None
 
-    # Create extra features vector
+    # Create extra features: (one-hot ids, real values), expanded by the network
     if len(feature_dict) > 0:
-        features = torch.zeros(len(ex['document']), len(feature_dict))
+        features = tuple(f if f is None else torch.from_numpy(f)
+                         for f in compact_features(ex, args, feature_dict))
     else:
         features = None
 
-    # f_{exact_match}
-    if args.use_in_question:
-        q_words_cased = {w for w in ex['question']}
-        q_words_uncased = {w.lower() for w in ex['question']}
-        q_lemma = {w for w in ex['qlemma']} if args.use_lemma else None
-        for i in range(len(ex['document'])):
-            if ex['document'][i] in q_words_cased:
-                features[i][feature_dict['in_question']] = 1.0
-            if ex['document'][i].lower() in q_words_uncased:
-                features[i][feature_dict['in_question_uncased']] = 1.0
-            if q_lemma and ex['lemma'][i] in q_lemma:
-                features[i][feature_dict['in_question_lemma']] = 1.0
-
-    # f_{token} (POS)
-    if args.use_pos:
-        for i, w in enumerate(ex['pos']):
-            f = 'pos=%s' % w
-            if f in feature_dict:
-                features[i][feature_dict[f]] = 1.0
-
-    # f_{token} (NER)
-    if args.use_ner:
-        for i, w in enumerate(ex['ner']):
-            f = 'ner=%s' % w
-            if f in feature_dict:
-                features[i][feature_dict[f]] = 1.0
-
-    # f_{token} (TF)
-    if args.use_tf:
-        counter = Counter([w.lower() for w in ex['document']])
-        l = len(ex['document'])
-        for i, w in enumerate(ex['document']):
-            features[i][feature_dict['tf']] = counter[w.lower()] * 1.0 / l
-
     # Maybe return without target
     if 'answers' not in ex:
         return (document, document_chars), features, (question, question_chars), ex['id']
@@ -85,80 +53,229 @@ def vectorize(ex, model, single_answer=False):
     return (document, document_chars), features, (question, question_chars), start, end, ex['id']
 
 
-def batchify(batch):
-    """Gather a batch of individual examples into one batch."""
+def index_chars(words, character_dict):
+    """Index the characters of words as one flat LongTensor, along with
+    the LongTensor of word lengths.
+    """
+    return (torch.LongTensor([character_dict[c] for w in words for c in w]),
+            torch.LongTensor([len(w) for w in words]))
+
+
+# Features with one active value per token, stored as ids instead of one-hots.
+FEATURE_GROUPS = ('pos', 'ner')
+
+
+def feature_value_columns(feature_dict):
+    """Return the columns of real-valued (i.e. not grouped one-hot) features,
+    in column order.
+    """
+    return sorted(i for f, i in feature_dict.items()
+                  if f.split('=')[0] not in FEATURE_GROUPS)
+
+
+def index_words(word_dict, ex, field):
+    """Dictionary indices of the words of ex[field], through its normalized
+    form (see utils.prepare_example) if the example has one.
+    """
+    if field + '_norm' in ex:
+        return word_dict.index(ex[field + '_norm'], normalized=True)
+    return word_dict.index(ex[field])
+
+
+def compact_features(ex, args, feature_dict):
+    """Build the manual features of a document in compact form.
+
+    Output:
+        ids: len_d * ngroups, for each one-hot group (pos, ner) the feature
+          column + 1 of the token's tag, 0 if unseen in training. None if no
+          groups are used.
+        values: len_d * nvalues, the real-valued feature columns (see
+          feature_value_columns). None if there are none.
+    """
+    document = ex['document']
+    doc_uncased = [w.lower() for w in document]
+    value_cols = feature_value_columns(feature_dict)
+    position = {c: i for i, c in enumerate(value_cols)}
+    values = np.zeros((len(document), len(value_cols)), dtype=np.float32)
+
+    # f_{exact_match}
+    if args.use_in_question and len(document) > 0:
+        # Compare normalized forms, if the example has them.
+        question = ex.get('question_norm', ex['question'])
+        d_words = ex.get('document_norm', document)
+        q_words_cased = set(question)
+        q_words_uncased = {w.lower() for w in question}
+        values[:, position[feature_dict['in_question']]] = \
+            [w in q_words_cased for w in d_words]
+        values[:, position[feature_dict['in_question_uncased']]] = \
+            [w.lower() in q_words_uncased for w in d_words]
+        q_lemma = set(ex['qlemma']) if args.use_lemma else None
+        if q_lemma:
+            values[:, position[feature_dict['in_question_lemma']]] = \
+                [w in q_lemma for w in ex['lemma']]
+
+    # f_{token} (POS, NER)
+    groups = [name for name, enabled in zip(FEATURE_GROUPS,
+                                            (args.use_pos, args.use_ner))
+              if enabled]
+    ids = np.zeros((len(document), len(groups)), dtype=np.int64)
+    for j, name in enumerate(groups):
+        ids[:, j] = [feature_dict.get('%s=%s' % (name, w), -1) + 1
+                     for w in ex[name]]
+
+    # f_{token} (TF)
+    if args.use_tf and len(document) > 0:
+        counter = Counter(doc_uncased)
+        counts = np.array([counter[w] for w in doc_uncased], dtype=np.float64)
+        values[:, position[feature_dict['tf']]] = counts / len(document)
+
+    return (ids if len(groups) > 0 else None,
+            values if len(value_cols) > 0 else None)
+
+
+class BatchCollator(object):
+    """Gather vectorized examples into padded batches in bulk.
+
+    Every padded tensor is filled from the flat concatenation of its rows with
+    a single masked assignment, instead of row by row (and word by word for
+    characters).
+
+    With reuse_buffers, the arrays backing the output are kept and overwritten
+    by the next batch, so a batch is only valid until the next call. Only use
+    it when batches are consumed one at a time in the collating process (e.g.
+    a DataLoader with num_workers = 0).
+    """
+
     NUM_INPUTS = 3
     NUM_TARGETS = 2
     NUM_EXTRA = 1
 
-    ids = [ex[-1] for ex in batch]
-    docs = [ex[0][0] for ex in batch]
-    docs_chars = [ex[0][1] for ex in batch if ex[0][1] is not None]
-    features = [ex[1] for ex in batch]
-    questions = [ex[2][0] for ex in batch]
-    questions_chars = [ex[2][1] for ex in batch if ex[2][1] is not None]
-
-    use_chars = True if len(docs_chars) > 0 else False
-
-    # Batch documents and features
-    max_length = max([d.size(0) for d in docs])
-    x1 = torch.LongTensor(len(docs), max_length).zero_()
-    x1_mask = torch.ByteTensor(len(docs), max_length).fill_(1)
-    if features[0] is None:
-        x1_f = None
-    else:
-        x1_f = torch.zeros(len(docs), max_length, features[0].size(1))
-    for i, d in enumerate(docs):
-        x1[i, :d.size(0)].copy_(d)
-        x1_mask[i, :d.size(0)].fill_(0)
-        if x1_f is not None:
-            x1_f[i, :d.size(0)].copy_(features[i])
-
-    # Batch chars of documents
-    if use_chars:
-        max_chars_length = max([w.size(0) for d in docs_chars for w in d])
-        x1_char = torch.LongTensor(len(docs), max_length, max_chars_length).zero_()
-        x1_char_mask = torch.ByteTensor(len(docs), max_length, max_chars_length).fill_(1)
-
-        for i, d in enumerate(docs_chars):
-            for j, w in enumerate(d):
-                x1_char[i, j, :w.size(0)].copy_(w)
-                x1_char_mask[i, j, :w.size(0)].fill_(0)
-
-    # Batch questions
-    max_length = max([q.size(0) for q in questions])
-    x2 = torch.LongTensor(len(questions), max_length).zero_()
-    x2_mask = torch.ByteTensor(len(questions), max_length).fill_(1)
-    for i, q in enumerate(questions):
-        x2[i, :q.size(0)].copy_(q)
-        x2_mask[i, :q.size(0)].fill_(0)
-
-    # Batch chars of questions
-    if questions_chars:
-        max_chars_length = max([w.size(0) for d in questions_chars for w in d])
-        x2_char = torch.LongTensor(len(questions_chars), max_length, max_chars_length).zero_()
-        x2_char_mask = torch.ByteTensor(len(questions_chars), max_length, max_chars_length).fill_(1)
-    for i, d in enumerate(questions_chars):
-        for j, w in enumerate(d):
-            x2_char[i, j, :w.size(0)].copy_(w)
-            x2_char_mask[i, j, :w.size(0)].fill_(0)
-
-    # Maybe return without targets (i.e. no answers)
-    if len(batch[0]) == NUM_INPUTS + NUM_EXTRA:
-        return x1, x1_f, x1_mask, x2, x2_mask, ids
-
-    elif len(batch[0]) == NUM_INPUTS + NUM_EXTRA + NUM_TARGETS:
-        # ...Otherwise add targets
-        if torch.is_tensor(batch[0][3]):
-            y_s = torch.cat([ex[3] for ex in batch])
-            y_e = torch.cat([ex[4] for ex in batch])
+    def __init__(self, reuse_buffers=False):
+        self.reuse_buffers = reuse_buffers
+        self.buffers = {}
+
+    def _full(self, key, shape, dtype, value=0):
+        """Return an array of the given shape filled with value."""
+        size = int(np.prod(shape))
+        buf = self.buffers.get(key)
+        if buf is None or buf.size < size or buf.dtype != dtype:
+            buf = np.empty(size, dtype=dtype)
+            if self.reuse_buffers:
+                self.buffers[key] = buf
+        array = buf[:size].reshape(shape)
+        array.fill(value)
+        return array
+
+    def _scatter(self, key, valid, flat):
+        """Place the rows of flat at the valid positions of a zero array."""
+        padded = self._full(key, valid.shape + flat.shape[1:], flat.dtype)
+        padded[valid] = flat
+        return torch.from_numpy(padded)
+
+    def _mask(self, key, valid):
+        """Padding mask: 1 where not valid."""
+        mask = self._full(key, valid.shape, np.uint8, 1)
+        mask[valid] = 0
+        return torch.from_numpy(mask)
+
+    def _pad(self, key, flat, lengths):
+        """Pad flat into len(lengths) x max(lengths) (plus a mask)."""
+        valid = np.arange(lengths.max()) < lengths[..., None]
+        return (self._scatter(key, valid, flat),
+                self._mask(key + '_mask', valid), valid)
+
+    def _pad_words(self, key, seqs):
+        lengths = np.array([s.size(0) for s in seqs])
+        return self._pad(key, torch.cat(seqs).numpy(), lengths)
+
+    def _pad_chars(self, key, chars, valid_words):
+        """Pad (flat chars, word lengths) pairs to batch * words * chars."""
+        word_lengths = np.zeros(valid_words.shape, dtype=np.int64)
+        word_lengths[valid_words] = torch.cat([c[1] for c in chars]).numpy()
+        flat = torch.cat([c[0] for c in chars]).numpy()
+        x_char, x_char_mask, _ = self._pad(key, flat, word_lengths)
+        return x_char, x_char_mask
+
+    def __call__(self, batch):
+        ids = [ex[-1] for ex in batch]
+        features = [ex[1] for ex in batch]
+        docs_chars = [ex[0][1] for ex in batch if ex[0][1] is not None]
+        questions_chars = [ex[2][1] for ex in batch if ex[2][1] is not None]
+
+        # Batch documents and features
+        x1, x1_mask, x1_valid = self._pad_words('x1', [ex[0][0] for ex in batch])
+
+        # Features stay compact: (ids, values), each padded with zeros
+        if features[0] is None:
+            x1_f = None
         else:
-            y_s = [ex[3] for ex in batch]
-            y_e = [ex[4] for ex in batch]
-    else:
-        raise RuntimeError('Incorrect number of inputs per example.')
+            x1_f = tuple(
+                None if f is None else self._scatter(
+                    'x1_f%d' % j, x1_valid,
+                    torch.cat([ex_f[j] for ex_f in features]).numpy()
+                )
+                for j, f in enumerate(features[0])
+            )
+
+        # Batch questions
+        x2, x2_mask, x2_valid = self._pad_words('x2', [ex[2][0] for ex in batch])
+
+        # Batch chars
+        use_chars = len(docs_chars) > 0
+        if use_chars:
+            x1_char, x1_char_mask = self._pad_chars('x1_char', docs_chars,
+                                                    x1_valid)
+        if questions_chars:
+            x2_char, x2_char_mask = self._pad_chars('x2_char', questions_chars,
+                                                    x2_valid)
 
-    if use_chars:
-        return x1, x1_mask, x1_char, x1_char_mask, x1_f, x2, x2_mask, x2_char, x2_char_mask, y_s, y_e, ids
+        # Maybe return without targets (i.e. no answers)
+        if len(batch[0]) == self.NUM_INPUTS + self.NUM_EXTRA:
+            return x1, x1_f, x1_mask, x2, x2_mask, ids
 
-    return x1, x1_f, x1_mask, x2, x2_mask, y_s, y_e, ids
+        elif len(batch[0]) == self.NUM_INPUTS + self.NUM_EXTRA + self.NUM_TARGETS:
+            # ...Otherwise add targets
+            if torch.is_tensor(batch[0][3]):
+                y_s = torch.cat([ex[3] for ex in batch])
+                y_e = torch.cat([ex[4] for ex in batch])
+            else:
+                y_s = [ex[3] for ex in batch]
+                y_e = [ex[4] for ex in batch]
+        else:
+            raise RuntimeError('Incorrect number of inputs per example.')
+
+        if use_chars:
+            return x1, x1_mask, x1_char, x1_char_mask, x1_f, x2, x2_mask, x2_char, x2_char_mask, y_s, y_e, ids
+
+        return x1, x1_f, x1_mask, x2, x2_mask, y_s, y_e, ids
+
+
+_collator = BatchCollator()
+
+
+def share_questions(x2, x2_mask):
+    """Find the distinct questions of a batch (e.g. one question read against
+    many paragraphs), so that they can be encoded once.
+
+    Output:
+        x2, x2_mask: of the distinct questions only, in order of appearance.
+        q_index: LongTensor, the question of each example; None if all
+          questions are distinct (inputs returned unchanged).
+    """
+    first, q_index, seen = [], [], {}
+    for i, row in enumerate(x2.tolist()):
+        key = tuple(row)
+        if key not in seen:
+            seen[key] = len(first)
+            first.append(i)
+        q_index.append(seen[key])
+    if len(first) == len(q_index):
+        return x2, x2_mask, None
+    first = torch.LongTensor(first)
+    return (x2.index_select(0, first), x2_mask.index_select(0, first),
+            torch.LongTensor(q_index))
+
+
+def batchify(batch):
+    """Gather a batch of individual examples into one batch."""
+    return _collator(batch)
@@ -24,11 +24,17 @@ def set_default(key, value):
 
 def get_class(name):
     if name == 'tfidf':
+        from .tfidf_doc_ranker import TfidfDocRanker
         return TfidfDocRanker
     if name == 'sqlite':
+        from .doc_db import DocDB
         return DocDB
     raise RuntimeError('Invalid retriever class: %s' % name)
 
 
-from .doc_db import DocDB
-from .tfidf_doc_ranker import TfidfDocRanker
+from ..common.lazy import lazy_import
+lazy_import(__name__, {
+    'DocDB': ('.doc_db', 'DocDB'),
+    'TfidfDocRanker': ('.tfidf_doc_ranker', 'TfidfDocRanker'),
+    'utils': ('.utils', None),
+})
@@ -43,6 +43,14 @@ class DocDB(object):
         cursor.close()
         return results
 
+    def get_doc_lengths(self):
+        """Fetch the text length of all docs stored in the db (id --> len)."""
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT id, LENGTH(text) FROM documents")
+        results = {r[0]: r[1] for r in cursor.fetchall()}
+        cursor.close()
+        return results
+
     def get_doc_text(self, doc_id):
         """Fetch the raw text of the doc for 'doc_id'."""
         cursor = self.connection.cursor()
@@ -16,25 +16,29 @@ def set_default(key, value):
     DEFAULTS[key] = value
 
 
-from .corenlp_tokenizer import CoreNLPTokenizer
-from .regexp_tokenizer import RegexpTokenizer
-from .simple_tokenizer import SimpleTokenizer
-
-# Spacy is optional
-try:
-    from .spacy_tokenizer import SpacyTokenizer
-except ImportError:
-    pass
+# Tokenizers are imported on first access (Spacy is optional).
+from ..common.lazy import lazy_import
+lazy_import(__name__, {
+    'CoreNLPTokenizer': ('.corenlp_tokenizer', 'CoreNLPTokenizer'),
+    'RegexpTokenizer': ('.regexp_tokenizer', 'RegexpTokenizer'),
+    'SimpleTokenizer': ('.simple_tokenizer', 'SimpleTokenizer'),
+    'SpacyTokenizer': ('.spacy_tokenizer', 'SpacyTokenizer'),
+    'SizeAwareScheduler': ('.scheduler', 'SizeAwareScheduler'),
+})
 
 
 def get_class(name):
     if name == 'spacy':
+        from .spacy_tokenizer import SpacyTokenizer
         return SpacyTokenizer
     if name == 'corenlp':
+        from .corenlp_tokenizer import CoreNLPTokenizer
         return CoreNLPTokenizer
     if name == 'regexp':
+        from .regexp_tokenizer import RegexpTokenizer
         return RegexpTokenizer
     if name == 'simple':
+        from .simple_tokenizer import SimpleTokenizer
         return SimpleTokenizer
 
     raise RuntimeError('Invalid tokenizer: %s' % name)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Size-aware scheduling of tokenization jobs onto a process pool.
+
+Jobs are handed out one at a time, largest first, so idle workers pull the
+next pending job as soon as they finish (instead of being assigned a fixed
+chunk up front). Very long texts are split at paragraph or sentence
+boundaries and the resulting Tokens are stitched back together with offsets
+relative to the original text.
+"""
+
+import os
+import time
+import regex
+import logging
+
+from collections import Counter
+from functools import partial
+
+from .tokenizer import Tokens
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------------------
+# Splitting and stitching.
+# ------------------------------------------------------------------------------
+
+
+# Preferred split points, in order: paragraphs, sentences, any whitespace.
+BOUNDARIES = [
+    regex.compile(r'\n+'),
+    regex.compile(r'(?<=[.!?])\s+'),
+    regex.compile(r'\s+'),
+]
+
+
+def _last_boundary(window):
+    """Return the end of the last preferred boundary inside window, or None."""
+    for pattern in BOUNDARIES:
+        end = None
+        for match in pattern.finditer(window):
+            if match.start() > 0:
+                end = match.end()
+        if end is not None:
+            return end
+    return None
+
+
+def split_text(text, max_chars):
+    """Split text into pieces of at most max_chars characters.
+
+    Args:
+        text: string to split.
+        max_chars: max length of a piece (0 or None = never split).
+    Output:
+        list of (char offset, piece) tuples covering the whole text.
+    """
+    if not max_chars or len(text) <= max_chars:
+        return [(0, text)]
+    pieces = []
+    start = 0
+    while len(text) - start > max_chars:
+        end = _last_boundary(text[start:start + max_chars]) or max_chars
+        pieces.append((start, text[start:start + end]))
+        start += end
+    pieces.append((start, text[start:]))
+    return pieces
+
+
+def merge_tokens(text, offsets, pieces):
+    """Stitch the Tokens of consecutive pieces of text into one Tokens.
+
+    Args:
+        text: the original (unsplit) text.
+        offsets: char offset of each piece in text.
+        pieces: Tokens of each piece.
+    """
+    data = []
+    for offset, tokens in zip(offsets, pieces):
+        if len(tokens) == 0:
+            continue
+        # Whitespace after the last token of the previous piece extends up to
+        # the first token of this one.
+        if len(data) > 0:
+            prev = data[-1]
+            ws = text[prev[Tokens.SPAN][0]:offset + tokens.data[0][Tokens.SPAN][0]]
+            data[-1] = prev[:Tokens.TEXT_WS] + (ws,) + prev[Tokens.TEXT_WS + 1:]
+        for t in tokens.data:
+            span = (t[Tokens.SPAN][0] + offset, t[Tokens.SPAN][1] + offset)
+            data.append(t[:Tokens.SPAN] + (span,) + t[Tokens.SPAN + 1:])
+    return Tokens(data, pieces[0].annotators, pieces[0].opts)
+
+
+# ------------------------------------------------------------------------------
+# Scheduler.
+# ------------------------------------------------------------------------------
+
+
+def timed_call(fn, job):
+    """Run fn on a job's (index, item) inside a worker, recording who ran it
+    and when. Returns (index, result, pid, start, end).
+    """
+    index, item = job
+    t0 = time.time()
+    result = fn(item)
+    return index, result, os.getpid(), t0, time.time()
+
+
+class SizeAwareScheduler(object):
+    """Dispatch jobs onto a multiprocessing pool in decreasing size order,
+    one job at a time, and keep track of per-worker utilization.
+    """
+
+    def __init__(self, pool, num_workers=None, max_chars=10000):
+        """
+        Args:
+            pool: multiprocessing pool whose workers run the jobs.
+            num_workers: number of processes in the pool (default cpu count).
+            max_chars: texts longer than this are tokenized in pieces
+              (0 = never split).
+        """
+        self.pool = pool
+        self.num_workers = num_workers or os.cpu_count()
+        self.max_chars = max_chars
+        self.reset()
+
+    def reset(self):
+        """Clear accumulated utilization statistics."""
+        self.busy = Counter()
+        self.jobs = Counter()
+        self.wall = 0
+        # (item index, pid, start, end) of the jobs run.
+        self.spans = []
+
+    def imap_unordered(self, fn, items, sizes=None):
+        """Run fn over items, largest first. Yields (index, result) pairs in
+        completion order.
+
+        Args:
+            fn: picklable function to call on each item in the workers.
+            items: list of inputs.
+            sizes: cost estimate of each item (default len(item)).
+        """
+        sizes = sizes if sizes is not None else [len(i) for i in items]
+        order = sorted(range(len(items)), key=lambda i: -sizes[i])
+        jobs = ((i, items[i]) for i in order)
+        t0 = time.time()
+        try:
+            for index, result, pid, start, end in self.pool.imap_unordered(
+                    partial(timed_call, fn), jobs, chunksize=1):
+                self.busy[pid] += end - start
+                self.jobs[pid] += 1
+                self.spans.append((index, pid, start, end))
+                yield index, result
+        finally:
+            self.wall += time.time() - t0
+
+    def map(self, fn, items, sizes=None):
+        """Like imap_unordered, but return results in input order."""
+        results = [None] * len(items)
+        for index, result in self.imap_unordered(fn, items, sizes):
+            results[index] = result
+        return results
+
+    def tokenize(self, fn, texts):
+        """Tokenize texts with fn, splitting the long ones into pieces.
+
+        Args:
+            fn: picklable function mapping text --> Tokens in the workers.
+            texts: list of strings.
+        Output:
+            list of Tokens, one per text.
+        """
+        pieces, owners = [], []
+        for idx, text in enumerate(texts):
+            for offset, piece in split_text(text, self.max_chars):
+                pieces.append(piece)
+                owners.append((idx, offset))
+        first = len(self.spans)
+        tokens = self.map(fn, pieces)
+        # Report jobs by text rather than by piece.
+        self.spans[first:] = [(owners[i][0], pid, start, end)
+                              for i, pid, start, end in self.spans[first:]]
+
+        results = [[] for _ in texts]
+        for (idx, offset), t in zip(owners, tokens):
+            results[idx].append((offset, t))
+        return [parts[0][1] if len(parts) == 1 else
+                merge_tokens(texts[idx], *zip(*parts))
+                for idx, parts in enumerate(results)]
+
+    def utilization(self):
+        """Return pid --> fraction of wall time spent running jobs."""
+        if self.wall == 0:
+            return {}
+        return {pid: busy / self.wall for pid, busy in self.busy.items()}
+
+    def log_utilization(self):
+        """Log a summary of per-worker utilization."""
+        if self.wall == 0:
+            return
+        usage = self.utilization()
+        # Workers that never got a job count as fully idle.
+        idle = max(self.num_workers - len(usage), 0)
+        values = sorted(usage.values()) + [0.0] * idle
+        logger.info(
+            'Worker utilization: mean = %.1f%% | min = %.1f%% | max = %.1f%% '
+            '| jobs = %d | wall = %.2f (s)' %
+            (100 * sum(values) / len(values), 100 * min(values),
+             100 * max(values), sum(self.jobs.values()), self.wall)
+        )
+        for pid in sorted(usage):
+            logger.debug('  worker %d: %d jobs, busy %.2f (s), %.1f%%' %
+                         (pid, self.jobs[pid], self.busy[pid],
+                          100 * usage[pid]))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Latency of a DocReader network on CPU: eager PyTorch vs. its exported
+TorchScript / ONNX graphs (see scripts/reader/export_graph.py).
+
+    python scripts/benchmark/backends.py model.mdl \
+        [--torchscript model.pt] [--onnx model.onnx] [--threads 1]
+
+Each backend runs the same random batches; scores are checked against eager.
+"""
+
+import json
+import time
+import argparse
+import prettytable
+import torch
+
+from drqa.reader import DocReader
+from drqa.reader.backends import example_inputs, get_backend, input_names
+
+
+def timeit(fn, batches, repeat):
+    fn(batches[0])  # warm up
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.time()
+        for inputs in batches:
+            fn(inputs)
+        best = min(best, time.time() - t0)
+    return best / len(batches)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', type=str, help='Module file (.mdl)')
+    parser.add_argument('--torchscript', type=str, default=None,
+                        help='Exported TorchScript graph')
+    parser.add_argument('--onnx', type=str, default=None,
+                        help='Exported ONNX graph')
+    parser.add_argument('--batch-sizes', type=str, default='1,32',
+                        help='Comma separated batch sizes')
+    parser.add_argument('--doc-len', type=int, default=150)
+    parser.add_argument('--question-len', type=int, default=12)
+    parser.add_argument('--num-batches', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Torch intra-op threads')
+    parser.add_argument('--out', type=str, default=None,
+                        help='Optionally write the results as JSON here')
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(1013)
+
+    model = DocReader.load(args.model)
+    model.network.eval()
+    names = input_names(model)
+
+    def eager(inputs):
+        with torch.no_grad():
+            return model.network(*inputs)
+
+    backends = [('eager', eager)]
+    for name, path in (('torchscript', args.torchscript),
+                       ('onnx', args.onnx)):
+        if path:
+            backend = get_backend(name, path)
+            backends.append((name, lambda x, b=backend: b.run(x, names)))
+
+    results = []
+    table = prettytable.PrettyTable(
+        ['Backend', 'Batch size', 'ms / batch', 'Speedup', 'Max score diff']
+    )
+    for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+        batches = [example_inputs(model, batch_size, args.doc_len,
+                                  args.question_len)
+                   for _ in range(args.num_batches)]
+        expected = [eager(inputs) for inputs in batches]
+        baseline = None
+        for name, fn in backends:
+            diff = max(float((e.data - s).abs().max())
+                       for inputs, scores in zip(batches, expected)
+                       for e, s in zip(scores, fn(inputs)))
+            latency = timeit(fn, batches, args.repeat)
+            baseline = baseline or latency
+            results.append({'backend': name, 'batch_size': batch_size,
+                            'latency': latency, 'max_diff': diff})
+            table.add_row([name, batch_size, '%.2f' % (1000 * latency),
+                           '%.2fx' % (baseline / latency), '%.1e' % diff])
+    print(table)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
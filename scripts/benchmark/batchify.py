@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Micro-benchmark of reader batch collation (vector.batchify).
+
+Compares the bulk BatchCollator (with and without buffer reuse) against the
+original row-by-row implementation on random examples, with and without
+character inputs, and checks that all outputs are identical.
+"""
+
+import time
+import random
+import argparse
+import numpy as np
+import torch
+
+from drqa.reader import vector
+
+
+def legacy_batchify(batch):
+    """The original batchify, copying one row (and one word) at a time."""
+    NUM_INPUTS = 3
+    NUM_TARGETS = 2
+    NUM_EXTRA = 1
+
+    # Chars used to be one tensor per word.
+    def split_chars(chars):
+        if chars is None:
+            return None
+        flat, lengths = chars
+        offsets = np.cumsum([0] + lengths.tolist())
+        return [flat[s:e] for s, e in zip(offsets[:-1], offsets[1:])]
+
+    ids = [ex[-1] for ex in batch]
+    docs = [ex[0][0] for ex in batch]
+    docs_chars = [split_chars(ex[0][1]) for ex in batch if ex[0][1] is not None]
+    features = [ex[1] for ex in batch]
+    questions = [ex[2][0] for ex in batch]
+    questions_chars = [split_chars(ex[2][1]) for ex in batch
+                       if ex[2][1] is not None]
+
+    use_chars = True if len(docs_chars) > 0 else False
+
+    max_length = max([d.size(0) for d in docs])
+    x1 = torch.LongTensor(len(docs), max_length).zero_()
+    x1_mask = torch.ByteTensor(len(docs), max_length).fill_(1)
+    for i, d in enumerate(docs):
+        x1[i, :d.size(0)].copy_(d)
+        x1_mask[i, :d.size(0)].fill_(0)
+
+    if features[0] is None:
+        x1_f = None
+    else:
+        x1_f = []
+        for j, f in enumerate(features[0]):
+            if f is None:
+                x1_f.append(None)
+                continue
+            padded = f.new(len(docs), max_length, f.size(1)).zero_()
+            for i, d in enumerate(docs):
+                padded[i, :d.size(0)].copy_(features[i][j])
+            x1_f.append(padded)
+        x1_f = tuple(x1_f)
+
+    if use_chars:
+        max_chars_length = max([w.size(0) for d in docs_chars for w in d])
+        x1_char = torch.LongTensor(len(docs), max_length, max_chars_length).zero_()
+        x1_char_mask = torch.ByteTensor(len(docs), max_length, max_chars_length).fill_(1)
+        for i, d in enumerate(docs_chars):
+            for j, w in enumerate(d):
+                x1_char[i, j, :w.size(0)].copy_(w)
+                x1_char_mask[i, j, :w.size(0)].fill_(0)
+
+    max_length = max([q.size(0) for q in questions])
+    x2 = torch.LongTensor(len(questions), max_length).zero_()
+    x2_mask = torch.ByteTensor(len(questions), max_length).fill_(1)
+    for i, q in enumerate(questions):
+        x2[i, :q.size(0)].copy_(q)
+        x2_mask[i, :q.size(0)].fill_(0)
+
+    if questions_chars:
+        max_chars_length = max([w.size(0) for d in questions_chars for w in d])
+        x2_char = torch.LongTensor(len(questions_chars), max_length, max_chars_length).zero_()
+        x2_char_mask = torch.ByteTensor(len(questions_chars), max_length, max_chars_length).fill_(1)
+    for i, d in enumerate(questions_chars):
+        for j, w in enumerate(d):
+            x2_char[i, j, :w.size(0)].copy_(w)
+            x2_char_mask[i, j, :w.size(0)].fill_(0)
+
+    if len(batch[0]) == NUM_INPUTS + NUM_EXTRA:
+        return x1, x1_f, x1_mask, x2, x2_mask, ids
+    if torch.is_tensor(batch[0][3]):
+        y_s = torch.cat([ex[3] for ex in batch])
+        y_e = torch.cat([ex[4] for ex in batch])
+    else:
+        y_s = [ex[3] for ex in batch]
+        y_e = [ex[4] for ex in batch]
+    if use_chars:
+        return x1, x1_mask, x1_char, x1_char_mask, x1_f, x2, x2_mask, x2_char, x2_char_mask, y_s, y_e, ids
+    return x1, x1_f, x1_mask, x2, x2_mask, y_s, y_e, ids
+
+
+def random_words(n, max_word_len):
+    return ['x' * random.randint(1, max_word_len) for _ in range(n)]
+
+
+def random_example(doc_len, q_len, num_values, num_groups, use_chars):
+    """A vectorized example, in the format produced by vector.vectorize."""
+    def chars(words):
+        if not use_chars:
+            return None
+        return (torch.LongTensor(sum(len(w) for w in words)).random_(1, 100),
+                torch.LongTensor([len(w) for w in words]))
+
+    document = random_words(doc_len, 15)
+    question = random_words(q_len, 15)
+    features = (torch.LongTensor(doc_len, num_groups).random_(0, 50),
+                torch.FloatTensor(doc_len, num_values).uniform_())
+    return ((torch.LongTensor(doc_len).random_(1, 10000), chars(document)),
+            features,
+            (torch.LongTensor(q_len).random_(1, 10000), chars(question)),
+            torch.LongTensor(1).fill_(0), torch.LongTensor(1).fill_(0),
+            'q%d' % random.randint(0, 1 << 30))
+
+
+def same(a, b):
+    if isinstance(a, (tuple, list)):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if torch.is_tensor(a):
+        return a.type() == b.type() and a.size() == b.size() and \
+            torch.equal(a, b)
+    return a == b
+
+
+def timeit(fn, batches, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.time()
+        for batch in batches:
+            fn(batch)
+        best = min(best, time.time() - t0)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-batches', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--doc-len', type=int, default=150,
+                        help='Mean document length (tokens)')
+    parser.add_argument('--question-len', type=int, default=12)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1013)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    for use_chars in (False, True):
+        batches = [
+            [random_example(random.randint(args.doc_len // 2, args.doc_len * 2),
+                            random.randint(3, args.question_len * 2),
+                            3, 2, use_chars)
+             for _ in range(args.batch_size)]
+            for _ in range(args.num_batches)
+        ]
+
+        # Correctness first (also without targets, and reusing buffers).
+        reuse = vector.BatchCollator(reuse_buffers=True)
+        for batch in batches:
+            expected = legacy_batchify(batch)
+            assert same(vector.batchify(batch), expected)
+            assert same(reuse(batch), expected)
+            no_targets = [ex[:3] + ex[-1:] for ex in batch]
+            assert same(vector.batchify(no_targets),
+                        legacy_batchify(no_targets))
+        print('chars = %s: outputs are identical on %d batches.' %
+              (use_chars, len(batches)))
+
+        legacy = timeit(legacy_batchify, batches, args.repeat)
+        bulk = timeit(vector.batchify, batches, args.repeat)
+        reused = timeit(reuse, batches, args.repeat)
+        print('legacy batchify:     %.3f (s) | %.1f batch/s' %
+              (legacy, len(batches) / legacy))
+        print('bulk batchify:       %.3f (s) | %.1f batch/s | %.1fx' %
+              (bulk, len(batches) / bulk, legacy / bulk))
+        print('bulk + buffer reuse: %.3f (s) | %.1f batch/s | %.1fx' %
+              (reused, len(batches) / reused, legacy / reused))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Compare DocReader startup from a .mdl file and from a serving bundle.
+
+Each variant is loaded in a fresh interpreter, reporting load time and memory:
+total RSS, and its private (anonymous) part, i.e. what each extra replica
+would cost. Pages of a bundle's memory mapped arrays are shared, file backed.
+
+    python scripts/benchmark/bundle.py model.mdl model.bundle \
+        [--embedding-file glove.840B.300d.txt]
+
+With --embedding-file, the .mdl is expanded with it after loading (as done by
+the pipeline); the bundle is expected to have been exported with it.
+"""
+
+import sys
+import json
+import argparse
+import subprocess
+import prettytable
+
+LOADER = """
+import sys, json, time, logging
+t0 = time.time()
+from drqa.reader import DocReader, utils
+model = DocReader.load(sys.argv[1], normalize=False)
+if len(sys.argv) > 2:
+    words = utils.index_embedding_words(sys.argv[2])
+    added = model.expand_dictionary(words)
+    model.load_embeddings(added, sys.argv[2])
+elapsed = time.time() - t0
+
+# Touch all parameters, as a first forward pass over many words would.
+total = sum(float(p.data.sum()) for p in model.network.parameters())
+
+memory = {}
+with open('/proc/self/status') as f:
+    for line in f:
+        key, value = line.split(':', 1)
+        if key in ('VmRSS', 'RssAnon', 'RssFile', 'VmHWM'):
+            memory[key] = int(value.split()[0]) * 1024
+print(json.dumps({'time': elapsed, 'vocab': len(model.word_dict),
+                  'memory': memory, 'checksum': total}))
+"""
+
+
+def run(path, embedding_file=None):
+    cmd = [sys.executable, '-c', LOADER, path]
+    if embedding_file:
+        cmd.append(embedding_file)
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(out.decode('utf-8').strip().split('\n')[-1])
+
+
+def mb(value):
+    return '%.1f' % (value / 1e6) if value is not None else '-'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', type=str, help='Module file (.mdl)')
+    parser.add_argument('bundle', type=str, help='Serving bundle directory')
+    parser.add_argument('--embedding-file', type=str, default=None,
+                        help='Expand the .mdl dictionary with this file')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', type=str, default=None,
+                        help='Optionally write the results as JSON here')
+    args = parser.parse_args()
+
+    results = {}
+    for name, path, emb in (('mdl', args.model, args.embedding_file),
+                            ('bundle', args.bundle, None)):
+        runs = [run(path, emb) for _ in range(args.repeat)]
+        best = min(runs, key=lambda r: r['time'])
+        results[name] = best
+
+    table = prettytable.PrettyTable(
+        ['Variant', 'Vocab', 'Load (s)', 'RSS (MB)', 'Private (MB)',
+         'Shared file (MB)', 'Peak RSS (MB)']
+    )
+    for name, r in results.items():
+        m = r['memory']
+        table.add_row([name, r['vocab'], '%.3f' % r['time'], mb(m.get('VmRSS')),
+                       mb(m.get('RssAnon')), mb(m.get('RssFile')),
+                       mb(m.get('VmHWM'))])
+    print(table)
+    if abs(results['mdl']['checksum'] - results['bundle']['checksum']) > \
+            1e-3 * max(1.0, abs(results['mdl']['checksum'])):
+        print('WARNING: parameter checksums differ (%f vs %f)' %
+              (results['mdl']['checksum'], results['bundle']['checksum']))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Compare two reports of scripts/benchmark/end2end.py:
+
+    python scripts/benchmark/compare.py base.json new.json [--tolerance 0.05]
+
+Every numeric result is listed with its relative change. Rates (*_per_s) are
+better higher, times (*_seconds) better lower; changes beyond the tolerance
+are flagged. With --fail-on-regression, exit with status 1 if any is worse.
+"""
+
+import sys
+import json
+import argparse
+import prettytable
+
+
+def flatten(results, prefix=''):
+    """Map dotted paths (e.g. pipeline.latency_seconds.p99) to numbers."""
+    flat = {}
+    for key, value in results.items():
+        path = prefix + key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def direction(path):
+    """1 if higher is better, -1 if lower is, 0 if neither."""
+    parts = path.split('.')
+    if parts[-1].endswith('_per_s'):
+        return 1
+    if any(p.endswith('_seconds') for p in parts):
+        return -1
+    return 0
+
+
+def compare(base, new, tolerance):
+    """Return rows of (path, base, new, change, verdict)."""
+    base, new = flatten(base['results']), flatten(new['results'])
+    rows = []
+    for path in sorted(set(base) | set(new)):
+        if path not in base or path not in new:
+            rows.append((path, base.get(path), new.get(path), None, 'missing'))
+            continue
+        change = (new[path] - base[path]) / base[path] if base[path] else None
+        verdict = ''
+        if change is not None and abs(change) > tolerance:
+            sign = direction(path)
+            if sign:
+                verdict = 'better' if change * sign > 0 else 'WORSE'
+        rows.append((path, base[path], new[path], change, verdict))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('base', type=str, help='Baseline report')
+    parser.add_argument('new', type=str, help='New report')
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help='Relative change ignored as noise')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    for key in ('commit', 'host', 'cpu_count', 'torch'):
+        old_value = base['environment'].get(key)
+        new_value = new['environment'].get(key)
+        if old_value != new_value:
+            print('%s: %s -> %s' % (key, old_value, new_value))
+    if base['corpus'] != new['corpus']:
+        print('WARNING: the reports are over different corpora')
+
+    def fmt(value):
+        return '-' if value is None else '%.4g' % value
+
+    table = prettytable.PrettyTable(['Result', 'Base', 'New', 'Change', ''])
+    table.align['Result'] = 'l'
+    rows = compare(base, new, args.tolerance)
+    for path, old_value, new_value, change, verdict in rows:
+        table.add_row([path, fmt(old_value), fmt(new_value),
+                       '-' if change is None else '%+.1f%%' % (change * 100),
+                       verdict])
+    print(table)
+
+    if args.fail_on_regression and any(r[4] == 'WORSE' for r in rows):
+        sys.exit(1)
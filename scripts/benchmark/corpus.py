@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Generate a synthetic corpus and QA set, and build everything the full
+pipeline needs to run over it (no Wikipedia or pretrained model required):
+
+    python scripts/benchmark/corpus.py /tmp/bench --num-docs 5000
+
+Writes to the output directory:
+    docs.json           documents, as read by retriever/build_db.py
+    dataset.txt         questions and answers, as read by pipeline/eval.py
+    docs.db             the DocDB (built with retriever/build_db.py)
+    docs-tfidf-*.npz    the TF-IDF index (built with retriever/build_tfidf.py)
+    reader.mdl          a tiny DocReader, randomly initialized
+    corpus.json         the options used and the paths of the above
+
+Generation only depends on the options (and seed): the same options always
+give the same documents and questions. Words are drawn from a Zipfian
+distribution over a made-up vocabulary, and each question is made of words
+of a sentence of some document, whose answer is another word of it.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import bisect
+import argparse
+import logging
+import subprocess
+import torch
+
+from drqa import SCRIPTS_DIR
+from drqa.reader import config, utils, DocReader
+from drqa.reader.data import Dictionary
+
+logger = logging.getLogger()
+
+SYLLABLES = [c + v for c in 'bdfgklmnprstvz' for v in 'aeiou']
+
+
+# ------------------------------------------------------------------------------
+# Text generation.
+# ------------------------------------------------------------------------------
+
+
+def make_vocab(rng, size):
+    """Distinct pronounceable made-up words."""
+    vocab, seen = [], set()
+    while len(vocab) < size:
+        word = ''.join(rng.choice(SYLLABLES)
+                       for _ in range(rng.randint(1, 4)))
+        if word not in seen:
+            seen.add(word)
+            vocab.append(word)
+    return vocab
+
+
+class ZipfSampler(object):
+    """Draw words with probability proportional to 1 / rank ** exponent."""
+
+    def __init__(self, vocab, exponent=1.0):
+        self.vocab = vocab
+        self.cumulative = []
+        total = 0.0
+        for rank in range(len(vocab)):
+            total += 1.0 / (rank + 1) ** exponent
+            self.cumulative.append(total)
+
+    def sample(self, rng):
+        r = rng.random() * self.cumulative[-1]
+        index = bisect.bisect_left(self.cumulative, r)
+        return self.vocab[min(index, len(self.vocab) - 1)]
+
+
+def make_sentence(rng, sampler, min_words, max_words):
+    words = [sampler.sample(rng)
+             for _ in range(rng.randint(min_words, max_words))]
+    return words[0].capitalize() + ' ' + ' '.join(words[1:]) + '.'
+
+
+def make_documents(rng, sampler, args):
+    """Yield {"id", "text"} documents: a title and paragraphs of sentences,
+    separated by blank lines.
+    """
+    for i in range(args.num_docs):
+        title = ' '.join(sampler.sample(rng).capitalize()
+                         for _ in range(rng.randint(1, 3)))
+        paragraphs = [title]
+        for _ in range(rng.randint(args.min_paragraphs, args.max_paragraphs)):
+            paragraphs.append(' '.join(
+                make_sentence(rng, sampler, 4, 25)
+                for _ in range(rng.randint(1, args.max_sentences))
+            ))
+        yield {'id': 'doc%d' % i, 'text': '\n\n'.join(paragraphs)}
+
+
+def make_question(rng, doc, question_words=6):
+    """A question from a random sentence of doc: some of its words (in
+    random order), answered by one of the others.
+    """
+    paragraphs = doc['text'].split('\n\n')[1:]
+    sentences = [s for p in paragraphs for s in p.split('. ')]
+    words = rng.choice(sentences).lower().rstrip('.').split()
+    answer = rng.choice(words)
+    words = [w for w in words if w != answer]
+    rng.shuffle(words)
+    question = ' '.join(words[:question_words]) + '?'
+    return {'question': question, 'answer': [answer]}
+
+
+# ------------------------------------------------------------------------------
+# Indexes and model.
+# ------------------------------------------------------------------------------
+
+
+def run_script(script, *args):
+    cmd = [sys.executable, os.path.join(SCRIPTS_DIR, script)]
+    cmd += [str(a) for a in args]
+    logger.info('Running %s' % ' '.join(cmd))
+    subprocess.run(cmd, check=True)
+
+
+def make_reader(vocab, args, path):
+    """Save a small, randomly initialized DocReader over vocab (only using
+    features that any tokenizer provides).
+    """
+    torch.manual_seed(args.seed)
+    parser = argparse.ArgumentParser()
+    config.add_model_args(parser)
+    model_args = parser.parse_args([
+        '--model-type', 'drqa',
+        '--embedding-dim', str(args.reader_embedding_dim),
+        '--hidden-size', str(args.reader_hidden_size),
+        '--doc-layers', str(args.reader_layers),
+        '--question-layers', str(args.reader_layers),
+        '--use-pos', 'f', '--use-ner', 'f', '--use-lemma', 'f',
+    ])
+    feature_dict = utils.build_feature_dict(model_args, [])
+    word_dict = Dictionary()
+    for word in vocab:
+        word_dict.add(word)
+        word_dict.add(word.capitalize())
+    model = DocReader(config.get_model_args(model_args), word_dict,
+                      feature_dict)
+    model.save(path)
+
+
+# ------------------------------------------------------------------------------
+# Main.
+# ------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    logger.setLevel(logging.INFO)
+    fmt = logging.Formatter('%(asctime)s: [ %(message)s ]',
+                            '%m/%d/%Y %I:%M:%S %p')
+    console = logging.StreamHandler()
+    console.setFormatter(fmt)
+    logger.addHandler(console)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('out_dir', type=str, help='Output directory')
+    parser.add_argument('--num-docs', type=int, default=5000)
+    parser.add_argument('--num-questions', type=int, default=1000)
+    parser.add_argument('--vocab-size', type=int, default=20000)
+    parser.add_argument('--zipf-exponent', type=float, default=1.0)
+    parser.add_argument('--min-paragraphs', type=int, default=1)
+    parser.add_argument('--max-paragraphs', type=int, default=10)
+    parser.add_argument('--max-sentences', type=int, default=8,
+                        help='Max sentences per paragraph')
+    parser.add_argument('--seed', type=int, default=1013)
+    parser.add_argument('--tokenizer', type=str, default='simple',
+                        help='Tokenizer of the TF-IDF index')
+    parser.add_argument('--ngram', type=int, default=2)
+    parser.add_argument('--hash-size', type=int, default=2**20)
+    parser.add_argument('--reader-embedding-dim', type=int, default=64)
+    parser.add_argument('--reader-hidden-size', type=int, default=32)
+    parser.add_argument('--reader-layers', type=int, default=2)
+    parser.add_argument('--num-workers', type=int, default=None)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    os.makedirs(args.out_dir, exist_ok=True)
+    paths = {
+        'docs': os.path.join(args.out_dir, 'docs.json'),
+        'dataset': os.path.join(args.out_dir, 'dataset.txt'),
+        'db': os.path.join(args.out_dir, 'docs.db'),
+        'tfidf': os.path.join(args.out_dir,
+                              'docs-tfidf-ngram=%d-hash=%d-tokenizer=%s.npz' %
+                              (args.ngram, args.hash_size, args.tokenizer)),
+        'reader': os.path.join(args.out_dir, 'reader.mdl'),
+    }
+
+    logger.info('Generating %d documents...' % args.num_docs)
+    rng = random.Random(args.seed)
+    vocab = make_vocab(rng, args.vocab_size)
+    sampler = ZipfSampler(vocab, args.zipf_exponent)
+    docs = list(make_documents(rng, sampler, args))
+    with open(paths['docs'], 'w') as f:
+        for doc in docs:
+            f.write(json.dumps(doc) + '\n')
+
+    logger.info('Generating %d questions...' % args.num_questions)
+    with open(paths['dataset'], 'w') as f:
+        for _ in range(args.num_questions):
+            question = make_question(rng, rng.choice(docs))
+            f.write(json.dumps(question) + '\n')
+
+    # build_db.py refuses to overwrite.
+    if os.path.isfile(paths['db']):
+        os.remove(paths['db'])
+    workers = ['--num-workers', args.num_workers] if args.num_workers else []
+    run_script('retriever/build_db.py', paths['docs'], paths['db'], *workers)
+    run_script('retriever/build_tfidf.py', paths['db'], args.out_dir,
+               '--tokenizer', args.tokenizer, '--ngram', args.ngram,
+               '--hash-size', args.hash_size, *workers)
+
+    logger.info('Initializing reader...')
+    make_reader(vocab, args, paths['reader'])
+
+    with open(os.path.join(args.out_dir, 'corpus.json'), 'w') as f:
+        json.dump({'options': vars(args), 'paths': paths}, f, indent=2)
+    logger.info('Done in %.2f (s)' % (time.time() - t0))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Micro-benchmark of word dictionary lookups and memory.
+
+Compares Dictionary and CompactDictionary on a random vocabulary: lookup
+speed with and without normalization, memory held (Python objects vs
+arrays), and checks that both give the same indices.
+"""
+
+import gc
+import time
+import random
+import argparse
+import tracemalloc
+
+from drqa.reader.data import Dictionary, CompactDictionary
+
+CHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJéèüñçÉ0123456789-'
+
+
+def random_word():
+    return ''.join(random.choice(CHARS) for _ in range(random.randint(1, 12)))
+
+
+def timeit(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.time()
+        fn()
+        best = min(best, time.time() - t0)
+    return best
+
+
+def allocated(build):
+    """Return (result of build(), bytes it allocated and kept)."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab-size', type=int, default=500000)
+    parser.add_argument('--num-lookups', type=int, default=500000)
+    parser.add_argument('--oov-rate', type=float, default=0.05)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1013)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    words = list({random_word() for _ in range(args.vocab_size)})
+
+    def build_dictionary():
+        dictionary = Dictionary()
+        for w in words:
+            dictionary.add(w)
+        return dictionary
+
+    dictionary, dict_bytes = allocated(build_dictionary)
+    compact, compact_bytes = allocated(
+        lambda: CompactDictionary.from_dictionary(dictionary)
+    )
+
+    tokens = [random.choice(words) if random.random() > args.oov_rate
+              else random_word() + '#' for _ in range(args.num_lookups)]
+    normalized = [Dictionary.normalize(t) for t in tokens]
+
+    # Correctness first.
+    assert len(compact) == len(dictionary)
+    assert compact.index(tokens) == dictionary.index(tokens) == \
+        [dictionary[t] for t in tokens]
+    assert all(compact[i] == dictionary[i] for i in range(len(dictionary)))
+    print('Indices are identical on %d lookups.' % len(tokens))
+
+    print('%d words | Dictionary: %.1f MB | CompactDictionary: %.1f MB' %
+          (len(dictionary), dict_bytes / 1e6, compact_bytes / 1e6))
+    results = [
+        ('Dictionary [t]', lambda: [dictionary[t] for t in tokens]),
+        ('Dictionary.index', lambda: dictionary.index(tokens)),
+        ('Dictionary.index (normalized)',
+         lambda: dictionary.index(normalized, normalized=True)),
+        ('CompactDictionary.index', lambda: compact.index(tokens)),
+        ('CompactDictionary.index (normalized)',
+         lambda: compact.index(normalized, normalized=True)),
+    ]
+    base = None
+    for name, fn in results:
+        elapsed = timeit(fn, args.repeat)
+        base = base or elapsed
+        print('%-38s %.3f (s) | %.0f ns/token | %.1fx' %
+              (name, elapsed, 1e9 * elapsed / len(tokens), base / elapsed))
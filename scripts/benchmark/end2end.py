@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Throughput and latency of each part of DrQA, and of the full pipeline, over
+a corpus generated by scripts/benchmark/corpus.py:
+
+    python scripts/benchmark/corpus.py /tmp/bench
+    python scripts/benchmark/end2end.py /tmp/bench --out report.json
+    python scripts/benchmark/compare.py base.json report.json
+
+Benchmarks (select with --benchmarks):
+    retriever   TF-IDF queries per second, one by one and batched
+    tokenizer   tokens per second over document paragraphs (one process)
+    reader      DocReader examples per second (vectorization and forward)
+    pipeline    DrQA.process latency percentiles, process_batch throughput
+                and time per stage
+
+The report (--out) is JSON: the results, with the corpus options and the
+machine and library versions they were obtained with.
+"""
+
+import os
+import json
+import time
+import argparse
+import platform
+import subprocess
+import logging
+import numpy as np
+import prettytable
+import regex
+import torch
+
+from drqa import SCRIPTS_DIR, pipeline, retriever, tokenizers
+from drqa.common import metrics
+from drqa.reader import DocReader
+from drqa.reader.data import ReaderDataset, SortedBatchSampler
+from drqa.reader.vector import batchify
+
+logger = logging.getLogger()
+
+BENCHMARKS = ('retriever', 'tokenizer', 'reader', 'pipeline')
+
+
+def percentiles(values):
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99),
+            'mean': float(np.mean(values))}
+
+
+def paragraphs(text):
+    """Split a document into paragraphs, as the pipeline does."""
+    return [p.strip() for p in regex.split(r'\n+', text) if p.strip()]
+
+
+# ------------------------------------------------------------------------------
+# Benchmarks.
+# ------------------------------------------------------------------------------
+
+
+def bench_retriever(ranker, questions, n_docs, num_workers):
+    ranker.closest_docs(questions[0], k=n_docs)  # warm up
+    latencies = []
+    t0 = time.time()
+    for question in questions:
+        t1 = time.time()
+        ranker.closest_docs(question, k=n_docs)
+        latencies.append(time.time() - t1)
+    single = time.time() - t0
+    t0 = time.time()
+    ranker.batch_closest_docs(questions, k=n_docs, num_workers=num_workers)
+    batched = time.time() - t0
+    return {
+        'queries': len(questions),
+        'queries_per_s': len(questions) / single,
+        'batch_queries_per_s': len(questions) / batched,
+        'latency_seconds': percentiles(latencies),
+    }
+
+
+def bench_tokenizer(name, texts, repeat):
+    tokenizer = tokenizers.get_class(name)()
+    tokenizer.tokenize(texts[0])  # warm up
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.time()
+        num_tokens = sum(len(tokenizer.tokenize(t)) for t in texts)
+        best = min(best, time.time() - t0)
+    tokenizer.shutdown()
+    num_chars = sum(len(t) for t in texts)
+    return {
+        'tokenizer': name,
+        'texts': len(texts),
+        'tokens': num_tokens,
+        'texts_per_s': len(texts) / best,
+        'tokens_per_s': num_tokens / best,
+        'mb_per_s': num_chars / best / 1e6,
+    }
+
+
+def bench_reader(model, examples, batch_size, repeat):
+    dataset = ReaderDataset(examples, model)
+    sampler = SortedBatchSampler(dataset.lengths(), batch_size, shuffle=False)
+    order = list(sampler)
+    t0 = time.time()
+    batches = [batchify([dataset[i] for i in order[k: k + batch_size]])
+               for k in range(0, len(order), batch_size)]
+    vectorize = time.time() - t0
+
+    model.predict(batches[0])  # warm up
+    best, latencies = float('inf'), []
+    for _ in range(repeat):
+        t0 = time.time()
+        for batch in batches:
+            t1 = time.time()
+            model.predict(batch)
+            latencies.append(time.time() - t1)
+        best = min(best, time.time() - t0)
+    return {
+        'examples': len(examples),
+        'batches': len(batches),
+        'batch_size': batch_size,
+        'vectorize_examples_per_s': len(examples) / vectorize,
+        'examples_per_s': len(examples) / best,
+        'batch_latency_seconds': percentiles(latencies),
+    }
+
+
+def bench_pipeline(drqa, questions, num_latency, batch_size, n_docs):
+    drqa.process(questions[0], n_docs=n_docs)  # warm up
+    latencies = []
+    for question in questions[:num_latency]:
+        t0 = time.time()
+        drqa.process(question, n_docs=n_docs)
+        latencies.append(time.time() - t0)
+
+    # Throughput, with the time spent per stage.
+    metrics.enable()
+    metrics.METRICS.reset()
+    t0 = time.time()
+    for i in range(0, len(questions), batch_size):
+        drqa.process_batch(questions[i: i + batch_size], n_docs=n_docs)
+    elapsed = time.time() - t0
+    histograms = metrics.METRICS.snapshot()['histograms']
+    metrics.enable(metrics=False)
+    return {
+        'queries': len(questions),
+        'latency_seconds': percentiles(latencies),
+        'batch_size': batch_size,
+        'batch_queries_per_s': len(questions) / elapsed,
+        'stage_seconds': {
+            stage: histograms['stage_seconds{stage=%s}' % stage]['sum']
+            for stage in drqa.STAGES
+        },
+    }
+
+
+# ------------------------------------------------------------------------------
+# Report.
+# ------------------------------------------------------------------------------
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=SCRIPTS_DIR,
+            stderr=subprocess.DEVNULL
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'commit': commit,
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'numpy': np.__version__,
+        'torch_threads': torch.get_num_threads(),
+    }
+
+
+def print_summary(results):
+    table = prettytable.PrettyTable(['Benchmark', 'Throughput', 'p50 (ms)',
+                                     'p95 (ms)', 'p99 (ms)'])
+    rows = [
+        ('retriever', 'queries_per_s', 'latency_seconds', 'queries/s'),
+        ('tokenizer', 'tokens_per_s', None, 'tokens/s'),
+        ('reader', 'examples_per_s', 'batch_latency_seconds', 'examples/s'),
+        ('pipeline', 'batch_queries_per_s', 'latency_seconds', 'queries/s'),
+    ]
+    for name, rate, latency, unit in rows:
+        if name not in results:
+            continue
+        r = results[name]
+        ms = ['%.2f' % (r[latency][p] * 1000) if latency else '-'
+              for p in ('p50', 'p95', 'p99')]
+        table.add_row([name, '%.1f %s' % (r[rate], unit)] + ms)
+    print(table)
+
+
+# ------------------------------------------------------------------------------
+# Main.
+# ------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    logger.setLevel(logging.INFO)
+    fmt = logging.Formatter('%(asctime)s: [ %(message)s ]',
+                            '%m/%d/%Y %I:%M:%S %p')
+    console = logging.StreamHandler()
+    console.setFormatter(fmt)
+    logger.addHandler(console)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('corpus_dir', type=str,
+                        help='Output directory of corpus.py')
+    parser.add_argument('--benchmarks', type=str, nargs='+',
+                        default=list(BENCHMARKS), choices=BENCHMARKS)
+    parser.add_argument('--num-queries', type=int, default=500,
+                        help='Questions used (from the corpus dataset)')
+    parser.add_argument('--num-latency-queries', type=int, default=100,
+                        help='Pipeline questions run one at a time')
+    parser.add_argument('--num-texts', type=int, default=5000,
+                        help='Paragraphs to tokenize')
+    parser.add_argument('--num-examples', type=int, default=2000,
+                        help='Reader examples (question, paragraph)')
+    parser.add_argument('--n-docs', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=128,
+                        help='Reader batch size')
+    parser.add_argument('--predict-batch-size', type=int, default=100,
+                        help='Questions per process_batch call')
+    parser.add_argument('--tokenizer', type=str, default=None,
+                        help='Tokenizer (default: that of the corpus)')
+    parser.add_argument('--num-workers', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Torch intra-op threads')
+    parser.add_argument('--out', type=str, default=None,
+                        help='Write the report (JSON) here')
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    with open(os.path.join(args.corpus_dir, 'corpus.json')) as f:
+        corpus = json.load(f)
+    paths = corpus['paths']
+    args.tokenizer = args.tokenizer or corpus['options']['tokenizer']
+
+    questions = []
+    with open(paths['dataset']) as f:
+        for line in f:
+            questions.append(json.loads(line)['question'])
+    questions = questions[:args.num_queries]
+
+    ranker = retriever.get_class('tfidf')(tfidf_path=paths['tfidf'])
+    results = {}
+
+    if 'retriever' in args.benchmarks:
+        logger.info('Benchmarking retriever...')
+        results['retriever'] = bench_retriever(ranker, questions, args.n_docs,
+                                               args.num_workers)
+
+    if 'tokenizer' in args.benchmarks or 'reader' in args.benchmarks:
+        db = retriever.DocDB(db_path=paths['db'])
+        doc_ids = db.get_doc_ids()
+        texts = []
+        for doc_id in doc_ids:
+            texts.extend(paragraphs(db.get_doc_text(doc_id)))
+            if len(texts) >= args.num_texts:
+                break
+        texts = texts[:args.num_texts]
+
+    if 'tokenizer' in args.benchmarks:
+        logger.info('Benchmarking tokenizer...')
+        results['tokenizer'] = bench_tokenizer(args.tokenizer, texts,
+                                               args.repeat)
+
+    if 'reader' in args.benchmarks:
+        logger.info('Benchmarking reader...')
+        model = DocReader.load(paths['reader'])
+        model.network.eval()
+        # Each question against the paragraphs of its top document.
+        tokenizer = tokenizers.get_class(args.tokenizer)()
+        examples = []
+        for question in questions:
+            q_tokens = tokenizer.tokenize(question)
+            doc_ids, _ = ranker.closest_docs(question, k=1)
+            for text in paragraphs(db.get_doc_text(doc_ids[0])):
+                p_tokens = tokenizer.tokenize(text)
+                examples.append({
+                    'id': len(examples),
+                    'question': q_tokens.words(),
+                    'qlemma': q_tokens.lemmas(),
+                    'document': p_tokens.words(),
+                    'lemma': p_tokens.lemmas(),
+                    'pos': p_tokens.pos(),
+                    'ner': p_tokens.entities(),
+                })
+            if len(examples) >= args.num_examples:
+                break
+        tokenizer.shutdown()
+        results['reader'] = bench_reader(model, examples[:args.num_examples],
+                                         args.batch_size, args.repeat)
+
+    if 'pipeline' in args.benchmarks:
+        logger.info('Benchmarking pipeline...')
+        drqa = pipeline.DrQA(
+            reader_model=paths['reader'],
+            tokenizer=args.tokenizer,
+            batch_size=args.batch_size,
+            cuda=False,
+            ranker_config={'options': {'tfidf_path': paths['tfidf']}},
+            db_config={'options': {'db_path': paths['db']}},
+            num_workers=args.num_workers,
+        )
+        # The pipeline logs every query.
+        logging.getLogger('drqa').setLevel(logging.WARNING)
+        results['pipeline'] = bench_pipeline(
+            drqa, questions, args.num_latency_queries,
+            args.predict_batch_size, args.n_docs
+        )
+        logging.getLogger('drqa').setLevel(logging.NOTSET)
+
+    print_summary(results)
+    if args.out:
+        report = {'environment': environment(), 'corpus': corpus['options'],
+                  'options': vars(args), 'results': results}
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info('Report written to %s' % args.out)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Benchmark the startup time of the DrQA scripts.
+
+Each script is run as `<script> --help` in a fresh interpreter, which covers
+all of its imports and stops right after argument parsing. We also record
+which heavy dependencies each script ended up importing.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import prettytable
+
+from drqa import SCRIPTS_DIR
+
+SCRIPTS = [
+    'retriever/build_db.py',
+    'retriever/build_tfidf.py',
+    'retriever/eval.py',
+    'retriever/interactive.py',
+    'reader/preprocess.py',
+    'reader/train.py',
+    'reader/predict.py',
+    'reader/interactive.py',
+    'reader/export_bundle.py',
+    'reader/export_graph.py',
+    'pipeline/predict.py',
+    'pipeline/interactive.py',
+    'pipeline/eval.py',
+    'distant/generate.py',
+]
+
+HEAVY_MODULES = ['torch', 'cove', 'sklearn', 'scipy', 'pexpect', 'nltk']
+
+# Run the script with --help and report which heavy modules were loaded.
+RUNNER = """
+import sys, json, runpy
+sys.argv = [sys.argv[1], '--help']
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+sys.stderr.write('\\n' + json.dumps(
+    [m for m in %r if m in sys.modules]
+) + '\\n')
+""" % HEAVY_MODULES
+
+
+def run_once(path):
+    """Time one fresh start of the script at path."""
+    t0 = time.time()
+    proc = subprocess.run([sys.executable, '-c', RUNNER, path],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    elapsed = time.time() - t0
+    lines = proc.stderr.decode('utf-8', 'replace').strip().split('\n')
+    try:
+        loaded = json.loads(lines[-1])
+    except ValueError:
+        # The script crashed before the end of argument parsing.
+        return elapsed, None, lines[-1]
+    return elapsed, loaded, None
+
+
+def benchmark(script, repeat):
+    path = os.path.join(SCRIPTS_DIR, script)
+    times, loaded, error = [], None, None
+    for _ in range(repeat):
+        elapsed, loaded, error = run_once(path)
+        if error:
+            break
+        times.append(elapsed)
+    times.sort()
+    return {
+        'script': script,
+        'min': times[0] if times else None,
+        'median': times[len(times) // 2] if times else None,
+        'loaded': loaded,
+        'error': error,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scripts', nargs='*', default=SCRIPTS,
+                        help='Scripts to time, relative to the scripts dir')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of fresh starts per script')
+    parser.add_argument('--out', type=str, default=None,
+                        help='Optionally write the results as JSON here')
+    args = parser.parse_args()
+
+    results = [benchmark(s, args.repeat) for s in args.scripts]
+
+    table = prettytable.PrettyTable(
+        ['Script', 'Min (s)', 'Median (s)', 'Heavy imports']
+    )
+    for r in results:
+        if r['error']:
+            table.add_row([r['script'], '-', '-', 'ERROR: ' + r['error'][:40]])
+        else:
+            table.add_row([r['script'], '%.3f' % r['min'],
+                           '%.3f' % r['median'], ', '.join(r['loaded'])])
+    print(table)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
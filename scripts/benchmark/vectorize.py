@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Micro-benchmark of reader feature construction (vector.vectorize).
+
+Compares the vectorized, compact features against the original element-wise
+dense implementation on random SQuAD-like examples, and checks that once
+expanded by the network they are bit-identical.
+"""
+
+import time
+import random
+import argparse
+import torch
+
+from collections import Counter
+from drqa.reader import vector, utils, layers
+from drqa.reader.data import Dictionary
+
+POS = ['NN', 'NNS', 'NNP', 'VB', 'VBD', 'VBZ', 'JJ', 'IN', 'DT', 'CD', 'RB']
+NER = ['O', 'PERSON', 'LOCATION', 'ORGANIZATION', 'DATE', 'NUMBER']
+
+
+def legacy_features(ex, args, feature_dict):
+    """The original, element-at-a-time feature construction."""
+    features = torch.zeros(len(ex['document']), len(feature_dict))
+    if args.use_in_question:
+        q_words_cased = {w for w in ex['question']}
+        q_words_uncased = {w.lower() for w in ex['question']}
+        q_lemma = {w for w in ex['qlemma']} if args.use_lemma else None
+        for i in range(len(ex['document'])):
+            if ex['document'][i] in q_words_cased:
+                features[i][feature_dict['in_question']] = 1.0
+            if ex['document'][i].lower() in q_words_uncased:
+                features[i][feature_dict['in_question_uncased']] = 1.0
+            if q_lemma and ex['lemma'][i] in q_lemma:
+                features[i][feature_dict['in_question_lemma']] = 1.0
+    if args.use_pos:
+        for i, w in enumerate(ex['pos']):
+            f = 'pos=%s' % w
+            if f in feature_dict:
+                features[i][feature_dict[f]] = 1.0
+    if args.use_ner:
+        for i, w in enumerate(ex['ner']):
+            f = 'ner=%s' % w
+            if f in feature_dict:
+                features[i][feature_dict[f]] = 1.0
+    if args.use_tf:
+        counter = Counter([w.lower() for w in ex['document']])
+        l = len(ex['document'])
+        for i, w in enumerate(ex['document']):
+            features[i][feature_dict['tf']] = counter[w.lower()] * 1.0 / l
+    return features
+
+
+def dense_features(features, model_args):
+    """Expand a single example's compact features like the network does."""
+    return layers.expand_features(
+        tuple(f if f is None else f.unsqueeze(0) for f in features),
+        model_args.feature_value_cols, model_args.num_features
+    ).data[0]
+
+
+def random_example(vocab, doc_len, q_len):
+    document = [random.choice(vocab) for _ in range(doc_len)]
+    question = [random.choice(vocab) for _ in range(q_len)]
+    return {
+        'id': 0,
+        'question': question,
+        'qlemma': [w.lower() for w in question],
+        'document': document,
+        'lemma': [w.lower() for w in document],
+        # Include a tag never seen in training.
+        'pos': [random.choice(POS + ['XX']) for _ in range(doc_len)],
+        'ner': [random.choice(NER) for _ in range(doc_len)],
+    }
+
+
+def timeit(fn, examples, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.time()
+        for ex in examples:
+            fn(ex)
+        best = min(best, time.time() - t0)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-examples', type=int, default=1000)
+    parser.add_argument('--doc-len', type=int, default=150,
+                        help='Mean document length (tokens)')
+    parser.add_argument('--question-len', type=int, default=12)
+    parser.add_argument('--vocab-size', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1013)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    vocab = ['w%d' % i for i in range(args.vocab_size)]
+    vocab += [w.upper() for w in vocab[:args.vocab_size // 10]]
+    examples = [
+        random_example(vocab,
+                       random.randint(args.doc_len // 2, args.doc_len * 2),
+                       args.question_len)
+        for _ in range(args.num_examples)
+    ]
+
+    model_args = argparse.Namespace(use_in_question=True, use_lemma=True,
+                                    use_pos=True, use_ner=True, use_tf=True,
+                                    use_char_emb=False)
+    feature_dict = utils.build_feature_dict(model_args, [{
+        'pos': POS, 'ner': NER,
+    }])
+    model_args.num_features = len(feature_dict)
+    model_args.feature_value_cols = vector.feature_value_columns(feature_dict)
+    word_dict = Dictionary()
+    for w in vocab:
+        word_dict.add(w)
+    model = argparse.Namespace(args=model_args, word_dict=word_dict,
+                               feature_dict=feature_dict, character_dict=None)
+
+    # Correctness first.
+    for ex in examples:
+        new = dense_features(vector.vectorize(ex, model)[1], model_args)
+        old = legacy_features(ex, model_args, feature_dict)
+        assert new.dtype == old.dtype and torch.equal(new, old), \
+            'Feature mismatch on example with %d tokens' % len(ex['document'])
+    print('Features are bit-identical on %d examples.' % len(examples))
+
+    tokens = sum(len(ex['document']) for ex in examples)
+    legacy = timeit(lambda ex: legacy_features(ex, model_args, feature_dict),
+                    examples, args.repeat)
+    fast = timeit(lambda ex: vector.compact_features(ex, model_args,
+                                                     feature_dict),
+                  examples, args.repeat)
+    full = timeit(lambda ex: vector.vectorize(ex, model), examples, args.repeat)
+    print('%d examples, %d document tokens, %d features' %
+          (len(examples), tokens, len(feature_dict)))
+    print('legacy features:     %.3f (s) | %.1f ex/s' %
+          (legacy, len(examples) / legacy))
+    print('compact features:    %.3f (s) | %.1f ex/s | %.1fx' %
+          (fast, len(examples) / fast, legacy / fast))
+    print('full vectorize:      %.3f (s) | %.1f ex/s' %
+          (full, len(examples) / full))
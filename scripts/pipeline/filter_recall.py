@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Measure the answer recall lost to the pipeline's paragraph pre-filter.
+
+For each question, the top n-docs documents are retrieved and split into
+passages (paragraphs, packed with --pack-tokens as in the pipeline). A
+question is a match if one of the passages kept by the filter contains the
+answer; this is compared to the recall of all passages, together with the
+fraction of passages kept (i.e. of reader work left), for several values of
+top-m and threshold:
+
+    python scripts/pipeline/filter_recall.py dataset.txt \
+        --top-m 1 3 5 10 20 --threshold 0.3 0.5
+"""
+
+import regex as re
+import logging
+import argparse
+import json
+import time
+import os
+import prettytable
+
+from multiprocessing import Pool as ProcessPool
+from multiprocessing.util import Finalize
+from functools import partial
+from drqa import retriever, tokenizers
+from drqa.retriever import utils
+from drqa.pipeline import ParagraphFilter
+from drqa.pipeline.drqa import pack_paragraphs, join_tokens
+
+# ------------------------------------------------------------------------------
+# Multiprocessing target functions.
+# ------------------------------------------------------------------------------
+
+PROCESS_TOK = None
+PROCESS_DB = None
+PROCESS_FILTER = None
+
+
+def init(tokenizer_class, tokenizer_opts, db_class, db_opts, paragraph_filter):
+    global PROCESS_TOK, PROCESS_DB, PROCESS_FILTER
+    PROCESS_TOK = tokenizer_class(**tokenizer_opts)
+    Finalize(PROCESS_TOK, PROCESS_TOK.shutdown, exitpriority=100)
+    PROCESS_DB = db_class(**db_opts)
+    Finalize(PROCESS_DB, PROCESS_DB.close, exitpriority=100)
+    PROCESS_FILTER = paragraph_filter
+
+
+def regex_match(text, pattern):
+    """Test if a regex pattern is contained within a text."""
+    try:
+        pattern = re.compile(
+            pattern,
+            flags=re.IGNORECASE + re.UNICODE + re.MULTILINE,
+        )
+    except BaseException:
+        return False
+    return pattern.search(text) is not None
+
+
+def has_answer(answer, text, tokens, match):
+    """Check if a paragraph (text and its tokens) contains an answer."""
+    global PROCESS_TOK
+    if match == 'string':
+        words = tokens.words(uncased=True)
+        for single_answer in answer:
+            single_answer = utils.normalize(single_answer)
+            single_answer = PROCESS_TOK.tokenize(single_answer)
+            single_answer = single_answer.words(uncased=True)
+            for i in range(0, len(words) - len(single_answer) + 1):
+                if single_answer == words[i: i + len(single_answer)]:
+                    return True
+    elif match == 'regex':
+        single_answer = utils.normalize(answer[0])
+        if regex_match(text, single_answer):
+            return True
+    return False
+
+
+def score_paragraphs(question_answer_docs, match, pack_tokens=0,
+                     window_overlap=0):
+    """Return (filter score, has answer) for each passage of the docs."""
+    global PROCESS_DB, PROCESS_TOK, PROCESS_FILTER
+    question, answer, (doc_ids, doc_scores) = question_answer_docs
+    weights = PROCESS_FILTER.weights(
+        PROCESS_TOK.tokenize(utils.normalize(question))
+    )
+    paragraphs = []
+    for doc_id in doc_ids:
+        text = utils.normalize(PROCESS_DB.get_doc_text(doc_id))
+        # Paragraphs as split by the pipeline.
+        splits = [split.strip() for split in re.split(r'\n+', text)]
+        tokens = [PROCESS_TOK.tokenize(split) for split in splits if split]
+        lengths = [len(t.words()) for t in tokens]
+        for passage in pack_paragraphs(lengths, pack_tokens, window_overlap):
+            passage = join_tokens([(tokens[i], s, e) for i, s, e in passage])
+            score = PROCESS_FILTER.scores(
+                weights, [PROCESS_FILTER.hashes(passage)]
+            )[0]
+            found = has_answer(answer, passage.untokenize(), passage, match)
+            paragraphs.append((score, found))
+    return paragraphs
+
+
+def recall(paragraph_filter, all_paragraphs):
+    """Return (questions matched, paragraphs kept) under paragraph_filter."""
+    matches, kept = 0, 0
+    for paragraphs in all_paragraphs:
+        keep = paragraph_filter.select([score for score, _ in paragraphs])
+        matches += any(paragraphs[i][1] for i in keep)
+        kept += len(keep)
+    return matches, kept
+
+
+# ------------------------------------------------------------------------------
+# Main
+# ------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    fmt = logging.Formatter('%(asctime)s: [ %(message)s ]',
+                            '%m/%d/%Y %I:%M:%S %p')
+    console = logging.StreamHandler()
+    console.setFormatter(fmt)
+    logger.addHandler(console)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dataset', type=str, default=None)
+    parser.add_argument('--retriever-model', type=str, default=None)
+    parser.add_argument('--doc-db', type=str, default=None,
+                        help='Path to Document DB')
+    parser.add_argument('--tokenizer', type=str, default='regexp')
+    parser.add_argument('--n-docs', type=int, default=5)
+    parser.add_argument('--num-workers', type=int, default=None)
+    parser.add_argument('--match', type=str, default='string',
+                        choices=['regex', 'string'])
+    parser.add_argument('--pack-tokens', type=int, default=0,
+                        help='Passage size in tokens (see DrQA pack_tokens)')
+    parser.add_argument('--window-overlap', type=int, default=32)
+    parser.add_argument('--top-m', type=int, nargs='*',
+                        default=[1, 3, 5, 10, 20],
+                        help='Values of top-m to evaluate')
+    parser.add_argument('--threshold', type=float, nargs='*', default=[],
+                        help='Values of threshold to evaluate')
+    parser.add_argument('--no-idf', action='store_true',
+                        help='Weigh all question terms equally')
+    args = parser.parse_args()
+    if 0 < args.pack_tokens <= args.window_overlap:
+        parser.error('--window-overlap must be smaller than --pack-tokens')
+
+    # start time
+    start = time.time()
+
+    # read all the data and store it
+    logger.info('Reading data ...')
+    questions = []
+    answers = []
+    for line in open(args.dataset):
+        data = json.loads(line)
+        questions.append(data['question'])
+        answers.append(data['answer'])
+
+    # get the closest docs for each question.
+    logger.info('Initializing ranker...')
+    ranker = retriever.get_class('tfidf')(tfidf_path=args.retriever_model,
+                                          strict=False)
+
+    logger.info('Ranking...')
+    closest_docs = ranker.batch_closest_docs(
+        questions, k=args.n_docs, num_workers=args.num_workers
+    )
+    question_answers_docs = zip(questions, answers, closest_docs)
+
+    # Scores do not depend on top-m or threshold: compute them once.
+    if args.no_idf:
+        scorer = ParagraphFilter(top_m=1, ngrams=ranker.ngrams,
+                                 hash_size=ranker.hash_size)
+    else:
+        scorer = ParagraphFilter(top_m=1, ranker=ranker)
+
+    # define processes
+    tok_class = tokenizers.get_class(args.tokenizer)
+    tok_opts = {}
+    db_class = retriever.DocDB
+    db_opts = {'db_path': args.doc_db}
+    processes = ProcessPool(
+        processes=args.num_workers,
+        initializer=init,
+        initargs=(tok_class, tok_opts, db_class, db_opts, scorer)
+    )
+
+    logger.info('Retrieving and scoring passages...')
+    score_partial = partial(score_paragraphs, match=args.match,
+                            pack_tokens=args.pack_tokens,
+                            window_overlap=args.window_overlap)
+    all_paragraphs = processes.map(score_partial, question_answers_docs)
+
+    total = len(all_paragraphs)
+    num_paragraphs = sum(len(p) for p in all_paragraphs)
+    base = sum(any(a for _, a in p) for p in all_paragraphs)
+
+    settings = [('all', None)]
+    settings += [('top-m %d' % m, ParagraphFilter(top_m=m))
+                 for m in args.top_m]
+    settings += [('threshold %.2f' % t, ParagraphFilter(threshold=t))
+                 for t in args.threshold]
+
+    table = prettytable.PrettyTable(
+        ['Filter', 'Matches', 'Match %', 'Recall lost %', 'Passages',
+         'Kept %']
+    )
+    for name, paragraph_filter in settings:
+        if paragraph_filter is None:
+            matches, kept = base, num_paragraphs
+        else:
+            matches, kept = recall(paragraph_filter, all_paragraphs)
+        table.add_row([
+            name, matches,
+            '%2.2f' % (matches / max(total, 1) * 100),
+            '%2.2f' % ((base - matches) / max(base, 1) * 100),
+            kept,
+            '%2.2f' % (kept / max(num_paragraphs, 1) * 100),
+        ])
+
+    filename = os.path.basename(args.dataset)
+    print('\n%s: %d examples, top %d docs, %d passages' %
+          (filename, total, args.n_docs, num_paragraphs))
+    print(table)
+    print('Total time: %2.4f (s)' % (time.time() - start))
@@ -36,6 +36,15 @@ parser.add_argument('--tokenizer', type=str, default=None,
 parser.add_argument('--candidate-file', type=str, default=None,
                     help=("List of candidates to restrict predictions to, "
                           "one candidate per line"))
+parser.add_argument('--incremental', action='store_true',
+                    help=('Read paragraphs in retrieval order and stop early '
+                          '(see DrQA.process_incremental)'))
+parser.add_argument('--margin', type=float, default=0.1,
+                    help=('Incremental mode: early stop margin over the '
+                          'estimated best unread score '
+                          '(see DrQA.process_incremental)'))
+parser.add_argument('--time-budget', type=float, default=None,
+                    help='Incremental mode: max seconds of reading per query')
 parser.add_argument('--no-cuda', action='store_true',
                     help="Use CPU only")
 parser.add_argument('--gpu', type=int, default=-1,
@@ -77,9 +86,15 @@ DrQA = pipeline.DrQA(
 
 
 def process(question, candidates=None, top_n=1, n_docs=5):
-    predictions = DrQA.process(
-        question, candidates, top_n, n_docs, return_context=True
-    )
+    if args.incremental:
+        predictions = DrQA.process_incremental(
+            question, candidates, top_n, n_docs, return_context=True,
+            margin=args.margin, time_budget=args.time_budget
+        )
+    else:
+        predictions = DrQA.process(
+            question, candidates, top_n, n_docs, return_context=True
+        )
     table = prettytable.PrettyTable(
         ['Rank', 'Answer', 'Doc', 'Answer Score', 'Doc Score']
     )
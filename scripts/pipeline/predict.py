@@ -14,6 +14,7 @@ import argparse
 import logging
 
 from drqa import pipeline
+from drqa.common import metrics
 from drqa.retriever import utils
 
 
@@ -56,13 +57,47 @@ parser.add_argument('--parallel', action='store_true',
                     help='Use data parallel (split across gpus)')
 parser.add_argument('--num-workers', type=int, default=None,
                     help='Number of CPU processes (for tokenizing, etc)')
+parser.add_argument('--reader-replicas', type=int, default=0,
+                    help=('Number of processes to run the reader in on CPU '
+                          '(sharing its weights)'))
 parser.add_argument('--batch-size', type=int, default=128,
                     help='Document paragraph batching size')
+parser.add_argument('--max-tokens', type=int, default=None,
+                    help=('Batch paragraphs by this budget of padded tokens '
+                          'instead of batch-size'))
+parser.add_argument('--pack-tokens', type=int, default=0,
+                    help=('Read passages of up to this many tokens: pack '
+                          'short paragraphs, window long ones (0 = off)'))
+parser.add_argument('--window-overlap', type=int, default=32,
+                    help='Tokens shared by consecutive windows')
+parser.add_argument('--filter-top-m', type=int, default=None,
+                    help=('Only read the M paragraphs per question that '
+                          'overlap the most with it'))
+parser.add_argument('--filter-threshold', type=float, default=None,
+                    help=('Only read paragraphs covering at least this '
+                          'fraction of the (idf weighted) question terms'))
 parser.add_argument('--predict-batch-size', type=int, default=1000,
                     help='Question batching size')
+parser.add_argument('--pipelined', action='store_true',
+                    help=('Run the pipeline stages of consecutive question '
+                          'batches concurrently'))
+parser.add_argument('--queue-size', type=int, default=2,
+                    help='Pipelined mode: max batches waiting per stage')
+parser.add_argument('--metrics-out', type=str, default=None,
+                    help='Append a metrics snapshot (JSON line) per batch')
+parser.add_argument('--prometheus-out', type=str, default=None,
+                    help='Write final metrics in Prometheus text format')
+parser.add_argument('--trace-out', type=str, default=None,
+                    help='Write per-query trace spans (JSON lines)')
 args = parser.parse_args()
 t0 = time.time()
 
+if args.metrics_out or args.prometheus_out or args.trace_out:
+    metrics.enable(metrics=bool(args.metrics_out or args.prometheus_out),
+                   tracing=bool(args.trace_out))
+    if args.trace_out and os.path.exists(args.trace_out):
+        os.remove(args.trace_out)
+
 args.cuda = not args.no_cuda and torch.cuda.is_available()
 if args.cuda:
     torch.cuda.set_device(args.gpu)
@@ -81,6 +116,12 @@ if args.candidate_file:
 else:
     candidates = None
 
+if args.filter_top_m or args.filter_threshold is not None:
+    filter_config = {'top_m': args.filter_top_m,
+                     'threshold': args.filter_threshold}
+else:
+    filter_config = None
+
 logger.info('Initializing pipeline...')
 DrQA = pipeline.DrQA(
     reader_model=args.reader_model,
@@ -88,12 +129,17 @@ DrQA = pipeline.DrQA(
     embedding_file=args.embedding_file,
     tokenizer=args.tokenizer,
     batch_size=args.batch_size,
+    max_tokens=args.max_tokens,
+    pack_tokens=args.pack_tokens,
+    window_overlap=args.window_overlap,
     cuda=args.cuda,
     data_parallel=args.parallel,
     ranker_config={'options': {'tfidf_path': args.retriever_model,
                                'strict': False}},
     db_config={'options': {'db_path': args.doc_db}},
     num_workers=args.num_workers,
+    reader_replicas=args.reader_replicas,
+    filter_config=filter_config,
 )
 
 
@@ -116,16 +162,43 @@ logger.info('Writing results to %s' % outfile)
 with open(outfile, 'w') as f:
     batches = [queries[i: i + args.predict_batch_size]
                for i in range(0, len(queries), args.predict_batch_size)]
-    for i, batch in enumerate(batches):
+
+    def flush_metrics():
+        if args.metrics_out:
+            metrics.METRICS.write_json(args.metrics_out)
+        if args.trace_out:
+            metrics.TRACER.write_json(args.trace_out)
+
+    def write(i, predictions):
         logger.info(
-            '-' * 25 + ' Batch %d/%d ' % (i + 1, len(batches)) + '-' * 25
-        )
-        predictions = DrQA.process_batch(
-            batch,
-            n_docs=args.n_docs,
-            top_n=args.top_n,
+            '-' * 25 + ' Batch %d/%d done ' % (i + 1, len(batches)) + '-' * 25
         )
         for p in predictions:
             f.write(json.dumps(p) + '\n')
+        flush_metrics()
+
+    if args.pipelined:
+        # Overlap the stages of consecutive batches.
+        runner = pipeline.PipelinedDrQA(DrQA, queue_size=args.queue_size)
+        runner.process_batches(batches, write, top_n=args.top_n,
+                               n_docs=args.n_docs)
+    else:
+        for i, batch in enumerate(batches):
+            # Write each query's predictions as soon as it (and all queries
+            # before it) are done.
+            done, written = {}, 0
+            for qidx, predictions in DrQA.process_batch_stream(
+                    batch, n_docs=args.n_docs, top_n=args.top_n):
+                done[qidx] = predictions
+                while written in done:
+                    f.write(json.dumps(done.pop(written)) + '\n')
+                    written += 1
+            logger.info(
+                '-' * 25 + ' Batch %d/%d done ' % (i + 1, len(batches)) +
+                '-' * 25
+            )
+            flush_metrics()
 
+if args.prometheus_out:
+    metrics.METRICS.write_prometheus(args.prometheus_out)
 logger.info('Total time: %.2f' % (time.time() - t0))
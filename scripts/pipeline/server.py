@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Serve the full DrQA pipeline over HTTP, batching concurrent queries.
+
+    GET /process?question=...&top_n=1&n_docs=5  -> predictions (JSON)
+    GET /stats                                   -> batching statistics
+    GET /metrics                                 -> metrics (Prometheus text,
+                                                    with --metrics)
+
+Queries are answered by a pipeline.RequestBatcher: concurrent queries are
+run through DrQA.process_batch together.
+"""
+
+import json
+import torch
+import argparse
+import logging
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+from drqa import pipeline
+from drqa.common import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+fmt = logging.Formatter('%(asctime)s: [ %(message)s ]', '%m/%d/%Y %I:%M:%S %p')
+console = logging.StreamHandler()
+console.setFormatter(fmt)
+logger.addHandler(console)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', type=str, default='localhost')
+parser.add_argument('--port', type=int, default=8000)
+parser.add_argument('--reader-model', type=str, default=None,
+                    help='Path to trained Document Reader model')
+parser.add_argument('--retriever-model', type=str, default=None,
+                    help='Path to Document Retriever model (tfidf)')
+parser.add_argument('--doc-db', type=str, default=None,
+                    help='Path to Document DB')
+parser.add_argument('--tokenizer', type=str, default=None,
+                    help=("String option specifying tokenizer type to "
+                          "use (e.g. 'corenlp')"))
+parser.add_argument('--num-workers', type=int, default=None,
+                    help='Number of CPU processes (for tokenizing, etc)')
+parser.add_argument('--max-batch-size', type=int, default=32,
+                    help='Max number of queries run together')
+parser.add_argument('--max-wait', type=float, default=0.01,
+                    help='Max seconds a query waits for others to join it')
+parser.add_argument('--metrics', action='store_true',
+                    help='Collect pipeline metrics (served at /metrics)')
+parser.add_argument('--no-cuda', action='store_true',
+                    help="Use CPU only")
+parser.add_argument('--gpu', type=int, default=-1,
+                    help="Specify GPU device id to use")
+args = parser.parse_args()
+
+if args.metrics:
+    metrics.enable()
+
+args.cuda = not args.no_cuda and torch.cuda.is_available()
+if args.cuda:
+    torch.cuda.set_device(args.gpu)
+    logger.info('CUDA enabled (GPU %d)' % args.gpu)
+else:
+    logger.info('Running on CPU only.')
+
+logger.info('Initializing pipeline...')
+DrQA = pipeline.DrQA(
+    cuda=args.cuda,
+    reader_model=args.reader_model,
+    ranker_config={'options': {'tfidf_path': args.retriever_model,
+                               'strict': False}},
+    db_config={'options': {'db_path': args.doc_db}},
+    tokenizer=args.tokenizer,
+    num_workers=args.num_workers,
+)
+batcher = pipeline.RequestBatcher(DrQA, args.max_batch_size, args.max_wait)
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == '/stats':
+            self.reply(200, batcher.stats())
+        elif url.path == '/metrics' and args.metrics:
+            self.reply(200, metrics.METRICS.prometheus(),
+                       'text/plain; version=0.0.4')
+        elif url.path == '/process' and params.get('question'):
+            try:
+                predictions = batcher.process(
+                    params['question'],
+                    top_n=int(params.get('top_n', 1)),
+                    n_docs=int(params.get('n_docs', 5)),
+                    return_context=params.get('context') == '1',
+                )
+            except Exception as e:
+                self.reply(500, {'error': str(e)})
+            else:
+                self.reply(200, predictions)
+        else:
+            self.reply(404, {'error': 'Unknown request: %s' % self.path})
+
+    def reply(self, code, data, content_type='application/json'):
+        if content_type == 'application/json':
+            data = json.dumps(data)
+        body = data.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+logger.info('Serving on http://%s:%d' % (args.host, args.port))
+try:
+    Server((args.host, args.port), Handler).serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    batcher.close()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Export a trained DocReader (.mdl) as a fast-start serving bundle.
+
+The bundle directory can be used anywhere a module file is expected (e.g.
+--reader-model of the pipeline scripts). If an embedding file is given, the
+dictionary is expanded with it at export time, so that serving does not
+need to read it again.
+"""
+
+import argparse
+import logging
+
+from drqa.reader import DocReader, utils
+from drqa.reader.bundle import export_bundle
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+fmt = logging.Formatter('%(asctime)s: [ %(message)s ]', '%m/%d/%Y %I:%M:%S %p')
+console = logging.StreamHandler()
+console.setFormatter(fmt)
+logger.addHandler(console)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('model', type=str, help='Path to module file (.mdl)')
+parser.add_argument('out_dir', type=str, help='Bundle directory to write')
+parser.add_argument('--embedding-file', type=str, default=None,
+                    help=('Expand dictionary to use all pretrained '
+                          'embeddings in this file.'))
+args = parser.parse_args()
+
+model = DocReader.load(args.model)
+if args.embedding_file:
+    logger.info('Expanding dictionary...')
+    words = utils.index_embedding_words(args.embedding_file)
+    added = model.expand_dictionary(words)
+    model.load_embeddings(added, args.embedding_file)
+export_bundle(model, args.out_dir)
+logger.info('Done. Vocab size = %d' % len(model.word_dict))
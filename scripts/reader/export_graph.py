@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Copyright 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Export the network of a trained DocReader as TorchScript or ONNX, then
+check that the exported graph gives the same scores as the eager network.
+
+    python scripts/reader/export_graph.py model.mdl model.pt
+    python scripts/reader/export_graph.py model.mdl model.onnx --format onnx
+
+Use it for inference with DocReader.set_backend('torchscript', 'model.pt').
+"""
+
+import sys
+import argparse
+import logging
+import torch
+
+from drqa.reader import DocReader, utils
+from drqa.reader.backends import (export_graph, example_inputs, get_backend,
+                                  input_names)
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+fmt = logging.Formatter('%(asctime)s: [ %(message)s ]', '%m/%d/%Y %I:%M:%S %p')
+console = logging.StreamHandler()
+console.setFormatter(fmt)
+logger.addHandler(console)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('model', type=str, help='Path to module file (.mdl)')
+parser.add_argument('out_file', type=str, help='Exported graph to write')
+parser.add_argument('--format', type=str, default='torchscript',
+                    choices=['torchscript', 'onnx'])
+parser.add_argument('--embedding-file', type=str, default=None,
+                    help=('Expand dictionary to use all pretrained '
+                          'embeddings in this file.'))
+parser.add_argument('--tolerance', type=float, default=1e-5,
+                    help='Max absolute score difference allowed')
+parser.add_argument('--no-check', action='store_true',
+                    help='Skip the parity check')
+args = parser.parse_args()
+
+model = DocReader.load(args.model)
+if args.embedding_file:
+    logger.info('Expanding dictionary...')
+    words = utils.index_embedding_words(args.embedding_file)
+    added = model.expand_dictionary(words)
+    model.load_embeddings(added, args.embedding_file)
+export_graph(model, args.out_file, args.format)
+if args.no_check:
+    sys.exit(0)
+
+
+# ------------------------------------------------------------------------------
+# Parity check: eager network vs. exported graph, on batches of other shapes
+# than the one traced.
+# ------------------------------------------------------------------------------
+
+
+backend = get_backend(args.format, args.out_file)
+names = input_names(model)
+failed = False
+for batch_size, doc_len, question_len in ((1, 30, 5), (7, 120, 14),
+                                          (32, 250, 30)):
+    inputs = example_inputs(model, batch_size, doc_len, question_len)
+    with torch.no_grad():
+        expected = model.network(*inputs)
+    scores = backend.run(inputs, names)
+    diff = max(float((e.data - s).abs().max())
+               for e, s in zip(expected, scores))
+    same = sum(int(e.data.max(1)[1].eq(s.max(1)[1]).sum())
+               for e, s in zip(expected, scores))
+    logger.info('batch = %d x %d: max score diff = %.2e | same argmax = '
+                '%d/%d' % (batch_size, doc_len, diff, same, 2 * batch_size))
+    failed = failed or not diff <= args.tolerance
+if failed:
+    logger.error('Parity check FAILED (tolerance %.1e)' % args.tolerance)
+    sys.exit(1)
+logger.info('Parity check passed.')
@@ -14,7 +14,7 @@ import logging
 import json
 
 from tqdm import tqdm
-from drqa.reader import Predictor
+from drqa.reader import Predictor, utils
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -26,8 +26,8 @@ logger.addHandler(console)
 parser = argparse.ArgumentParser()
 parser.add_argument('dataset', type=str, default=None,
                     help='SQuAD-like dataset to evaluate on')
-parser.add_argument('--module', type=str, default=None,
-                    help='Path to module to use')
+parser.add_argument('--model', '--module', type=str, default=None,
+                    dest='model', help='Path to module to use')
 parser.add_argument('--embedding-file', type=str, default=None,
                     help=('Expand dictionary to use all pretrained '
                           'embeddings in this file.'))
@@ -49,6 +49,13 @@ parser.add_argument('--top-n', type=int, default=1,
                     help='Store top N predicted spans per example')
 parser.add_argument('--official', action='store_true',
                     help='Only store single top span instead of top N list')
+parser.add_argument('--quantize', action='store_true',
+                    help='Use int8 dynamic quantization (CPU only)')
+parser.add_argument('--quantize-embedding', action='store_true',
+                    help='With --quantize, also store embeddings in 8 bits')
+parser.add_argument('--report', action='store_true',
+                    help=('Report accuracy (EM/F1) and reader latency; with '
+                          '--quantize, of both the float and int8 models'))
 args = parser.parse_args()
 t0 = time.time()
 
@@ -60,13 +67,15 @@ else:
     logger.info('Running on CPU only.')
 
 predictor = Predictor(
-    args.model,
-    args.tokenizer,
-    args.embedding_file,
-    args.num_workers,
+    model=args.model,
+    tokenizer=args.tokenizer,
+    embedding_file=args.embedding_file,
+    num_workers=args.num_workers,
 )
 if args.cuda:
     predictor.cuda()
+if args.quantize and args.cuda:
+    raise RuntimeError('--quantize is for CPU inference (use --no-cuda)')
 
 
 # ------------------------------------------------------------------------------
@@ -76,6 +85,7 @@ if args.cuda:
 
 examples = []
 qids = []
+answers = []
 with open(args.dataset) as f:
     data = json.load(f)['data']
     for article in data:
@@ -84,20 +94,68 @@ with open(args.dataset) as f:
             for qa in paragraph['qas']:
                 qids.append(qa['id'])
                 examples.append((context, qa['question']))
+                answers.append([a['text'] for a in qa.get('answers', [])])
 
-results = {}
-for i in tqdm(range(0, len(examples), args.batch_size)):
-    predictions = predictor.predict_batch(
-        examples[i:i + args.batch_size], top_n=args.top_n
-    )
-    for j in range(len(predictions)):
-        # Official eval expects just a qid --> span
-        if args.official:
-            results[qids[i + j]] = predictions[j][0][0]
-
-        # Otherwise we store top N and scores for debugging.
-        else:
-            results[qids[i + j]] = [(p[0], float(p[1])) for p in predictions[j]]
+
+def predict():
+    predictor.reader_timer.reset().stop()
+    results = {}
+    for i in tqdm(range(0, len(examples), args.batch_size)):
+        predictions = predictor.predict_batch(
+            examples[i:i + args.batch_size], top_n=args.top_n
+        )
+        for j in range(len(predictions)):
+            # Official eval expects just a qid --> span
+            if args.official:
+                results[qids[i + j]] = predictions[j][0][0]
+
+            # Otherwise we store top N and scores for debugging.
+            else:
+                results[qids[i + j]] = [(p[0], float(p[1]))
+                                        for p in predictions[j]]
+    return results
+
+
+def report(name, results):
+    """Log EM/F1 of the top predictions and the time spent in the reader."""
+    exact_match, f1, total = 0, 0, 0
+    for qid, ground_truths in zip(qids, answers):
+        if not ground_truths:
+            continue
+        prediction = results[qid]
+        if not args.official:
+            prediction = prediction[0][0]
+        exact_match += utils.metric_max_over_ground_truths(
+            utils.exact_match_score, prediction, ground_truths
+        )
+        f1 += utils.metric_max_over_ground_truths(
+            utils.f1_score, prediction, ground_truths
+        )
+        total += 1
+    elapsed = predictor.reader_timer.time()
+    logger.info('%s: EM = %.2f | F1 = %.2f | examples = %d | reader time = '
+                '%.2f (s), %.2f (ms/batch)' %
+                (name, 100.0 * exact_match / max(total, 1),
+                 100.0 * f1 / max(total, 1), total, elapsed,
+                 1000 * elapsed * args.batch_size / max(len(examples), 1)))
+
+
+if args.report and args.quantize:
+    float_results = predict()
+    report('float32', float_results)
+
+if args.quantize:
+    predictor.quantize(embedding=args.quantize_embedding)
+
+results = predict()
+if args.report:
+    report('int8' if args.quantize else 'float32', results)
+    if args.quantize:
+        same = sum(float_results[qid] == results[qid] if args.official else
+                   float_results[qid][0][0] == results[qid][0][0]
+                   for qid in qids)
+        logger.info('Same top prediction as float32: %.2f%%' %
+                    (100.0 * same / max(len(qids), 1)))
 
 model = os.path.splitext(os.path.basename(args.model or 'default'))[0]
 basename = os.path.splitext(os.path.basename(args.dataset))[0]
@@ -15,7 +15,8 @@ import sys
 import subprocess
 import logging
 
-from drqa.reader import utils, vector, config, data
+from itertools import chain
+from drqa.reader import utils, vector, config, data, cache, stream
 from drqa.reader import DocReader
 from drqa import DATA_DIR as DRQA_DATA
 from drqa import SCRIPTS_DIR as DRQA_SCRIPTS
@@ -63,6 +64,18 @@ def add_train_args(parser):
                          help='Batch size for training')
     runtime.add_argument('--test-batch-size', type=int, default=128,
                          help='Batch size during validation/testing')
+    runtime.add_argument('--shuffle-buffer', type=int, default=10000,
+                         help=('Number of streamed train examples bucketed '
+                               'by length and shuffled together'))
+    runtime.add_argument('--epoch-size', type=int, default=0,
+                         help=('Streamed train examples per epoch, drawn by '
+                               'source weight (0 = read each source once)'))
+    runtime.add_argument('--max-tokens', type=int, default=0,
+                         help=('Batch training examples by a budget of padded '
+                               'document tokens instead (0 = use batch-size)'))
+    runtime.add_argument('--test-max-tokens', type=int, default=0,
+                         help=('Padded document token budget per batch '
+                               'during validation (0 = use test-batch-size)'))
 
     # Files
     files = parser.add_argument_group('Filesystem')
@@ -75,6 +88,11 @@ def add_train_args(parser):
     files.add_argument('--train-file', type=str,
                        default='SQuAD-v1.1-train-processed-corenlp.txt',
                        help='Preprocessed train file')
+    files.add_argument('--train-sources', type=str, nargs='+', default=None,
+                       help=('Stream train examples from these sources '
+                             'instead of train-file: "glob[:weight]" of '
+                             'preprocessed shards, e.g. "squad*.txt:2 '
+                             'webq*.dstrain:1"'))
     files.add_argument('--dev-file', type=str,
                        default='SQuAD-v1.1-dev-processed-corenlp.txt',
                        help='Preprocessed dev file')
@@ -92,6 +110,9 @@ def add_train_args(parser):
     files.add_argument('--prediction_file', type=str,
                        default='_dev_prediction.json',
                        help='Prediction of dev set file')
+    files.add_argument('--cache-dir', type=str, default='',
+                       help=('Directory for binary caches of vectorized '
+                             'train/dev examples (disabled if empty)'))
 
     # Saving + loading
     save_load = parser.add_argument_group('Saving/Loading')
@@ -130,7 +151,7 @@ def set_defaults(args):
     if not os.path.isfile(args.dev_json):
         raise IOError('No such file: %s' % args.dev_json)
     args.train_file = os.path.join(args.data_dir, args.train_file)
-    if not os.path.isfile(args.train_file):
+    if not args.train_sources and not os.path.isfile(args.train_file):
         raise IOError('No such file: %s' % args.train_file)
     args.dev_file = os.path.join(args.data_dir, args.dev_file)
     if not os.path.isfile(args.dev_file):
@@ -194,14 +215,14 @@ def init_from_scratch(args, train_exs, dev_exs):
     # Build a dictionary from the data questions + words (train/dev splits)
     logger.info('-' * 100)
     logger.info('Build dictionary')
-    word_dict = utils.build_word_dict(args, train_exs + dev_exs)
+    word_dict = utils.build_word_dict(args, chain(train_exs, dev_exs))
     logger.info('Num words = %d' % len(word_dict))
 
     if args.use_char_emb:
         # Build a character dictionary from the data questions + words (train/dev splits)
         logger.info('-' * 100)
         logger.info('Build character dictionary')
-        character_dict = utils.build_character_dict(args, train_exs + dev_exs)
+        character_dict = utils.build_character_dict(args, chain(train_exs, dev_exs))
         logger.info('Num character = %d' % len(character_dict))
         # Initialize module
         model = DocReader(config.get_model_args(args), word_dict, feature_dict, character_dict)
@@ -227,12 +248,18 @@ def train(args, data_loader, model, global_stats):
     train_loss = utils.AverageMeter()
     epoch_time = utils.Timer()
 
+    # Streamed data has no known length
+    try:
+        num_iters = str(len(data_loader))
+    except TypeError:
+        num_iters = '?'
+
     # Run one epoch
     for idx, ex in enumerate(data_loader):
         train_loss.update(*model.update(ex))
         if idx % args.display_iter == 0:
-            logger.info('train: Epoch = %d | iter = %d/%d | ' %
-                        (global_stats['epoch'], idx, len(data_loader)) +
+            logger.info('train: Epoch = %d | iter = %d/%s | ' %
+                        (global_stats['epoch'], idx, num_iters) +
                         'loss = %.2f | elapsed time = %.2f (s)' %
                         (train_loss.avg, global_stats['timer'].time()))
             train_loss.reset()
@@ -401,23 +428,120 @@ def eval_accuracies(pred_s, target_s, pred_e, target_e):
 # ------------------------------------------------------------------------------
 
 
+class LazyExamples(object):
+    """Examples of a data file, only loaded when first needed (e.g. not at
+    all if they are read from a binary cache).
+    """
+
+    def __init__(self, args, filename, skip_no_answer=False):
+        self.args = args
+        self.filename = filename
+        self.skip_no_answer = skip_no_answer
+        self.examples = None
+
+    def __call__(self):
+        if self.examples is None:
+            self.examples = utils.load_data(self.args, self.filename,
+                                            self.skip_no_answer)
+            logger.info('Num examples in %s = %d' %
+                        (self.filename, len(self.examples)))
+        return self.examples
+
+
+def make_dataset(args, exs, model, single_answer):
+    """Read examples from the binary cache if enabled (and supported)."""
+    if args.cache_dir and not getattr(model.args, 'use_char_emb', False):
+        return cache.cached_dataset(exs.filename, exs, model, args.cache_dir,
+                                    single_answer=single_answer,
+                                    skip_no_answer=exs.skip_no_answer)
+    if args.cache_dir:
+        logger.warning('Example cache does not hold character inputs, '
+                       'vectorizing on the fly.')
+    return data.ReaderDataset(exs(), model, single_answer=single_answer)
+
+
+def make_loader(args, dataset, batch_size, max_tokens, train):
+    """Batch by token budget if max_tokens, else by a fixed batch_size."""
+    # Without workers, batches are used one at a time: recycle their memory.
+    collate_fn = vector.BatchCollator(reuse_buffers=args.data_workers == 0)
+    if max_tokens > 0:
+        batch_sampler = data.TokenBudgetBatchSampler(dataset.lengths(),
+                                                     max_tokens,
+                                                     shuffle=train)
+        data.log_padding_efficiency(batch_sampler,
+                                    'Train' if train else 'Dev')
+        return torch.utils.data.DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            num_workers=args.data_workers,
+            collate_fn=collate_fn,
+            pin_memory=args.cuda,
+        )
+    if args.sort_by_len:
+        sampler = data.SortedBatchSampler(dataset.lengths(), batch_size,
+                                          shuffle=train)
+        data.log_padding_efficiency(sampler, 'Train' if train else 'Dev')
+    elif train:
+        sampler = torch.utils.data.sampler.RandomSampler(dataset)
+    else:
+        sampler = torch.utils.data.sampler.SequentialSampler(dataset)
+    return torch.utils.data.DataLoader(
+        dataset,
+        batch_size=batch_size,
+        sampler=sampler,
+        num_workers=args.data_workers,
+        collate_fn=collate_fn,
+        pin_memory=args.cuda,
+    )
+
+
+def make_stream_loader(args, examples, model):
+    """Batches of streamed examples (by token budget if args.max_tokens),
+    read by the data workers if possible.
+    """
+    dataset = stream.ShardedReaderDataset(examples, model, args.batch_size,
+                                          buffer_size=args.shuffle_buffer,
+                                          single_answer=True,
+                                          max_tokens=args.max_tokens)
+    if args.data_workers == 0 or not stream.HAS_ITERABLE_DATASET:
+        return dataset
+    return torch.utils.data.DataLoader(
+        dataset,
+        batch_size=None,
+        num_workers=args.data_workers,
+        pin_memory=args.cuda,
+    )
+
+
 def main(args):
     # --------------------------------------------------------------------------
     # DATA
     logger.info('-' * 100)
     logger.info('Load data files')
-    # load data directly
-    train_exs = utils.load_data(args, args.train_file, skip_no_answer=True)
-    logger.info('Num train examples = %d' % len(train_exs))
-    dev_exs = utils.load_data(args, args.dev_file)
-    logger.info('Num dev examples = %d' % len(dev_exs))
+    if args.train_sources:
+        # stream train data (iterated over instead of loaded)
+        sources = stream.parse_sources(args.train_sources, args.data_dir)
+        train_exs = stream.ExampleStream(sources, args, skip_no_answer=True,
+                                         epoch_size=args.epoch_size)
+        for files, weight in sources:
+            logger.info('Streaming train source: %d shard(s) of %s, '
+                        'weight = %.2f' % (len(files), files[0], weight))
+
+        def load_train():
+            # Dictionaries are built from one full pass over every source:
+            # with epoch_size, each iteration of train_exs is a new sample.
+            return stream.ExampleStream(sources, args, skip_no_answer=True)
+    else:
+        # load data directly (when first needed)
+        load_train = LazyExamples(args, args.train_file, skip_no_answer=True)
+    load_dev = LazyExamples(args, args.dev_file)
 
     # If we are doing offician evals then we need to:
     # 1) Load the original text to retrieve spans from offsets.
     # 2) Load the (multiple) text answers for each question.
     if args.official_eval:
         dev_texts = utils.load_text_with_id(args.dev_json)  # dict with qid as key, contexts as value
-        dev_offsets = {ex['id']: ex['offsets'] for ex in dev_exs}
+        dev_offsets = {ex['id']: ex['offsets'] for ex in load_dev()}
         dev_answers = utils.load_answers(args.dev_json)  # dict with qid as key, answer as value
         dev_questions = utils.load_questions(args.dev_json)
 
@@ -439,7 +563,8 @@ def main(args):
             if args.expand_dictionary:
                 logger.info('Expanding dictionary for new data...')
                 # Add words in training + dev examples
-                words = utils.load_words(args, train_exs + dev_exs)
+                words = utils.load_words(args,
+                                         chain(load_train(), load_dev()))
                 added = model.expand_dictionary(words)
                 # Load pretrained embeddings for added words
                 if args.embedding_file:
@@ -447,7 +572,7 @@ def main(args):
 
         else:
             logger.info('Training module from scratch...')
-            model = init_from_scratch(args, train_exs, dev_exs)
+            model = init_from_scratch(args, load_train(), load_dev())
 
         # Set up partial tuning of embeddings
         if args.tune_partial > 0:
@@ -455,7 +580,7 @@ def main(args):
             logger.info('Counting %d most frequent question words' %
                         args.tune_partial)
             top_words = utils.top_question_words(
-                args, train_exs, model.word_dict
+                args, load_train(), model.word_dict
             )
             for word in top_words[:5]:
                 logger.info(word)
@@ -480,36 +605,16 @@ def main(args):
     # Two datasets: train and dev. If we sort by length it's faster.
     logger.info('-' * 100)
     logger.info('Make data loaders')
-    train_dataset = data.ReaderDataset(train_exs, model, single_answer=True)
-    if args.sort_by_len:
-        train_sampler = data.SortedBatchSampler(train_dataset.lengths(),
-                                                args.batch_size,
-                                                shuffle=True)
+    if args.train_sources:
+        train_loader = make_stream_loader(args, train_exs, model)
     else:
-        train_sampler = torch.utils.data.sampler.RandomSampler(train_dataset)
-    train_loader = torch.utils.data.DataLoader(
-        train_dataset,
-        batch_size=args.batch_size,
-        sampler=train_sampler,
-        num_workers=args.data_workers,
-        collate_fn=vector.batchify,
-        pin_memory=args.cuda,
-    )
-    dev_dataset = data.ReaderDataset(dev_exs, model, single_answer=False)
-    if args.sort_by_len:
-        dev_sampler = data.SortedBatchSampler(dev_dataset.lengths(),
-                                              args.test_batch_size,
-                                              shuffle=False)
-    else:
-        dev_sampler = torch.utils.data.sampler.SequentialSampler(dev_dataset)
-    dev_loader = torch.utils.data.DataLoader(
-        dev_dataset,
-        batch_size=args.test_batch_size,
-        sampler=dev_sampler,
-        num_workers=args.data_workers,
-        collate_fn=vector.batchify,
-        pin_memory=args.cuda,
-    )
+        train_dataset = make_dataset(args, load_train, model,
+                                     single_answer=True)
+        train_loader = make_loader(args, train_dataset, args.batch_size,
+                                   args.max_tokens, train=True)
+    dev_dataset = make_dataset(args, load_dev, model, single_answer=False)
+    dev_loader = make_loader(args, dev_dataset, args.test_batch_size,
+                             args.test_max_tokens, train=False)
 
     # -------------------------------------------------------------------------
     # PRINT CONFIG
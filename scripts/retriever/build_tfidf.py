@@ -102,19 +102,30 @@ def get_count_matrix(args, db, db_opts):
         initializer=init,
         initargs=(tok_class, db_class, db_opts)
     )
+    scheduler = tokenizers.SizeAwareScheduler(workers, args.num_workers)
+
+    # Longest documents are dispatched first, so that a few huge articles
+    # don't end up pinning single workers at the end of a batch.
+    with db_class(**db_opts) as doc_db:
+        doc_lens = doc_db.get_doc_lengths()
+    ordered_ids = sorted(doc_ids, key=lambda d: -(doc_lens.get(d) or 0))
 
     # Compute the count matrix in steps (to keep in memory)
     logger.info('Mapping...')
     row, col, data = [], [], []
     step = max(int(len(doc_ids) / 10), 1)
-    batches = [doc_ids[i:i + step] for i in range(0, len(doc_ids), step)]
+    batches = [ordered_ids[i:i + step]
+               for i in range(0, len(ordered_ids), step)]
     _count = partial(count, args.ngram, args.hash_size)
     for i, batch in enumerate(batches):
         logger.info('-' * 25 + 'Batch %d/%d' % (i + 1, len(batches)) + '-' * 25)
-        for b_row, b_col, b_data in workers.imap_unordered(_count, batch):
+        sizes = [doc_lens.get(d) or 0 for d in batch]
+        for _, (b_row, b_col, b_data) in scheduler.imap_unordered(
+                _count, batch, sizes):
             row.extend(b_row)
             col.extend(b_col)
             data.extend(b_data)
+    scheduler.log_utilization()
     workers.close()
     workers.join()
 